@@ -0,0 +1,193 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+"""
+Async Sampling Profiler
+
+Low-overhead, asyncio-aware sampling profiler used by the orchestrator (step_*
+coroutines) and by the generated MCP server (*_impl functions).
+
+A background thread wakes up HZ times per second and, for every profiled scope
+(a coroutine wrapped with AsyncSamplingProfiler.wrap), records one sample:
+
+- the Python stack of the event loop thread when the scope's task is running
+  (agent framework, JSON handling, MCP transport code...), or
+- the await chain of the task when it is suspended, ending in the awaited
+  object (e.g. "<await Future>"), so time spent waiting on the backend or on
+  the MCP stdio pipe shows up as well.
+
+Samples are written per scope as collapsed stacks ("frame;frame;frame count"),
+the input format of flamegraph.pl, speedscope and inferno:
+
+    profiles/<label>_<timestamp>_<pid>/step_1_get_customer_invoices.collapsed
+
+Files are rewritten every FLUSH_SECONDS with the cumulative counts, so a process
+that is killed (as MCP stdio servers usually are) still leaves its profile behind.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import functools
+import threading
+from collections import Counter
+
+DEFAULT_HZ = 19
+FLUSH_SECONDS = 30
+MAX_DEPTH = 64
+
+
+def _is_wrapper(code):
+    return code.co_name == "profiled" and code.co_filename == __file__
+
+
+def _frame_label(code, lineno):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{lineno})".replace(";", ",")
+
+
+def _task_stack(frame, coro_frame):
+    """Running task: frames from the task's coroutine down to the innermost frame."""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        if not _is_wrapper(frame.f_code):
+            stack.append(_frame_label(frame.f_code, frame.f_lineno))
+        if frame is coro_frame:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_chain(coro):
+    """Suspended task: the chain of coroutines it is awaiting, ending in the awaited object."""
+    stack = []
+    while coro is not None and len(stack) < MAX_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            stack.append(f"<await {type(coro).__name__}>")
+            break
+        if not _is_wrapper(frame.f_code):
+            stack.append(_frame_label(frame.f_code, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+class AsyncSamplingProfiler:
+    """Samples the event loop thread and attributes each sample to the active scopes."""
+
+    def __init__(self, label, hz=DEFAULT_HZ, output_dir="profiles"):
+        self.label = label
+        self.interval = 1.0 / max(hz, 0.1)
+        self.output_dir = os.path.join(output_dir, f"{label}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+        self.samples = {}
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, label, prefix, enabled=False):
+        """
+        Build a profiler from <prefix>_PROFILE (true or a sampling rate in Hz),
+        <prefix>_PROFILE_HZ and <prefix>_PROFILE_DIR; None when profiling is off.
+        """
+        setting = os.getenv(f"{prefix}_PROFILE", "false").strip().lower()
+        if setting in ("", "0", "false", "no", "off") and not enabled:
+            return None
+        try:
+            hz = float(setting)
+        except ValueError:
+            hz = float(os.getenv(f"{prefix}_PROFILE_HZ", str(DEFAULT_HZ)))
+        return cls(label, hz, os.getenv(f"{prefix}_PROFILE_DIR", "profiles"))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.label}-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and write the final collapsed-stack files."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def wrap(self, name, func):
+        """Profile every await of the coroutine function func under the scope name."""
+
+        @functools.wraps(func)
+        async def profiled(*args, **kwargs):
+            task = asyncio.current_task()
+            if task is None:
+                return await func(*args, **kwargs)
+            if self._loop is None:
+                self._loop = asyncio.get_running_loop()
+                self._loop_thread = threading.get_ident()
+            with self._lock:
+                self._scopes.setdefault(task, []).append(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    names = self._scopes[task]
+                    names.pop()
+                    if not names:
+                        del self._scopes[task]
+
+        return profiled
+
+    def instrument(self, namespace, predicate):
+        """Wrap the coroutine functions of a class (or a module's globals()) whose names match predicate."""
+        items = namespace if isinstance(namespace, dict) else vars(namespace)
+        names = [name for name, value in items.items()
+                 if predicate(name) and asyncio.iscoroutinefunction(value)]
+        for name in names:
+            if isinstance(namespace, dict):
+                namespace[name] = self.wrap(name, namespace[name])
+            else:
+                setattr(namespace, name, self.wrap(name, getattr(namespace, name)))
+        return names
+
+    def _sample(self):
+        if self._loop is None:
+            return
+        frame = sys._current_frames().get(self._loop_thread)
+        running = asyncio.current_task(self._loop) if frame is not None else None
+        with self._lock:
+            scopes = [(task, names[-1]) for task, names in self._scopes.items()]
+        for task, name in scopes:
+            coro = task.get_coro()
+            if task is running:
+                stack = _task_stack(frame, getattr(coro, "cr_frame", None))
+            else:
+                stack = _await_chain(coro)
+            if stack:
+                self.samples.setdefault(name, Counter())[";".join(stack)] += 1
+
+    def _run(self):
+        next_flush = time.monotonic() + FLUSH_SECONDS
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                # The loop mutates tasks while we look at them; drop the sample
+                continue
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + FLUSH_SECONDS
+
+    def flush(self):
+        """Write one <scope>.collapsed file per profiled scope with the cumulative counts."""
+        if not self.samples:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, counts in list(self.samples.items()):
+            path = os.path.join(self.output_dir, f"{name}.collapsed")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                for stack, count in sorted(counts.items()):
+                    f.write(f"{stack} {count}\n")
+            os.replace(path + ".tmp", path)
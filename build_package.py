@@ -4,12 +4,77 @@ Programmatically creates all required files for a complete Python package
 """
 
 import os
+import sys
 import json
+import shutil
+import zipapp
+import tempfile
+import compileall
 from datetime import datetime
-from pathlib import Path
 
-def create_package_structure():
-    """Create complete package structure with all required files."""
+# Entry point of the server zipapp; the server itself ships as bytecode only
+ZIPAPP_MAIN = """import runpy
+runpy.run_module("telefonica_mcp_server", run_name="__main__", alter_sys=True)
+"""
+
+
+def build_server_zipapp(base_path, strip=False):
+    """
+    Bundle the generated server (plus async_profiler.py for MCP_PROFILE) into
+    telefonica_mcp_server.pyz. The client is not included: it runs in the orchestrator
+    process, never in a spawned server.
+
+    The modules are precompiled to legacy .pyc files (no .py sources, no __pycache__
+    lookups) and stored uncompressed, so a spawn only unmarshals bytecode. strip=True
+    compiles with optimize=2, dropping docstrings and asserts. The import set is kept
+    minimal by the generated server itself: async_profiler and the HTTP transport
+    (uvicorn, starlette) are only imported when enabled.
+    Returns build information for build_metadata.json, or None if there is no server.
+    """
+    modules = [name for name in ("telefonica_mcp_server.py", "async_profiler.py")
+               if os.path.exists(os.path.join(base_path, name))]
+    if "telefonica_mcp_server.py" not in modules:
+        return None
+    
+    archive_path = os.path.join(base_path, "telefonica_mcp_server.pyz")
+    staging_dir = tempfile.mkdtemp(prefix="zipapp_")
+    try:
+        for name in modules:
+            shutil.copy2(os.path.join(base_path, name), staging_dir)
+        
+        optimize = 2 if strip else 0
+        # co_filename points into the archive, not at the staging dir deleted below
+        if not compileall.compile_dir(staging_dir, ddir=archive_path, quiet=1, legacy=True, optimize=optimize):
+            raise RuntimeError("could not compile the server to bytecode")
+        for name in modules:
+            os.remove(os.path.join(staging_dir, name))
+        
+        with open(os.path.join(staging_dir, "__main__.py"), 'w', encoding='utf-8') as f:
+            f.write(ZIPAPP_MAIN)
+        
+        zipapp.create_archive(staging_dir, target=archive_path, compressed=False)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    return {
+        "archive": os.path.basename(archive_path),
+        "size_bytes": os.path.getsize(archive_path),
+        "modules": modules,
+        "stripped": strip,
+        # .pyc files only load on the interpreter version that built them
+        "python_version": f"{sys.version_info.major}.{sys.version_info.minor}"
+    }
+
+
+def measure_cold_start(server_path):
+    """Cold start of a server (source or .pyz) in ms, measured with mcp_server_benchmark."""
+    from mcp_server_benchmark import run_benchmark
+    
+    return round(run_benchmark(server_path, calls_per_tool=1)["cold_start_ms"], 1)
+
+
+def create_package_structure(strip_zipapp=False):
+    """Create complete package structure with all required files. Returns False if the zipapp is broken."""
     
     base_path = r"C:\TelefonicaProcessAgent\Data\SourceDesigned"
     package_name = "telefonica_mcp_orchestrator"
@@ -21,7 +86,7 @@ def create_package_structure():
     print(f"Package name: {package_name}\n")
     
     # Step 1: Create .env file
-    print("[1/6] Creating .env file...")
+    print("[1/7] Creating .env file...")
     env_content = """# Azure OpenAI Configuration
 AZURE_OPENAI_ENDPOINT=https://workshopopenaisw.openai.azure.com/
 AZURE_OPENAI_API_KEY=your-api-key-here
@@ -47,7 +112,7 @@ TEST_MSISIDN=56987654321
     print(f"   ✓ Created: {env_path}")
     
     # Step 2: Create requirements.txt
-    print("\n[2/6] Creating requirements.txt...")
+    print("\n[2/7] Creating requirements.txt...")
     requirements_content = """# Core dependencies
 httpx>=0.27.0
 python-dotenv>=1.0.0
@@ -66,6 +131,8 @@ azure-identity>=1.15.0
 
 # Utilities
 pydantic>=2.0.0
+orjson>=3.9.0  # optional fast JSON codec used by the server and client when installed
+numpy>=1.24.0  # invoice_column_store analytics (a pure-Python fallback runs without it)
 """
     
     req_path = os.path.join(base_path, "requirements.txt")
@@ -74,7 +141,7 @@ pydantic>=2.0.0
     print(f"   ✓ Created: {req_path}")
     
     # Step 3: Create README.md
-    print("\n[3/6] Creating README.md...")
+    print("\n[3/7] Creating README.md...")
     readme_content = f"""# Telefonica MCP Orchestrator
 
 Automated billing workflow orchestrator using Model Context Protocol (MCP) and Azure OpenAI.
@@ -120,6 +187,15 @@ Edit `.env` file with your credentials:
 python verify_setup.py
 ```
 
+Optional performance smoke test: spawns the MCP server against a local mock backend,
+times initialization, `list_tools` and every tool, and flags regressions against
+`perf_baseline.json` (created on the first run):
+
+```bash
+python verify_setup.py --perf
+python verify_setup.py --perf --update-baseline   # accept the current numbers
+```
+
 ## Usage
 
 ### Run Complete Workflow
@@ -175,6 +251,9 @@ SourceDesigned/
 ├── README.md                              # This file
 ├── setup_environment.py                   # Environment setup script
 ├── verify_setup.py                        # Setup verification
+├── mcp_server_benchmark.py                # Mock-backend benchmark used by verify_setup.py --perf
+├── mcp_zygote.py                          # Pre-forking server launcher (POSIX)
+├── async_profiler.py                      # Sampling profiler (TELEFONICA_PROFILE / MCP_PROFILE)
 ├── telefonica_mcp_server_*.py            # MCP server
 ├── mcp_client_deuda_fija_*.py            # Payment documents client
 ├── mcp_client_listado_de_boletas_*.py    # Invoice list client
@@ -215,7 +294,7 @@ For issues or questions, review the execution logs in `../WorkflowResults/`.
     print(f"   ✓ Created: {readme_path}")
     
     # Step 4: Create setup_environment.py
-    print("\n[4/6] Creating setup_environment.py...")
+    print("\n[4/7] Creating setup_environment.py...")
     setup_env_content = """\"\"\"
 Environment Setup Script for Telefonica MCP Orchestrator
 Automates creation and configuration of Python virtual environment
@@ -324,7 +403,7 @@ if __name__ == "__main__":
     print(f"   ✓ Created: {setup_path}")
     
     # Step 5: Create verify_setup.py
-    print("\n[5/6] Creating verify_setup.py...")
+    print("\n[5/7] Creating verify_setup.py...")
     verify_content = """\"\"\"
 Setup Verification Script
 Checks all dependencies and configuration before running orchestrator
@@ -332,6 +411,7 @@ Checks all dependencies and configuration before running orchestrator
 
 import os
 import sys
+import json
 from pathlib import Path
 
 def check_file_exists(filepath, description):
@@ -363,7 +443,48 @@ def check_import(module_name):
         print(f"  ✗ {module_name} - NOT INSTALLED")
         return False
 
-def verify_setup():
+def check_performance(base_path, update_baseline=False):
+    \"\"\"
+    Spawn the MCP server against a local mock backend, time initialization, list_tools
+    and every tool, and compare the numbers with perf_baseline.json.
+    \"\"\"
+    try:
+        from mcp_server_benchmark import run_benchmark, compare_reports, print_report
+    except ImportError as e:
+        print(f"  ✗ Cannot run benchmark: {e}")
+        return False
+    
+    server_path = os.getenv("MCP_SERVER_PATH") or str(base_path / "telefonica_mcp_server.py")
+    if not os.path.exists(server_path):
+        print(f"  ✗ MCP server not found: {server_path}")
+        return False
+    
+    try:
+        report = run_benchmark(server_path, calls_per_tool=int(os.getenv("MCP_PERF_CALLS_PER_TOOL", "3")))
+    except Exception as e:
+        print(f"  ✗ Benchmark failed: {e}")
+        return False
+    print_report(report)
+    if report["errors"]:
+        return False
+    
+    baseline_path = base_path / "perf_baseline.json"
+    if update_baseline or not baseline_path.exists():
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"  ✓ Baseline saved to {baseline_path.name}")
+        return True
+    
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_reports(report, baseline, float(os.getenv("MCP_PERF_MAX_SLOWDOWN", "1.5")))
+    for regression in regressions:
+        print(f"  ✗ Regression - {regression}")
+    if not regressions:
+        print("  ✓ No regressions against baseline")
+    return not regressions
+
+def verify_setup(perf=False, update_baseline=False):
     \"\"\"Run complete verification of setup.\"\"\"
     
     print("=" * 80)
@@ -397,7 +518,7 @@ def verify_setup():
             all_checks_passed = False
     
     # Check for generated files
-    mcp_server_files = list(base_path.glob("telefonica_mcp_server_*.py"))
+    mcp_server_files = list(base_path.glob("telefonica_mcp_server*.py"))
     if mcp_server_files:
         print(f"  ✓ Found MCP server: {mcp_server_files[0].name}")
     else:
@@ -442,6 +563,12 @@ def verify_setup():
         print(f"  ✗ Python {python_version.major}.{python_version.minor} (3.10+ required)")
         all_checks_passed = False
     
+    # Check 5: Performance (optional)
+    if perf:
+        print("\\n[5] Checking MCP Server Performance (mock backend)...")
+        if not check_performance(base_path, update_baseline):
+            all_checks_passed = False
+    
     # Summary
     print("\\n" + "=" * 80)
     if all_checks_passed:
@@ -460,7 +587,15 @@ def verify_setup():
     return all_checks_passed
 
 if __name__ == "__main__":
-    success = verify_setup()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Verify the Telefonica MCP orchestrator setup")
+    parser.add_argument("--perf", action="store_true",
+                        help="benchmark the MCP server against a mock backend and compare with perf_baseline.json")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="with --perf, store the measured numbers as the new baseline")
+    args = parser.parse_args()
+    success = verify_setup(perf=args.perf, update_baseline=args.update_baseline)
     sys.exit(0 if success else 1)
 """
     
@@ -469,25 +604,84 @@ if __name__ == "__main__":
         f.write(verify_content)
     print(f"   ✓ Created: {verify_path}")
     
-    # Step 6: Create build metadata
-    print("\n[6/6] Creating build metadata...")
-    
-    # Find latest generated files
-    mcp_server_files = list(Path(base_path).glob("telefonica_mcp_server_*.py"))
-    client_files = list(Path(base_path).glob("mcp_client_*.py"))
-    orchestrator_files = list(Path(base_path).glob("process_orchestrator_main.py"))
+    # verify_setup.py --perf runs the same benchmark as the server generator's staging check;
+    # mcp_zygote.py is the pre-forking launcher used when MCP_ZYGOTE_SOCKET is set;
+    # async_profiler.py is imported by the orchestrator and by servers run with MCP_PROFILE
+    for helper in ("mcp_server_benchmark.py", "mcp_zygote.py", "async_profiler.py"):
+        helper_path = os.path.join(base_path, helper)
+        shutil.copy2(os.path.join(os.path.dirname(os.path.abspath(__file__)), helper), helper_path)
+        print(f"   ✓ Copied: {helper_path}")
+    
+    # Step 6: Bundle the server into a precompiled zipapp
+    print("\n[6/7] Building server zipapp...")
+    zipapp_info = None
+    zipapp_ok = True
+    try:
+        zipapp_info = build_server_zipapp(base_path, strip=strip_zipapp)
+        if zipapp_info is None:
+            print("   ⚠ telefonica_mcp_server.py not found - run mcp_servers_generator.py first")
+        else:
+            archive_path = os.path.join(base_path, zipapp_info["archive"])
+            print(f"   ✓ Created: {archive_path} ({zipapp_info['size_bytes']} bytes)")
+            
+            # The archive must actually start: a server that crashes on import is not shipped as usable
+            try:
+                zipapp_info["cold_start_ms"] = measure_cold_start(archive_path)
+            except Exception as e:
+                zipapp_ok = False
+                print(f"   ✗ The zipapp does not start: {e!r}")
+            if zipapp_ok:
+                try:
+                    zipapp_info["source_cold_start_ms"] = measure_cold_start(
+                        os.path.join(base_path, "telefonica_mcp_server.py")
+                    )
+                except Exception as e:
+                    print(f"   ⚠ Could not measure the source cold start: {e}")
+                print(f"   ✓ Cold start: {zipapp_info['cold_start_ms']} ms "
+                      f"(source: {zipapp_info.get('source_cold_start_ms')} ms)")
+                print(f"   Use it with: MCP_SERVER_PATH={archive_path}")
+            zipapp_info["cold_start_ok"] = zipapp_ok
+    except Exception as e:
+        zipapp_ok = False
+        print(f"   ✗ Error building zipapp: {e}")
+    
+    # Step 7: Create build metadata
+    print("\n[7/7] Creating build metadata...")
+    
+    # Generated files, by name: shard servers come from the manifest written by --shards
+    def existing(*names):
+        return [name for name in names if os.path.exists(os.path.join(base_path, name))]
+    
+    shard_servers = []
+    manifest_path = os.path.join(base_path, "telefonica_mcp_shards.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            shard_servers = [shard["server"] for shard in json.load(f).get("shards", {}).values()]
+    
+    server_archive = None
+    if zipapp_info is not None:
+        server_archive = {
+            "file": zipapp_info["archive"],
+            "cold_start_ms": zipapp_info.get("cold_start_ms"),
+            "cold_start_ok": zipapp_info.get("cold_start_ok", False),
+            "source_cold_start_ms": zipapp_info.get("source_cold_start_ms")
+        }
     
     build_metadata = {
         "package_name": package_name,
         "build_date": datetime.now().isoformat(),
         "base_path": base_path,
         "components": {
-            "mcp_server": [f.name for f in mcp_server_files],
-            "mcp_clients": [f.name for f in client_files],
-            "orchestrator": [f.name for f in orchestrator_files]
+            "mcp_server": existing("telefonica_mcp_server.py"),
+            "mcp_shard_servers": existing(*shard_servers),
+            "mcp_server_archive": server_archive,
+            "mcp_clients": existing("telefonica_mcp_client.py"),
+            "orchestrator": existing("process_orchestrator_main.py")
         },
         "configuration_files": [".env", "requirements.txt", "README.md"],
-        "setup_scripts": ["setup_environment.py", "verify_setup.py"]
+        "setup_scripts": ["setup_environment.py", "verify_setup.py", "mcp_server_benchmark.py", "mcp_zygote.py",
+                          "async_profiler.py"],
+        "zipapp": zipapp_info
     }
     
     metadata_path = os.path.join(base_path, "build_metadata.json")
@@ -497,6 +691,10 @@ if __name__ == "__main__":
     
     # Final Summary
     print("\n" + "=" * 80)
+    if not zipapp_ok:
+        print("✗ PACKAGE BUILD FAILED - telefonica_mcp_server.pyz is not usable")
+        print("=" * 80)
+        return False
     print("✓ PACKAGE BUILD COMPLETE")
     print("=" * 80)
     print(f"\nPackage location: {base_path}")
@@ -507,6 +705,13 @@ if __name__ == "__main__":
     print(f"  4. python verify_setup.py")
     print(f"  5. python process_orchestrator_main.py")
     print("\n" + "=" * 80)
+    return True
 
 if __name__ == "__main__":
-    create_package_structure()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Build the Telefonica MCP orchestrator package")
+    parser.add_argument("--strip", action="store_true",
+                        help="compile the server zipapp with -OO (no docstrings or asserts)")
+    args = parser.parse_args()
+    sys.exit(0 if create_package_structure(strip_zipapp=args.strip) else 1)
@@ -0,0 +1,151 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+"""
+Invoice Column Store
+
+Accumulates the implInvoiceLists of every processed customer in typed columns
+(array module) instead of nested dicts:
+
+    amount         float64   totalAmount
+    status         int8      invoiceStatusInd code (see STATUS_CODES)
+    due_date       int32     dueDate as a date ordinal (MISSING_DATE when absent)
+    document_type  int8      documentType code (see DOCUMENT_TYPE_CODES)
+    customer_id    int64     customer account id
+
+Portfolio analytics run as whole-column passes; NumPy is used when installed
+(zero-copy views of the arrays), otherwise the same passes run over the arrays.
+"""
+
+from array import array
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STATUS_CODES = {"O": 0, "P": 1}
+DOCUMENT_TYPE_CODES = {"CY": 0}
+UNKNOWN_CODE = -1
+MISSING_DATE = -1
+
+# Aging buckets for open debt, in days past due (upper bound inclusive)
+AGING_BUCKETS = (
+    ("not_due", 0),
+    ("1_30", 30),
+    ("31_60", 60),
+    ("61_90", 90),
+    ("over_90", None)
+)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _to_ordinal(value):
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return MISSING_DATE
+
+
+class InvoiceColumnStore:
+    """Columnar accumulator of invoices across a batch of customers."""
+
+    def __init__(self):
+        self.amount = array("d")
+        self.status = array("b")
+        self.due_date = array("i")
+        self.document_type = array("b")
+        self.customer_id = array("q")
+
+    def __len__(self):
+        return len(self.amount)
+
+    def append_customer(self, customer_id, invoice_data):
+        """Append every invoice of one customer's implInvoiceLists response; return how many."""
+        invoices = invoice_data.get("implInvoiceLists") or []
+        for invoice in invoices:
+            self.amount.append(_to_float(invoice.get("totalAmount")))
+            self.status.append(STATUS_CODES.get(invoice.get("invoiceStatusInd"), UNKNOWN_CODE))
+            self.due_date.append(_to_ordinal(invoice.get("dueDate")))
+            self.document_type.append(DOCUMENT_TYPE_CODES.get(invoice.get("documentType"), UNKNOWN_CODE))
+        self.customer_id.extend([int(customer_id)] * len(invoices))
+        return len(invoices)
+
+    def analytics(self, as_of=None):
+        """
+        Batch-wide portfolio figures: total and open debt, aging buckets of the open
+        debt relative to as_of (default today) and the share of cyclic invoices.
+        """
+        as_of = (as_of or date.today()).toordinal()
+        if np is not None:
+            return self._analytics_numpy(as_of)
+        return self._analytics_array(as_of)
+
+    def _analytics_numpy(self, as_of):
+        amount = np.frombuffer(self.amount, dtype=np.float64)
+        status = np.frombuffer(self.status, dtype=np.int8)
+        due_date = np.frombuffer(self.due_date, dtype=np.int32)
+        document_type = np.frombuffer(self.document_type, dtype=np.int8)
+        customer_id = np.frombuffer(self.customer_id, dtype=np.int64)
+
+        is_open = status == STATUS_CODES["O"]
+        open_amount = amount[is_open]
+        days_past_due = as_of - due_date[is_open].astype(np.int64)
+        has_date = due_date[is_open] != MISSING_DATE
+
+        aging = {}
+        lower = None
+        for name, upper in AGING_BUCKETS:
+            in_bucket = has_date.copy()
+            if lower is not None:
+                in_bucket &= days_past_due > lower
+            if upper is not None:
+                in_bucket &= days_past_due <= upper
+            aging[name] = float(open_amount[in_bucket].sum())
+            lower = upper
+        aging["no_due_date"] = float(open_amount[~has_date].sum())
+
+        total = len(amount)
+        return {
+            "invoices": total,
+            "customers": int(np.unique(customer_id).size),
+            "total_amount": float(amount.sum()),
+            "open_invoices": int(is_open.sum()),
+            "open_debt": float(open_amount.sum()),
+            "aging": aging,
+            "cyclic_share": float((document_type == DOCUMENT_TYPE_CODES["CY"]).sum()) / total if total else 0.0
+        }
+
+    def _analytics_array(self, as_of):
+        open_code = STATUS_CODES["O"]
+        open_rows = [(amount, due_date) for amount, status, due_date
+                     in zip(self.amount, self.status, self.due_date) if status == open_code]
+
+        aging = {name: 0.0 for name, _ in AGING_BUCKETS}
+        aging["no_due_date"] = 0.0
+        for amount, due_date in open_rows:
+            if due_date == MISSING_DATE:
+                aging["no_due_date"] += amount
+                continue
+            days_past_due = as_of - due_date
+            for name, upper in AGING_BUCKETS:
+                if upper is None or days_past_due <= upper:
+                    aging[name] += amount
+                    break
+
+        total = len(self.amount)
+        return {
+            "invoices": total,
+            "customers": len(set(self.customer_id)),
+            "total_amount": sum(self.amount),
+            "open_invoices": len(open_rows),
+            "open_debt": sum(amount for amount, _ in open_rows),
+            "aging": aging,
+            "cyclic_share": self.document_type.count(DOCUMENT_TYPE_CODES["CY"]) / total if total else 0.0
+        }
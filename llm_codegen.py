@@ -0,0 +1,162 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+"""
+LLM Code Generation Helpers
+
+Shared by mcp_servers_generator.py and mcp_client_generator.py:
+1. Streams chat completions and shows progress as tokens arrive
+2. Detects replies cut off at max_tokens (finish_reason == "length") and asks the
+   model to continue until the code is complete
+3. Retries transient Azure OpenAI errors with exponential backoff
+"""
+
+import os
+import sys
+import time
+import random
+import openai
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Errors worth retrying: network failures, timeouts, throttling and 5xx responses
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError
+)
+
+CONTINUATION_PROMPT = (
+    "Your previous reply was cut off. Continue EXACTLY where it stopped: do not repeat "
+    "any earlier line, do not restart the file and do not add markdown fences."
+)
+
+
+# tiktoken encoder, loaded on first use
+_encoding = None
+
+
+def estimate_tokens(text):
+    """Count prompt tokens with tiktoken when installed, otherwise approximate (~4 chars per token)."""
+
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def strip_code_fences(text):
+    """Return the code inside the first markdown code fence, or the text unchanged."""
+
+    if "```python" in text:
+        return text.split("```python")[1].split("```")[0].strip()
+    if "```" in text:
+        return text.split("```")[1].split("```")[0].strip()
+    return text
+
+
+def _stream_once(client, deployment_name, messages, temperature, max_tokens):
+    """Stream one completion; return (text, finish_reason, usage or None)."""
+
+    stream = client.chat.completions.create(
+        model=deployment_name,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    parts = []
+    finish_reason = None
+    usage = None
+    received = 0
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta is not None and choice.delta.content:
+            parts.append(choice.delta.content)
+            received += len(choice.delta.content)
+            if len(parts) % 25 == 0:
+                sys.stdout.write(f"\r   ⏳ Received {received} characters...")
+                sys.stdout.flush()
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+
+    sys.stdout.write(f"\r   ✓ Received {received} characters ({finish_reason})\n")
+    return "".join(parts), finish_reason, usage
+
+
+def _stream_with_retries(client, deployment_name, messages, temperature, max_tokens, max_retries):
+    """Run _stream_once, retrying transient errors with exponential backoff and jitter."""
+
+    for attempt in range(max_retries + 1):
+        try:
+            return _stream_once(client, deployment_name, messages, temperature, max_tokens)
+        except TRANSIENT_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = min(60.0, 2.0 ** attempt) + random.uniform(0, 1)
+            print(f"\n   ⚠ Transient Azure OpenAI error ({type(e).__name__}) - retrying in {delay:.1f}s "
+                  f"({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+def generate_code(client, deployment_name, messages, temperature=0.3, max_tokens=4000,
+                  max_continuations=None, max_retries=None):
+    """
+    Generate code with a streamed chat completion, continuing truncated replies.
+
+    Returns (code, usage) where usage sums prompt, completion and total tokens over
+    every request and records how many continuations were needed.
+    """
+
+    if max_continuations is None:
+        max_continuations = int(os.getenv("LLM_MAX_CONTINUATIONS", "4"))
+    if max_retries is None:
+        max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+    conversation = list(messages)
+    reply_parts = []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "continuations": 0}
+
+    for request_index in range(max_continuations + 1):
+        text, finish_reason, request_usage = _stream_with_retries(
+            client, deployment_name, conversation, temperature, max_tokens, max_retries
+        )
+
+        # A continuation sometimes reopens the code fence; drop that line before joining
+        if request_index > 0 and text.lstrip().startswith("```"):
+            text = text.lstrip().split("\n", 1)[-1]
+        reply_parts.append(text)
+
+        if request_usage is not None:
+            usage["prompt_tokens"] += request_usage.prompt_tokens
+            usage["completion_tokens"] += request_usage.completion_tokens
+        else:
+            usage["prompt_tokens"] += sum(estimate_tokens(message["content"]) for message in conversation)
+            usage["completion_tokens"] += estimate_tokens(text)
+
+        if finish_reason != "length":
+            break
+
+        usage["continuations"] += 1
+        print(f"   ⚠ Reply truncated at max_tokens - requesting continuation "
+              f"{usage['continuations']}/{max_continuations}")
+        conversation += [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": CONTINUATION_PROMPT}
+        ]
+    else:
+        raise RuntimeError(f"reply still truncated after {max_continuations} continuations")
+
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return strip_code_fences("".join(reply_parts)), usage
@@ -2,9 +2,15 @@
 
 import os
 import json
+import re
 import ast
+import math
+import inspect
+import keyword
+import unicodedata
 from openai import AzureOpenAI
 from dotenv import load_dotenv
+from llm_codegen import generate_code, estimate_tokens
 
 # Load environment variables
 load_dotenv()
@@ -14,102 +20,832 @@ MCP Client Generator
 
 This script:
 1. Reads the telefonica_mcp_server.py Python code
-2. Extracts all methods/tools from the MCP server
-3. Generates ONE unified MCP client with methods for each server tool
+2. Extracts all tools (name, description, inputSchema) from the MCP server with one ast pass
+3. Generates ONE unified MCP client with methods for each server tool, rendered from
+   the schemas (default) or written by Azure OpenAI (MCP_CLIENT_GENERATION_MODE=llm sends
+   the server source, llm-compact only the minified tool schemas)
 4. Uses unique names (no timestamps)
 """
 
 
-def extract_tools_from_mcp_server(server_code):
+# Configuration and agent setup shared by every generated client. The template
+# renderer emits it verbatim and the LLM prompt shows it as the EXACT STRUCTURE.
+CLIENT_RUNTIME_TEMPLATE = '''import os
+import re
+import json
+import math
+import time
+import asyncio
+import inspect
+import secrets
+import contextvars
+import unicodedata
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from typing import Any
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from mcp import ClientSession
+from agent_framework import ChatAgent, MCPStdioTool, MCPStreamableHTTPTool
+from agent_framework.azure import AzureOpenAIChatClient
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Load environment variables
+load_dotenv()
+
+# First ```json (or bare ```) fenced block anywhere in an agent reply
+_JSON_FENCE = re.compile(r"```(?:json)?[ \\t]*\\n?(.*?)```", re.DOTALL)
+
+def parse_response_text(text: str) -> dict:
+    """Parse a tool response once (orjson when installed), falling back to the first ```json fence in it."""
+    loads = orjson.loads if orjson is not None else json.loads
+    try:
+        return loads(text.strip())
+    except ValueError:
+        pass
+    # Agents often wrap the JSON in prose ("Here is the result: ```json ... ```")
+    fence = _JSON_FENCE.search(text)
+    if fence:
+        try:
+            return loads(fence.group(1).strip())
+        except ValueError:
+            pass
+    return {"raw_response": text, "success": True}
+
+# ============================================================================
+# TRACE CONTEXT - W3C traceparent shared by orchestrator, client, MCP server and backend
+# ============================================================================
+
+# Spans are appended as JSON lines; tracing (and propagation) is off when empty
+TRACE_FILE = os.getenv("TELEFONICA_TRACE_FILE", "").strip()
+
+_traceparent = contextvars.ContextVar("traceparent", default=None)
+
+def new_traceparent() -> str | None:
+    """Start a new trace (e.g. one per customer workflow); None when tracing is off."""
+    return f"00-{secrets.token_hex(16)}-{secrets.token_hex(8)}-01" if TRACE_FILE else None
+
+def current_traceparent() -> str | None:
+    """traceparent of the innermost open span."""
+    return _traceparent.get()
+
+def write_span(record: dict):
+    """Append one span to TRACE_FILE (shared by every process of the workflow)."""
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, separators=(",", ":")) + "\\n")
+
+@contextmanager
+def trace_span(name: str, traceparent: str | None = None, service: str = "client", **attributes):
+    """Record a span under traceparent (default: the current span) and yield its own traceparent."""
+    parent = traceparent or _traceparent.get()
+    if not TRACE_FILE or not parent:
+        yield parent
+        return
+    _, trace_id, parent_id, _ = parent.split("-")
+    span_id = secrets.token_hex(8)
+    token = _traceparent.set(f"00-{trace_id}-{span_id}-01")
+    start = time.time()
+    try:
+        yield _traceparent.get()
+    except BaseException as e:
+        attributes["error"] = repr(e)
+        raise
+    finally:
+        _traceparent.reset(token)
+        write_span({
+            "trace_id": trace_id, "span_id": span_id, "parent_id": parent_id, "name": name,
+            "service": service, "pid": os.getpid(), "start": start,
+            "duration_ms": round((time.time() - start) * 1000, 3), "attributes": attributes
+        })
+
+def _propagate_trace_context():
+    """Send the current traceparent in the _meta of every MCP tools/call and time the round trip."""
+    call_tool = ClientSession.call_tool
+    supports_meta = "meta" in inspect.signature(call_tool).parameters
+    
+    async def traced_call_tool(self, name, arguments=None, *args, **kwargs):
+        with trace_span(f"mcp.call_tool {name}") as traceparent:
+            if traceparent and supports_meta and kwargs.get("meta") is None:
+                kwargs["meta"] = {"traceparent": traceparent}
+            return await call_tool(self, name, arguments, *args, **kwargs)
+    
+    ClientSession.call_tool = traced_call_tool
+
+if TRACE_FILE:
+    _propagate_trace_context()
+
+# Configuration
+# MCP_SERVER_PATH may point at the precompiled telefonica_mcp_server.pyz built by build_package.py
+MCP_SERVER_PATH = os.getenv(
+    "MCP_SERVER_PATH",
+    r"C:\\TelefonicaProcessAgent\\Data\\SourceDesigned\\__SERVER_FILENAME__"
+)
+PYTHON_EXECUTABLE = os.getenv("PYTHON_PATH", "python")
+# Set to e.g. http://127.0.0.1:8765/mcp/ to share one long-lived server started with --transport http
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "").strip()
+# Set to the socket of a running "mcp_zygote.py --serve" to get pre-forked server workers
+MCP_ZYGOTE_SOCKET = os.getenv("MCP_ZYGOTE_SOCKET", "").strip()
+
+# Tool router for servers generated with --shards: tool name -> shard, shard -> server file
+# (next to MCP_SERVER_PATH). Both are empty when a single server exposes every tool.
+TOOL_SHARDS = __TOOL_SHARDS__
+SHARD_SERVERS = __SHARD_SERVERS__
+
+# Local BM25 index over tool names, descriptions and parameter names, built by the client
+# generator. Agents only get the tools they need: call_* agents their own tool, the workflow
+# agent the MCP_TOOL_TOP_K best matches of its task (0 = every tool).
+TOOL_INDEX = __TOOL_INDEX__
+TOOL_TOP_K = int(os.getenv("MCP_TOOL_TOP_K", "5"))
+
+__TOOL_TOKENIZER__
+def select_tools(query: str, k: int = TOOL_TOP_K) -> list[str] | None:
+    """Names of the k tools that best match query (BM25), or None to keep every tool."""
+    if not TOOL_INDEX or k <= 0:
+        return None
+    k1, b, avgdl, idf = TOOL_INDEX["k1"], TOOL_INDEX["b"], TOOL_INDEX["avgdl"], TOOL_INDEX["idf"]
+    terms = [term for term in tokenize_tool_text(query) if term in idf]
+    scores = {}
+    for name, doc in TOOL_INDEX["docs"].items():
+        norm = k1 * (1 - b + b * doc["length"] / avgdl)
+        score = sum(idf[term] * doc["tf"][term] * (k1 + 1) / (doc["tf"][term] + norm)
+                    for term in terms if term in doc["tf"])
+        if score > 0:
+            scores[name] = score
+    # No match at all: better every tool than none
+    return sorted(scores, key=lambda name: (-scores[name], name))[:k] or None
+
+def shard_setting(name: str, shard: str) -> str:
+    """Per-shard connection setting, e.g. MCP_SERVER_URL_BILLING for the shard 'billing'."""
+    return os.getenv(f"{name}_{re.sub(r'[^0-9A-Za-z]+', '_', shard).upper()}", "").strip()
+
+async def create_mcp_tool(shard: str | None = None, allowed_tools: tuple | None = None):
+    """Create and return the MCP tool connected to the Telefonica MCP server (or one of its shards)."""
+    name = f"Telefonica API MCP Server ({shard})" if shard else "Telefonica API MCP Server"
+    # MCP_SERVER_URL and MCP_ZYGOTE_SOCKET serve one server; a shard only uses its own
+    # MCP_SERVER_URL_<SHARD> / MCP_ZYGOTE_SOCKET_<SHARD> and is spawned over stdio otherwise
+    server_url = shard_setting("MCP_SERVER_URL", shard) if shard else MCP_SERVER_URL
+    zygote_socket = shard_setting("MCP_ZYGOTE_SOCKET", shard) if shard else MCP_ZYGOTE_SOCKET
+    if server_url:
+        return MCPStreamableHTTPTool(
+            name=name,
+            url=server_url,
+            allowed_tools=allowed_tools
+        )
+    server_path = os.path.join(os.path.dirname(MCP_SERVER_PATH), SHARD_SERVERS[shard]) if shard else MCP_SERVER_PATH
+    args = [server_path]
+    if zygote_socket:
+        # Stdlib-only launcher (-I -S); runs the server directly when no zygote is listening
+        # (or when the zygote serves another server file)
+        zygote_launcher = os.path.join(os.path.dirname(MCP_SERVER_PATH), "mcp_zygote.py")
+        args = ["-I", "-S", zygote_launcher, "--connect", "--socket", zygote_socket, "--server", server_path]
+    env = os.environ.copy()
+    if current_traceparent():
+        # Parent of the server.start span only: each tools/call carries its own in _meta
+        env["TRACEPARENT"] = current_traceparent()
+    return MCPStdioTool(
+        name=name,
+        command=PYTHON_EXECUTABLE,
+        args=args,
+        env=env,
+        allowed_tools=allowed_tools
+    )
+
+# Agents are cached per tool (least recently used evicted first); each keeps its MCP
+# connection open, and all of them share one chat client and its HTTP connection pool.
+# _agent_lock only guards the cache itself: servers are spawned outside it, so agents for
+# different tools start in parallel, and an evicted agent is closed by its last user.
+AGENT_CACHE_SIZE = int(os.getenv("MCP_AGENT_CACHE_SIZE", "8"))
+
+_chat_client = None
+_agent_cache = OrderedDict()
+_agent_lock = asyncio.Lock()
+
+class _CachedAgent:
+    """A cached agent, the exit stack of its MCP connections and how many callers use it."""
+    def __init__(self):
+        self.ready = asyncio.get_running_loop().create_future()
+        self.agent = None
+        self.stack = None
+        self.users = 0
+        self.evicted = False
+
+def _fail_future(future: asyncio.Future, error: BaseException):
+    """Hand a creation failure to the callers waiting on future."""
+    if isinstance(error, Exception):
+        future.set_exception(error)
+        future.exception()  # retrieved, even when nobody else was waiting
+    else:
+        future.cancel()
+
+def get_chat_client():
+    """Return the shared Azure OpenAI chat client, creating it on first use."""
+    global _chat_client
+    if _chat_client is None:
+        _chat_client = AzureOpenAIChatClient(
+            endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview"),
+            model=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME", "gpt-4")
+        )
+    return _chat_client
+
+async def create_agent(tool_name: str, instructions: str, shards: tuple | None = None,
+                       allowed_tools: tuple | None = None, **agent_options):
     """
-    Parse the MCP server Python code and extract tool definitions.
-    Returns a list of tool information dictionaries.
+    Create an Azure OpenAI agent with the MCP tool of the tool's shard (or of each of shards).
+    The agent only sees allowed_tools (default: just tool_name when it is a server tool).
     """
-    tools = []
-    import re
+    if shards is None:
+        shards = (TOOL_SHARDS.get(tool_name),)
+    if allowed_tools is None and tool_name in TOOL_INDEX.get("docs", {}):
+        allowed_tools = (tool_name,)
+    mcp_tools = [await create_mcp_tool(shard, allowed_tools) for shard in shards]
     
-    # Find all Tool(...) definitions using a pattern that captures complete Tool objects
-    # Split by 'Tool(' but keep the delimiter
-    parts = server_code.split('Tool(')
+    return get_chat_client().create_agent(
+        name=f"Telefonica_{tool_name}_Agent",
+        instructions=instructions,
+        tools=mcp_tools,
+        **agent_options
+    )
+
+@asynccontextmanager
+async def use_agent(tool_name: str, instructions: str, **agent_options):
+    """
+    Use the cached, already connected agent for a tool, creating it if needed.
     
-    for part in parts[1:]:  # Skip first part (before first Tool)
-        try:
-            # Find the closing parenthesis for this Tool
-            # Count parentheses to find the matching closing one
-            paren_count = 1
-            end_idx = 0
-            
-            for i, char in enumerate(part):
-                if char == '(':
-                    paren_count += 1
-                elif char == ')':
-                    paren_count -= 1
-                    if paren_count == 0:
-                        end_idx = i
-                        break
-            
-            if end_idx == 0:
-                continue
-                
-            tool_content = part[:end_idx]
-            
-            # Extract name
-            name_match = re.search(r"name=['\"]([^'\"]+)['\"]", tool_content)
-            if not name_match:
+    Concurrent callers of the same tool wait for one creation; the agent is never closed
+    while a caller is still inside the block (eviction defers the close to the last one).
+    """
+    key = (tool_name, instructions, agent_options.get("shards"), agent_options.get("allowed_tools"))
+    async with _agent_lock:
+        entry = _agent_cache.get(key)
+        creating = entry is None
+        if creating:
+            entry = _agent_cache[key] = _CachedAgent()
+        else:
+            _agent_cache.move_to_end(key)
+        entry.users += 1
+    
+    try:
+        if creating:
+            try:
+                stack = AsyncExitStack()
+                with trace_span("mcp.spawn", tool=tool_name):
+                    entry.agent = await stack.enter_async_context(
+                        await create_agent(tool_name, instructions, **agent_options))
+                entry.stack = stack
+            except BaseException as e:
+                async with _agent_lock:
+                    if _agent_cache.get(key) is entry:
+                        del _agent_cache[key]
+                _fail_future(entry.ready, e)
+                raise
+            entry.ready.set_result(None)
+            await _evict_agents()
+        else:
+            await asyncio.shield(entry.ready)
+        yield entry.agent
+    finally:
+        async with _agent_lock:
+            entry.users -= 1
+            close = entry.evicted and entry.users == 0 and entry.stack is not None
+        if close:
+            await entry.stack.aclose()
+
+async def _evict_agents():
+    """Drop the least recently used agents beyond AGENT_CACHE_SIZE, closing those not in use."""
+    idle = []
+    async with _agent_lock:
+        while len(_agent_cache) > max(AGENT_CACHE_SIZE, 1):
+            _, entry = _agent_cache.popitem(last=False)
+            entry.evicted = True
+            if entry.users == 0 and entry.stack is not None:
+                idle.append(entry.stack)
+    for stack in idle:
+        await stack.aclose()
+
+async def startup_clients():
+    """Create the shared chat client up front (optional - everything is also created lazily)."""
+    get_chat_client()
+
+async def shutdown_clients():
+    """Close every cached agent and its MCP connection; call once when the process is done."""
+    global _chat_client, _stream_stack
+    async with _agent_lock:
+        while _agent_cache:
+            _, entry = _agent_cache.popitem(last=False)
+            if entry.stack is None:
                 continue
-            name = name_match.group(1)
-            
-            # Extract description
-            desc_match = re.search(r"description=['\"]([^'\"]+)['\"]", tool_content)
-            description = desc_match.group(1) if desc_match else ""
-            
-            # Extract inputSchema
-            schema_start = tool_content.find('inputSchema=')
-            if schema_start != -1:
-                schema_content = tool_content[schema_start + len('inputSchema='):]
-                
-                # Count braces to get the complete dict
-                brace_count = 0
-                end_pos = 0
-                
-                for i, char in enumerate(schema_content):
-                    if char == '{':
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            end_pos = i + 1
-                            break
-                
-                schema_str = schema_content[:end_pos]
-                
-                try:
-                    input_schema = ast.literal_eval(schema_str)
-                except Exception as e:
-                    print(f"⚠️  Warning: Could not parse schema for {name}: {e}")
-                    input_schema = {}
+            try:
+                await entry.stack.aclose()
+            except Exception as e:
+                print(f"⚠ Error closing agent: {e}")
+        if _stream_stack is not None:
+            try:
+                await _stream_stack.aclose()
+            except Exception as e:
+                print(f"⚠ Error closing stream session: {e}")
+            _stream_stack = None
+            _stream_tools.clear()
+        _chat_client = None
+
+# ============================================================================
+# STREAMED TOOL CALLS - ARRAY ITEMS AS SOON AS THE SERVER PARSES THEM
+# ============================================================================
+
+# MCP connections used for direct (agent-less) streamed calls: shard -> future of its MCP tool
+_stream_tools = {}
+_stream_stack = None
+
+async def get_stream_session(shard: str | None = None) -> ClientSession:
+    """Return the MCP session used for streamed calls to a shard, connecting on first use."""
+    global _stream_stack
+    async with _agent_lock:
+        ready = _stream_tools.get(shard)
+        connecting = ready is None
+        if connecting:
+            ready = _stream_tools[shard] = asyncio.get_running_loop().create_future()
+            if _stream_stack is None:
+                _stream_stack = AsyncExitStack()
+            stack = _stream_stack
+    
+    if connecting:
+        try:
+            ready.set_result(await stack.enter_async_context(await create_mcp_tool(shard)))
+        except BaseException as e:
+            async with _agent_lock:
+                if _stream_tools.get(shard) is ready:
+                    del _stream_tools[shard]
+            _fail_future(ready, e)
+            raise
+    return (await asyncio.shield(ready)).session
+
+async def stream_tool_items(tool_name: str, arguments: dict, key: str, final: dict | None = None,
+                            traceparent: str | None = None):
+    """
+    Call a tool directly and yield the elements of the response array `key` one by one while the
+    server is still reading the backend body (e.g. invoices of implInvoiceLists).
+
+    When the server streams nothing (error payloads, unchanged data, empty lists) nothing is
+    yielded and the parsed tool response is stored in final["response"]; so is {"unchanged": true}
+    when skipUnchanged finds the data unchanged only after the items were streamed.
+    """
+    session = await get_stream_session(TOOL_SHARDS.get(tool_name))
+    items = asyncio.Queue()
+
+    async def on_progress(progress, total, message):
+        if message is not None:
+            items.put_nowait(message)
+
+    async def call():
+        with trace_span(f"stream_{tool_name}", traceparent, key=key):
+            return await session.call_tool(
+                tool_name, {**arguments, "_streamItems": key}, progress_callback=on_progress
+            )
+
+    call_task = asyncio.create_task(call())
+    try:
+        while not call_task.done():
+            next_item = asyncio.create_task(items.get())
+            await asyncio.wait({next_item, call_task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_item.done():
+                yield parse_response_text(next_item.result())
             else:
-                input_schema = {}
-            
-            tools.append({
-                'name': name,
-                'description': description,
-                'inputSchema': input_schema
-            })
-            
-        except Exception as e:
-            print(f"⚠️  Warning: Error parsing tool section: {e}")
-            continue
+                next_item.cancel()
+        # Progress notifications are handled before the response, but drain whatever is left
+        while not items.empty():
+            yield parse_response_text(items.get_nowait())
+
+        result = call_task.result()
+        text = "".join(getattr(content, "text", "") for content in result.content)
+        if result.isError:
+            raise RuntimeError(f"{tool_name} failed: {text}")
+        response = parse_response_text(text)
+        if final is not None and "streamed" not in response:
+            final["response"] = response
+    finally:
+        call_task.cancel()
+
+# ============================================================================
+# WORKFLOW AGENT - ONE CONVERSATION FOR A WHOLE MULTI-TOOL TASK
+# ============================================================================
+
+class WorkflowResult(BaseModel):
+    """Structured answer of the workflow agent (the tool responses are taken from the run itself)."""
+    summary: str
+
+WORKFLOW_INSTRUCTIONS = (
+    "You are an API assistant for the Telefonica MCP server. Complete the whole task in this "
+    "conversation: call every tool the task needs, and call independent tools in parallel in the "
+    "same turn. Only wait for a result when its values are required as input of another call. "
+    "When done, answer with a short summary of the results; do not repeat the API responses."
+)
+
+def _result_text(result: Any) -> str:
+    """Text of a function result: MCP tools return a list of text contents."""
+    if isinstance(result, str):
+        return result
+    if isinstance(result, list):
+        return "".join(getattr(item, "text", None) or "" for item in result)
+    return getattr(result, "text", None) or json.dumps(result, default=str)
+
+def tool_call_results(response) -> dict:
+    """Parsed response of every tool call of an agent run, grouped by tool name in call order."""
+    names, results = {}, {}
+    for message in getattr(response, "messages", None) or []:
+        for content in getattr(message, "contents", None) or []:
+            content_type = getattr(content, "type", None)
+            if content_type == "function_call":
+                names[content.call_id] = content.name
+            elif content_type == "function_result" and content.call_id in names:
+                results.setdefault(names[content.call_id], []).append(
+                    parse_response_text(_result_text(content.result)))
+    return results
+
+async def run_workflow(task: str, traceparent: str | None = None, tools: list[str] | None = None) -> dict:
+    """
+    Resolve a multi-tool task with one agent that has every MCP tool, parallel tool calls
+    and a structured (WorkflowResult) response.
+    
+    tools names the tools the task needs (default: the MCP_TOOL_TOP_K best BM25 matches of
+    the task); the agent only sees those, and with sharded servers only their shards start.
     
+    Returns:
+        dict: {"summary": str, "results": {tool_name: [parsed API response, ...]}}
+    """
+    if tools is None:
+        tools = select_tools(task)
+    shards = None
+    if SHARD_SERVERS:
+        shards = tuple(sorted({TOOL_SHARDS[tool] for tool in tools if tool in TOOL_SHARDS} if tools else SHARD_SERVERS))
+    with trace_span("run_workflow", traceparent):
+        async with use_agent(
+            "Workflow",
+            WORKFLOW_INSTRUCTIONS,
+            shards=shards,
+            allowed_tools=tuple(sorted(tools)) if tools else None,
+            response_format=WorkflowResult,
+            allow_multiple_tool_calls=True
+        ) as agent:
+            with trace_span("agent.run"):
+                response = await agent.run(task)
+    
+    result = getattr(response, "value", None)
+    if not isinstance(result, WorkflowResult):
+        result = WorkflowResult.model_validate_json(response.text)
+    
+    # The tool responses as the MCP server returned them, not as the model would echo them
+    return {"summary": result.summary, "results": tool_call_results(response)}
+'''
+
+# JSON Schema type -> Python annotation used in the generated call_* signatures
+JSON_SCHEMA_TYPES = {
+    "string": "str",
+    "integer": "int",
+    "number": "float",
+    "boolean": "bool",
+    "array": "list",
+    "object": "dict"
+}
+
+
+# Excluded from the tool index: every tool has them
+COMMON_TOOL_PARAMETERS = ("fields", "skipUnchanged")
+
+
+def tokenize_tool_text(text):
+    """Lower-case ASCII word tokens of text, splitting camelCase and snake_case."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if len(token) > 1]
+
+
+def build_tool_index(tools, k1=1.2, b=0.75):
+    """
+    BM25 index over the tools: name (counted twice, it is the strongest signal),
+    description and parameter names. Emitted into the client as TOOL_INDEX.
+    """
+    docs = {}
+    for tool in tools:
+        properties = (tool.get("inputSchema") or {}).get("properties", {})
+        terms = tokenize_tool_text(tool["name"]) * 2 + tokenize_tool_text(tool.get("description", ""))
+        for prop in properties:
+            if prop not in COMMON_TOOL_PARAMETERS:
+                terms += tokenize_tool_text(prop)
+        tf = {}
+        for term in terms:
+            tf[term] = tf.get(term, 0) + 1
+        docs[tool["name"]] = {"length": len(terms), "tf": tf}
+
+    if not docs:
+        return {}
+    document_frequency = {}
+    for doc in docs.values():
+        for term in doc["tf"]:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    count = len(docs)
+    return {
+        "k1": k1,
+        "b": b,
+        "avgdl": sum(doc["length"] for doc in docs.values()) / count or 1.0,
+        "idf": {term: round(math.log(1 + (count - df + 0.5) / (df + 0.5)), 6)
+                for term, df in sorted(document_frequency.items())},
+        "docs": docs
+    }
+
+
+def client_runtime(server_filename, tool_shards=None, shard_servers=None, tool_index=None):
+    """Return CLIENT_RUNTIME_TEMPLATE for the given server file (shard router and tool index, if any)."""
+    return (CLIENT_RUNTIME_TEMPLATE
+            .replace("__SERVER_FILENAME__", server_filename)
+            .replace("__TOOL_SHARDS__", json.dumps(tool_shards or {}, indent=4, sort_keys=True))
+            .replace("__SHARD_SERVERS__", json.dumps(shard_servers or {}, indent=4, sort_keys=True))
+            .replace("__TOOL_INDEX__", json.dumps(tool_index or {}, separators=(",", ":"), sort_keys=True))
+            .replace("__TOOL_TOKENIZER__", inspect.getsource(tokenize_tool_text)))
+
+
+def _batch_schema(item_schema, constants):
+    """inputSchema of a *_batch tool, as the server's injected batch_schema() helper builds it."""
+    item_properties = {key: value for key, value in item_schema.get("properties", {}).items()
+                       if key not in ("fields", "skipUnchanged")}
+    return {
+        "type": "object",
+        "properties": {
+            "items": {
+                "type": "array",
+                "description": "One entry per call, each with the same arguments as the single-call tool",
+                "items": {
+                    "type": "object",
+                    "properties": item_properties,
+                    "required": item_schema.get("required", [])
+                }
+            },
+            "fields": constants.get("FIELDS_SCHEMA", {"type": "array", "items": {"type": "string"}})
+        },
+        "required": ["items"]
+    }
+
+
+def _evaluate(node, constants):
+    """
+    Evaluate a literal expression from the server source without running any of it.
+
+    Besides literals this resolves module-level constants (e.g. LISTADO_SCHEMA,
+    FIELDS_SCHEMA), string concatenation and batch_schema(<schema>) calls.
+    """
+    if isinstance(node, ast.Name):
+        if node.id not in constants:
+            raise ValueError(f"unknown name {node.id}")
+        return constants[node.id]
+    if isinstance(node, ast.Dict):
+        return {_evaluate(key, constants): _evaluate(value, constants)
+                for key, value in zip(node.keys, node.values)}
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_evaluate(element, constants) for element in node.elts]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return _evaluate(node.left, constants) + _evaluate(node.right, constants)
+    if isinstance(node, ast.Call):
+        if getattr(node.func, "id", None) == "batch_schema" and len(node.args) == 1 and not node.keywords:
+            return _batch_schema(_evaluate(node.args[0], constants), constants)
+        raise ValueError(f"unsupported call {ast.unparse(node.func)}()")
+    return ast.literal_eval(node)
+
+
+def _list_tools_handlers(module):
+    """Functions registered with @server.list_tools() (the injected helpers define their own Tool() calls)."""
+    handlers = []
+    for node in ast.walk(module):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for decorator in node.decorator_list:
+                target = decorator.func if isinstance(decorator, ast.Call) else decorator
+                if getattr(target, "attr", None) == "list_tools":
+                    handlers.append(node)
+    return handlers
+
+
+def extract_tools_from_mcp_server(server_code):
+    """
+    Parse the MCP server Python code and extract tool definitions with one ast pass;
+    nothing of the (LLM-generated) server is executed.
+    Returns a list of tool information dictionaries.
+    """
+    module = ast.parse(server_code)
+
+    # Module-level constants, resolved in source order
+    constants = {}
+    for node in module.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    try:
+                        constants[target.id] = _evaluate(node.value, constants)
+                    except Exception:
+                        pass
+
+    handlers = _list_tools_handlers(module)
+    if not handlers:
+        print("⚠️  Warning: No @server.list_tools() handler found in the server")
+
+    tools = []
+    for handler in handlers:
+        for node in ast.walk(handler):
+            if not (isinstance(node, ast.Call) and getattr(node.func, "id", getattr(node.func, "attr", None)) == "Tool"):
+                continue
+            keywords = {argument.arg: argument.value for argument in node.keywords}
+            try:
+                tool = {
+                    "name": _evaluate(keywords["name"], constants),
+                    "description": _evaluate(keywords["description"], constants) if "description" in keywords else "",
+                    "inputSchema": _evaluate(keywords["inputSchema"], constants) if "inputSchema" in keywords else {}
+                }
+            except Exception as e:
+                print(f"⚠️  Warning: Skipping a Tool at line {node.lineno}: could not resolve {e!r}")
+                continue
+            if tool["name"]:
+                tools.append(tool)
+
     return tools
 
 
-def create_unified_client_prompt(server_code, server_filename):
-    """Create prompt for generating a unified MCP client with all methods."""
-    
-    prompt = f"""You are an expert Python developer specializing in creating MCP clients using the agent_framework.
+def _python_name(name):
+    """Make a schema property or tool name usable as a Python identifier."""
+    identifier = re.sub(r"\W+", "_", name).strip("_") or "value"
+    if identifier[0].isdigit():
+        identifier = f"_{identifier}"
+    return f"{identifier}_" if keyword.iskeyword(identifier) else identifier
+
+
+def _parameter_names(properties):
+    """
+    Property name -> Python parameter name (e.g. 'X-Correlation-Id' -> X_Correlation_Id,
+    'page[size]' -> page_size). The tool still receives the original names.
+    """
+    names = {}
+    taken = {"traceparent"}
+    for prop in properties:
+        identifier = base = _python_name(prop)
+        suffix = 2
+        while identifier in taken:
+            identifier = f"{base}_{suffix}"
+            suffix += 1
+        taken.add(identifier)
+        names[prop] = identifier
+    return names
+
+
+def _annotation(prop):
+    """Python type hint for a JSON Schema property (arrays keep their item type)."""
+    annotation = JSON_SCHEMA_TYPES.get(prop.get("type"), "Any")
+    if annotation == "list" and prop.get("items", {}).get("type") in JSON_SCHEMA_TYPES:
+        return f"list[{_annotation(prop['items'])}]"
+    return annotation
+
+
+def _sample_value(prop):
+    """Example argument for a property, used in the generated main()."""
+    if "example" in prop:
+        return prop["example"]
+    if "default" in prop:
+        return prop["default"]
+    return {"integer": 1, "number": 1.0, "boolean": False, "array": [], "object": {}}.get(prop.get("type"), "value")
+
+
+def render_client_function(tool):
+    """Render the typed call_<tool> coroutine for one tool."""
+    name = tool["name"]
+    schema = tool.get("inputSchema") or {}
+    properties = schema.get("properties", {})
+    required = [prop for prop in schema.get("required", []) if prop in properties]
+    optional = [prop for prop in properties if prop not in required]
+    names = _parameter_names(properties)
+
+    parameters = [f"{names[prop]}: {_annotation(properties[prop])}" for prop in required]
+    parameters += [f"{names[prop]}: {_annotation(properties[prop])} | None = None" for prop in optional]
+    parameters.append("traceparent: str | None = None")
+
+    description = " ".join((tool.get("description") or f"Call the {name} API via MCP server.").split())
+    description = description.replace("\\", "\\\\").replace('"""', "'''")
+    arg_docs = []
+    for prop in required + optional:
+        prop_description = " ".join(str(properties[prop].get("description", "")).split())
+        prop_description = prop_description.replace("\\", "\\\\").replace('"""', "'''")
+        arg_docs.append(f"        {names[prop]}: {prop_description}".rstrip())
+    arg_docs.append("        traceparent: W3C trace context of the caller (default: the current span)")
 
-YOUR TASK: Read the complete MCP server code below and generate ONE unified MCP client file with methods for EACH tool defined in the server.
+    lines = [
+        f"async def call_{_python_name(name)}({', '.join(parameters)}) -> dict:",
+        '    """',
+        f"    {description}",
+        "    "
+    ]
+    if arg_docs:
+        lines += ["    Args:"] + arg_docs + ["    "]
+    lines += [
+        "    Returns:",
+        "        dict: API response",
+        '    """',
+        "    kwargs = {" + ", ".join(f"{prop!r}: {names[prop]}" for prop in required) + "}"
+    ]
+    for prop in optional:
+        lines += [
+            f"    if {names[prop]} is not None:",
+            f"        kwargs[{prop!r}] = {names[prop]}"
+        ]
+    instructions = (f"You are an API assistant for: {description.rstrip('.')}. "
+                    f"Use the {name} tool from the MCP server to call the API. "
+                    "Pass all the provided parameters to the tool. "
+                    "Return the raw response from the API.")
+    lines += [
+        "    instructions = (",
+        f"        {instructions!r}",
+        "    )",
+        "    ",
+        f"    with trace_span({'call_' + name!r}, traceparent):",
+        f"        query = f\"Call {name} with parameters: {{json.dumps(kwargs)}}\"",
+        f"        async with use_agent({name!r}, instructions) as agent:",
+        "            # LLM time = agent.run minus the mcp.call_tool spans nested in it",
+        "            with trace_span(\"agent.run\"):",
+        "                response = await agent.run(query)",
+        "    ",
+        "    # Parse JSON response (once)",
+        "    return parse_response_text(response.text)",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def render_unified_client(tools, server_filename, tool_shards=None, shard_servers=None):
+    """
+    Render the complete unified client from extracted tool schemas (no LLM involved).
+
+    With tool_shards / shard_servers (sharded servers) every call_* is routed to the
+    server of its shard.
+    """
+    source = ", ".join(sorted(shard_servers.values())) if shard_servers else server_filename
+    sections = [
+        "# Copyright (c) Microsoft. All rights reserved.\n",
+        '"""\nTelefonica MCP Client\n\n'
+        f"Generated by mcp_client_generator.py from the tool schemas of {source}.\n"
+        'Re-run the generator instead of editing this file.\n"""\n',
+        client_runtime(server_filename, tool_shards, shard_servers, build_tool_index(tools)),
+        "# ============================================================================\n"
+        "# API CLIENT METHODS - ONE PER MCP SERVER TOOL\n"
+        "# ============================================================================\n"
+    ]
+    sections += [render_client_function(tool) for tool in tools]
+
+    main_lines = [
+        "async def main():",
+        '    """',
+        "    Main function demonstrating usage of all API methods.",
+        '    """',
+        '    print("=" * 80)',
+        '    print("TELEFONICA MCP CLIENT - UNIFIED INTERFACE")',
+        '    print("=" * 80)',
+        "    "
+    ]
+    for tool in tools:
+        if tool["name"].endswith("_batch"):
+            continue
+        schema = tool.get("inputSchema") or {}
+        properties = schema.get("properties", {})
+        names = _parameter_names(properties)
+        arguments = ", ".join(f"{names[prop]}={_sample_value(properties[prop])!r}"
+                              for prop in schema.get("required", []) if prop in properties)
+        main_lines += [
+            "    try:",
+            f"        result = await call_{_python_name(tool['name'])}({arguments})",
+            f"        print(\"\\n✓ {tool['name']}:\")",
+            "        print(json.dumps(result, indent=2, ensure_ascii=False)[:1000])",
+            "    except Exception as e:",
+            f"        print(f\"\\n✗ {tool['name']} failed: {{e}}\")",
+            "    "
+        ]
+    main_lines += [
+        "    await shutdown_clients()",
+        "    ",
+        '    print("\\n✅ All API calls completed!")',
+        '    print("=" * 80)'
+    ]
+    sections.append("\n".join(main_lines) + "\n")
+    sections.append('if __name__ == "__main__":\n    import asyncio\n    asyncio.run(main())\n')
+
+    return "\n\n".join(section.rstrip("\n") + "\n" for section in sections)
+
+
+def create_unified_client_prompt(server_code, server_filename, tools=None):
+    """
+    Create prompt for generating a unified MCP client with all methods.
+
+    When tools (from extract_tools_from_mcp_server) is given, the prompt carries only
+    their minified schemas instead of the whole server source (compact mode).
+    """
+    
+    if tools is None:
+        source_section = f"""YOUR TASK: Read the complete MCP server code below and generate ONE unified MCP client file with methods for EACH tool defined in the server.
 
 MCP SERVER FILE: {server_filename}
 MCP SERVER LOCATION: C:\\TelefonicaProcessAgent\\Data\\SourceDesigned\\{server_filename}
@@ -127,12 +863,31 @@ INSTRUCTIONS:
    - Tool description
    - Required input parameters from inputSchema
    - Parameter types
-4. Generate ONE unified client with ONE async method per tool
+4. Generate ONE unified client with ONE async method per tool"""
+    else:
+        tool_schemas = json.dumps(tools, separators=(",", ":"), ensure_ascii=False)
+        source_section = f"""YOUR TASK: Generate ONE unified MCP client file with methods for EACH tool of the MCP server described below.
+
+MCP SERVER FILE: {server_filename}
+MCP SERVER LOCATION: C:\\TelefonicaProcessAgent\\Data\\SourceDesigned\\{server_filename}
+
+MCP SERVER TOOLS (minified JSON list of {{"name","description","inputSchema"}}):
+{tool_schemas}
+
+INSTRUCTIONS:
+1. Use ONLY the tools listed above - their names, descriptions and inputSchema are authoritative
+2. Take required parameters and types from each inputSchema
+3. Generate ONE unified client with ONE async method per tool"""
+    
+    prompt = f"""You are an expert Python developer specializing in creating MCP clients using the agent_framework.
+
+{source_section}
 
 REQUIREMENTS:
 1. Create ONE unified client file with multiple async methods
 2. Each method corresponds to ONE MCP server tool
-3. Use agent_framework with MCPStdioTool to spawn the server as subprocess
+3. Use agent_framework with MCPStdioTool to spawn the server as subprocess, or MCPStreamableHTTPTool
+   when MCP_SERVER_URL points at a shared server (keep create_mcp_tool() EXACTLY as shown)
 4. Each method should:
    - Accept the required parameters for that specific tool
    - Create an agent with Azure OpenAI
@@ -144,42 +899,7 @@ REQUIREMENTS:
 
 EXACT STRUCTURE TO FOLLOW:
 
-import os
-import json
-from dotenv import load_dotenv
-from agent_framework import ChatAgent, MCPStdioTool
-from agent_framework.azure import AzureOpenAIChatClient
-
-# Load environment variables
-load_dotenv()
-
-# Configuration
-MCP_SERVER_PATH = r"C:\\TelefonicaProcessAgent\\Data\\SourceDesigned\\{server_filename}"
-PYTHON_EXECUTABLE = os.getenv("PYTHON_PATH", "python")
-
-async def create_mcp_tool():
-    \"\"\"Create and return the MCP tool connected to the Telefonica MCP server.\"\"\"
-    return MCPStdioTool(
-        name="Telefonica API MCP Server",
-        command=PYTHON_EXECUTABLE,
-        args=[MCP_SERVER_PATH],
-        env=os.environ.copy()
-    )
-
-async def create_agent(tool_name: str, instructions: str):
-    \"\"\"Create an Azure OpenAI agent with the MCP tool.\"\"\"
-    mcp_tool = await create_mcp_tool()
-    
-    return AzureOpenAIChatClient(
-        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview"),
-        model=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME", "gpt-4")
-    ).create_agent(
-        name=f"Telefonica_{{tool_name}}_Agent",
-        instructions=instructions,
-        tools=[mcp_tool]
-    )
+{client_runtime(server_filename).rstrip()}
 
 # ============================================================================
 # API CLIENT METHODS - ONE PER MCP SERVER TOOL
@@ -204,16 +924,16 @@ async def create_agent(tool_name: str, instructions: str):
 #         "Return the raw response from the API."
 #     )
 #     
-#     async with await create_agent("TOOL_NAME", instructions) as agent:
+#     with trace_span("call_TOOL_NAME", traceparent):
 #         # Build the query with parameters
 #         query = f"Call TOOL_NAME with parameters: {{json.dumps(kwargs)}}"
-#         response = await agent.run(query)
-#         
-#         # Parse JSON response
-#         try:
-#             return json.loads(response.text)
-#         except:
-#             return {{"raw_response": response.text, "success": True}}
+#         # Cached agent: use_agent() keeps it open for the block, shutdown_clients() closes it
+#         async with use_agent("TOOL_NAME", instructions) as agent:
+#             with trace_span("agent.run"):
+#                 response = await agent.run(query)
+#     
+#     # Parse JSON response (once, with parse_response_text)
+#     return parse_response_text(response.text)
 
 async def main():
     \"\"\"
@@ -226,6 +946,9 @@ async def main():
     # Example calls for each method (use sample data from tool schemas)
     # Add try/except blocks for each call
     
+    # Close the cached agents and MCP connections
+    await shutdown_clients()
+    
     print("\\n✅ All API calls completed!")
     print("=" * 80)
 
@@ -243,6 +966,22 @@ CRITICAL INSTRUCTIONS:
 7. Include example calls in main() with sample data
 8. NO TIMESTAMPS in any names
 9. Use descriptive method names based on tool names
+10. Every tool accepts an optional 'fields' projection argument (list of dotted paths such as
+    'implInvoiceLists.totalAmount'). Expose it as the last parameter `fields: list[str] | None = None`
+    and include it in the tool parameters only when it is not None
+    Likewise expose the optional 'skipUnchanged' argument as `skipUnchanged: bool | None = None`; the tool
+    then returns {{"unchanged": true}} when the backend data did not change since the previous call
+11. Tools ending in '_batch' take `items: list[dict]` (one dict of arguments per call) plus the
+    optional `fields`; generate `call_<tool>(items: list[dict], fields: list[str] | None = None)`.
+    They return {{"total", "succeeded", "failed", "results": [{{"index", "input", "result"|"error"}}]}}
+12. Keep get_chat_client(), use_agent(), startup_clients(), shutdown_clients() and the workflow agent
+    section (WorkflowResult, tool_call_results, run_workflow), parse_response_text() and the tool index section
+    (TOOL_INDEX = {{}}, tokenize_tool_text, select_tools) and the streamed tool calls section
+    (get_stream_session, stream_tool_items) EXACTLY as shown;
+    every call_* method runs its agent inside "async with use_agent(...) as agent:" and never closes it itself
+13. Every call_* method takes a last keyword argument `traceparent: str | None = None` (never sent to the
+    tool) and wraps its body in trace_span("call_<tool>", traceparent) and agent.run in trace_span("agent.run")
+    as shown; keep the TRACE CONTEXT section EXACTLY as shown
 
 Generate ONLY the complete Python code. No explanations, no markdown formatting - just pure Python code."""
 
@@ -256,85 +995,152 @@ def generate_unified_mcp_client():
     print("UNIFIED MCP CLIENT GENERATOR")
     print("=" * 80)
     
-    # Step 1: Locate the MCP server file
+    # Step 1: Locate the MCP server file (or the shards of mcp_servers_generator.py --shards)
     print("\n[Step 1] Locating MCP server file...")
     output_dir = r"C:\TelefonicaProcessAgent\Data\SourceDesigned"
     mcp_server_filename = "telefonica_mcp_server.py"
     mcp_server_path = os.path.join(output_dir, mcp_server_filename)
+    shard_manifest_path = os.path.join(output_dir, "telefonica_mcp_shards.json")
     
-    if not os.path.exists(mcp_server_path):
+    shard_servers = {}
+    if os.path.exists(shard_manifest_path):
+        with open(shard_manifest_path, 'r', encoding='utf-8') as f:
+            shard_servers = {domain: shard["server"] for domain, shard in json.load(f).get("shards", {}).items()}
+        missing = [name for name in shard_servers.values() if not os.path.exists(os.path.join(output_dir, name))]
+        if missing or not shard_servers:
+            print(f"✗ Shard manifest {shard_manifest_path} lists missing servers: {', '.join(missing) or 'none listed'}")
+            print("  Please run mcp_servers_generator.py --shards again!")
+            return
+        print(f"✓ Found {len(shard_servers)} MCP server shard(s): {', '.join(sorted(shard_servers.values()))}")
+    elif not os.path.exists(mcp_server_path):
         print(f"✗ MCP server not found at: {mcp_server_path}")
         print("  Please run mcp_servers_generator.py first!")
         return
-    
-    print(f"✓ Found MCP server: {mcp_server_filename}")
+    else:
+        print(f"✓ Found MCP server: {mcp_server_filename}")
     
     # Step 2: Read the complete MCP server code
     print("\n[Step 2] Reading MCP server code...")
+    server_paths = {domain: os.path.join(output_dir, name) for domain, name in shard_servers.items()}
+    server_codes = {}
     try:
-        with open(mcp_server_path, 'r', encoding='utf-8') as f:
-            server_code = f.read()
+        for shard, path in (server_paths or {None: mcp_server_path}).items():
+            with open(path, 'r', encoding='utf-8') as f:
+                server_codes[shard] = f.read()
+        server_code = "\n\n".join(server_codes.values())
         print(f"✓ Read {len(server_code)} characters of server code")
     except Exception as e:
         print(f"✗ Error reading MCP server: {e}")
         return
     
-    # Step 3: Set up Azure OpenAI
-    print("\n[Step 3] Setting up Azure OpenAI client...")
-    
-    azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-    api_key = os.getenv("AZURE_OPENAI_API_KEY")
-    deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
-    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
+    # Step 3: Extract the tool definitions with a single AST pass (per shard)
+    print("\n[Step 3] Extracting tool definitions...")
+    tools = []
+    tool_shards = {}
+    for shard, code in server_codes.items():
+        try:
+            shard_tools = extract_tools_from_mcp_server(code)
+        except SyntaxError as e:
+            print(f"✗ MCP server {shard or mcp_server_filename} is not valid Python: {e}")
+            return
+        for tool in shard_tools:
+            if tool["name"] in tool_shards:
+                print(f"⚠️  Warning: {tool['name']} is defined by shards {tool_shards[tool['name']]} and {shard}; "
+                      f"keeping {tool_shards[tool['name']]}")
+                continue
+            tools.append(tool)
+            if shard:
+                tool_shards[tool["name"]] = shard
     
-    if not azure_endpoint or not api_key:
-        print("✗ Azure OpenAI credentials not configured in .env")
+    if not tools:
+        print("✗ No Tool(...) definitions found in the MCP server")
         return
     
-    print(f"✓ Using deployment: {deployment_name}")
+    print(f"✓ Found {len(tools)} tools: {', '.join(tool['name'] for tool in tools)}")
     
-    client = AzureOpenAI(
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-        api_version=api_version
-    )
-    
-    # Step 4: Generate the unified client by passing the entire server code to OpenAI
-    print("\n[Step 4] Generating unified MCP client code...")
-    print("⏳ Azure OpenAI is reading the server code and creating the client...")
+    generation_mode = os.getenv("MCP_CLIENT_GENERATION_MODE", "template").strip().lower()
+    if shard_servers and generation_mode != "template":
+        # The router tables come from the shard manifest; rendering keeps them exact
+        print(f"⚠️  Sharded servers: ignoring MCP_CLIENT_GENERATION_MODE={generation_mode}, rendering from templates")
+        generation_mode = "template"
+    deployment_name = None
+    usage = {"total_tokens": 0, "continuations": 0}
+    prompt_tokens_estimate = 0
     
-    prompt = create_unified_client_prompt(server_code, mcp_server_filename)
-    
-    try:
-        response = client.chat.completions.create(
-            model=deployment_name,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert Python developer. Generate clean, production-ready code with proper error handling."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.3,
-            max_tokens=4000
-        )
+    if generation_mode == "template":
+        # Step 4: Render the client straight from the schemas - no LLM call, same output every run
+        print("\n[Step 4] Rendering unified MCP client from tool schemas...")
+        generated_code = render_unified_client(tools, mcp_server_filename, tool_shards, shard_servers)
+        print(f"✓ Generated {len(generated_code)} characters of code")
+    else:
+        # Step 4: Set up Azure OpenAI and let the model write the client
+        print("\n[Step 4] Generating unified MCP client code with Azure OpenAI...")
         
-        generated_code = response.choices[0].message.content
+        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
         
-        # Clean markdown if present
-        if "```python" in generated_code:
-            generated_code = generated_code.split("```python")[1].split("```")[0].strip()
-        elif "```" in generated_code:
-            generated_code = generated_code.split("```")[1].split("```")[0].strip()
+        if not azure_endpoint or not api_key:
+            print("✗ Azure OpenAI credentials not configured in .env")
+            return
         
-        print(f"✓ Generated {len(generated_code)} characters of code")
-        print(f"✓ Tokens used: {response.usage.total_tokens}")
+        print(f"✓ Using deployment: {deployment_name}")
         
-    except Exception as e:
-        print(f"✗ Error calling Azure OpenAI: {e}")
+        client = AzureOpenAI(
+            azure_endpoint=azure_endpoint,
+            api_key=api_key,
+            api_version=api_version
+        )
+        
+        # llm-compact sends only the minified tool schemas, so the prompt grows with the tool count
+        if generation_mode == "llm-compact":
+            print("⏳ Azure OpenAI is reading the tool schemas and creating the client...")
+            prompt = create_unified_client_prompt(server_code, mcp_server_filename, tools=tools)
+        else:
+            print("⏳ Azure OpenAI is reading the server code and creating the client...")
+            prompt = create_unified_client_prompt(server_code, mcp_server_filename)
+        prompt_tokens_estimate = estimate_tokens(prompt)
+        print(f"✓ Prompt: ~{prompt_tokens_estimate} tokens")
+        
+        try:
+            # Streamed; truncated replies are continued and transient errors retried
+            generated_code, usage = generate_code(
+                client,
+                deployment_name,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are an expert Python developer. Generate clean, production-ready code with proper error handling."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                temperature=0.3,
+                max_tokens=4000
+            )
+            
+            # The prompt shows an empty index; the real one is computed here, not by the model
+            generated_code = generated_code.replace(
+                "TOOL_INDEX = {}",
+                "TOOL_INDEX = " + json.dumps(build_tool_index(tools), separators=(",", ":"), sort_keys=True),
+                1
+            )
+            
+            print(f"✓ Generated {len(generated_code)} characters of code")
+            print(f"✓ Tokens used: {usage['total_tokens']} ({usage['continuations']} continuation(s))")
+            
+        except Exception as e:
+            print(f"✗ Error calling Azure OpenAI: {e}")
+            return
+    
+    # The client is only written when it compiles (catalog names, LLM output)
+    try:
+        compile(generated_code, "telefonica_mcp_client.py", "exec")
+    except SyntaxError as e:
+        print(f"✗ Generated client does not compile: {e}")
         return
     
     # Step 5: Delete old client files from output directory (except server and metadata)
@@ -372,28 +1178,42 @@ def generate_unified_mcp_client():
     print("\n[Step 6] Saving metadata...")
     
     from datetime import datetime
-    metadata = {
+    client_metadata = {
         "generated_at": datetime.now().isoformat(),
         "mcp_server": mcp_server_filename,
+        "shards": shard_servers,
         "mcp_client": client_filename,
         "server_code_length": len(server_code),
-        "tokens_used": response.usage.total_tokens,
-        "model": deployment_name
+        "generation_mode": generation_mode,
+        "tools": [tool["name"] for tool in tools],
+        "tokens_used": usage["total_tokens"],
+        "prompt_tokens_estimate": prompt_tokens_estimate,
+        "continuations": usage["continuations"],
+        "model": deployment_name or "template"
     }
     
+    # Shared with the server generator: its metadata is kept, the client's goes under "client"
     metadata_path = os.path.join(output_dir, "telefonica_mcp_metadata.json")
+    metadata = {}
+    if os.path.exists(metadata_path):
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Could not read {metadata_path}, rewriting it: {e}")
+    metadata["client"] = client_metadata
     with open(metadata_path, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=2)
-    print(f"✓ Metadata saved to: {metadata_path}")
+    print(f"✓ Client metadata merged into: {metadata_path}")
     
     # Final summary
     print("\n" + "=" * 80)
     print("✅ UNIFIED MCP CLIENT GENERATION COMPLETE!")
     print("=" * 80)
     print("\nGenerated Files:")
-    print(f"  • MCP Server: {mcp_server_filename}")
+    print(f"  • MCP Server: {', '.join(sorted(shard_servers.values())) if shard_servers else mcp_server_filename}")
     print(f"  • MCP Client: {client_filename}")
-    print(f"  • Tokens used: {response.usage.total_tokens}")
+    print(f"  • Tokens used: {usage['total_tokens']}")
     print(f"\nAll files in: {output_dir}")
     print("\nNext steps:")
     print("  1. Configure .env with Azure OpenAI credentials")
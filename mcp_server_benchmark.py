@@ -0,0 +1,248 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+"""
+MCP Server Benchmark
+
+Starts a generated MCP server against a local mock backend and measures:
+1. Cold start (process spawn until the MCP session is initialized)
+2. list_tools latency
+3. Per-call latency of every tool, called with sample arguments from its inputSchema
+
+The generated server sends every backend request to MCP_BACKEND_OVERRIDE, so no
+real Telefonica API (or credential) is touched.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+# Body returned by the mock backend for every request
+MOCK_RESPONSE = {
+    "implInvoiceLists": [
+        {
+            "billingInvoiceNumber": "100000001",
+            "invoiceStatusInd": "O",
+            "documentType": "CY",
+            "totalAmount": 15990,
+            "dueDate": "2024-01-15",
+            "name": "Mock Customer",
+            "customerRut": "11111111-1",
+            "downloadLink": "https://example.invalid/invoice.pdf"
+        }
+    ]
+}
+
+# A slowdown smaller than this is treated as noise, whatever the ratio
+MIN_REGRESSION_MS = 25.0
+
+# Secrets the benchmarked server gets replaced by placeholders
+CREDENTIAL_VARIABLES = ("BEARER_TOKEN", "APIM_SUBSCRIPTION_KEY", "AZURE_OPENAI_API_KEY")
+
+# Shared state and opt-in features the benchmarked server gets switched off: the mock run must
+# not spend the real quota, serve or fill the real HTTP cache, write spans, reload the catalog or profile
+OPERATIONAL_VARIABLES = ("MCP_QUOTA_DB", "MCP_HTTP_CACHE_DB", "TELEFONICA_TRACE_FILE", "MCP_CATALOG_PATH", "MCP_PROFILE")
+
+
+class _MockBackendHandler(BaseHTTPRequestHandler):
+    """Answer every request with the configured JSON body."""
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        body = self.server.response_body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+    do_PUT = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockBackend:
+    """Local HTTP server standing in for the APIM gateway and direct APIs."""
+
+    def __init__(self, response=None):
+        self.response = MOCK_RESPONSE if response is None else response
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _MockBackendHandler)
+        self._server.response_body = json.dumps(self.response).encode("utf-8")
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def sample_arguments(schema):
+    """Build the smallest valid arguments for a tool from its JSON inputSchema."""
+
+    arguments = {}
+    properties = schema.get("properties", {})
+    for name in schema.get("required", []):
+        arguments[name] = _sample_value(properties.get(name, {}))
+    return arguments
+
+
+def _sample_value(prop):
+    prop_type = prop.get("type", "string")
+    if prop_type == "integer":
+        return 1
+    if prop_type == "number":
+        return 1.0
+    if prop_type == "boolean":
+        return False
+    if prop_type == "object":
+        return sample_arguments(prop)
+    if prop_type == "array":
+        items = prop.get("items", {})
+        return [_sample_value(items)] if items.get("type") == "object" else []
+    return "1"
+
+
+def _call_error(result):
+    """Return an error message if a tool result signals failure, else None."""
+
+    if result.isError:
+        return " ".join(getattr(content, "text", "") for content in result.content) or "tool error"
+    for content in result.content:
+        try:
+            data = json.loads(getattr(content, "text", ""))
+        except ValueError:
+            continue
+        if isinstance(data, dict) and data.get("error"):
+            return str(data["error"])
+        if isinstance(data, dict) and data.get("failed"):
+            return json.dumps(data.get("results", [])[:1])
+    return None
+
+
+async def benchmark_server(server_path, backend_url, calls_per_tool=3, python_executable=None):
+    """Spawn the server over stdio, call every tool and return latency measurements in ms."""
+
+    env = os.environ.copy()
+    env["MCP_BACKEND_OVERRIDE"] = backend_url
+    env["APIM_BASE_URL"] = backend_url
+    # Placeholders (not removed), so the server's load_dotenv() cannot fill them in from .env
+    # either: a server without the override hook must never reach the real backends with real credentials
+    for name in CREDENTIAL_VARIABLES:
+        env[name] = "mock-credential"
+    for name in OPERATIONAL_VARIABLES:
+        env[name] = ""
+    params = StdioServerParameters(
+        command=python_executable or sys.executable,
+        args=[server_path],
+        env=env
+    )
+
+    report = {"server": server_path, "tools": {}, "errors": []}
+    started = time.perf_counter()
+    async with stdio_client(params) as (read_stream, write_stream):
+        async with ClientSession(read_stream, write_stream) as session:
+            await session.initialize()
+            report["cold_start_ms"] = (time.perf_counter() - started) * 1000
+
+            list_started = time.perf_counter()
+            tools = (await session.list_tools()).tools
+            report["list_tools_ms"] = (time.perf_counter() - list_started) * 1000
+            report["tool_count"] = len(tools)
+
+            for tool in tools:
+                arguments = sample_arguments(tool.inputSchema or {})
+                timings = []
+                for _ in range(calls_per_tool):
+                    call_started = time.perf_counter()
+                    try:
+                        result = await session.call_tool(tool.name, arguments)
+                        error = _call_error(result)
+                    except Exception as e:
+                        error = str(e)
+                    timings.append((time.perf_counter() - call_started) * 1000)
+                    if error:
+                        report["errors"].append(f"{tool.name}: {error}")
+                        break
+                report["tools"][tool.name] = {
+                    "median_ms": statistics.median(timings),
+                    "calls": len(timings)
+                }
+
+    call_medians = [entry["median_ms"] for entry in report["tools"].values()]
+    report["mean_call_ms"] = statistics.mean(call_medians) if call_medians else 0.0
+    return report
+
+
+def run_benchmark(server_path, calls_per_tool=3, timeout=120.0, python_executable=None):
+    """Benchmark a server file against a fresh MockBackend (blocking)."""
+
+    with MockBackend() as backend:
+        return asyncio.run(asyncio.wait_for(
+            benchmark_server(server_path, backend.url, calls_per_tool, python_executable),
+            timeout=timeout
+        ))
+
+
+def compare_reports(new_report, baseline_report, max_slowdown=1.5):
+    """Return regression messages for new_report measured against baseline_report."""
+
+    regressions = []
+    for metric in ("cold_start_ms", "list_tools_ms", "mean_call_ms"):
+        new_value = new_report.get(metric)
+        old_value = baseline_report.get(metric)
+        if new_value is None or not old_value:
+            continue
+        if new_value > old_value * max_slowdown and new_value - old_value > MIN_REGRESSION_MS:
+            regressions.append(f"{metric}: {new_value:.1f} ms vs {old_value:.1f} ms baseline")
+
+    baseline_tools = baseline_report.get("tools", {})
+    for name, timing in new_report.get("tools", {}).items():
+        if name not in baseline_tools:
+            continue
+        new_value = timing["median_ms"]
+        old_value = baseline_tools[name]["median_ms"]
+        if new_value > old_value * max_slowdown and new_value - old_value > MIN_REGRESSION_MS:
+            regressions.append(f"{name}: {new_value:.1f} ms vs {old_value:.1f} ms baseline")
+    return regressions
+
+
+def print_report(report):
+    """Print a benchmark report in the generators' console style."""
+
+    print(f"   Cold start:  {report['cold_start_ms']:.1f} ms")
+    print(f"   list_tools:  {report['list_tools_ms']:.1f} ms ({report['tool_count']} tools)")
+    for name, timing in report["tools"].items():
+        print(f"   {name}: {timing['median_ms']:.1f} ms")
+    for error in report["errors"]:
+        print(f"   ✗ {error}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python mcp_server_benchmark.py <path to telefonica_mcp_server.py>")
+        sys.exit(2)
+    benchmark = run_benchmark(sys.argv[1])
+    print_report(benchmark)
+    sys.exit(1 if benchmark["errors"] else 0)
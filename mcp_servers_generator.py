@@ -1,31 +1,1201 @@
 # Copyright (c) Microsoft. All rights reserved.
 
 import os
+import re
 import json
+import ast
+import shutil
+import tempfile
 from datetime import datetime
 from openai import AzureOpenAI
 from dotenv import load_dotenv
+from mcp_server_benchmark import run_benchmark, compare_reports, print_report
+from llm_codegen import generate_code, estimate_tokens
+from openapi_catalog_importer import load_catalog_slice
 
 # Load environment variables
 load_dotenv()
 
-def create_mcp_generation_prompt(api_catalog):
-    """Create a detailed prompt for Azure OpenAI to generate MCP server code."""
+# Catalog fields the server generator reads; everything else is dropped from the prompt
+CATALOG_FIELDS = ("name", "description", "endpoint", "method", "inputs", "useApimGateway", "apimPath")
+
+API_CATALOG_PATH = r"C:\TelefonicaProcessAgent\Data\api_catalog_modified_1765230841788.json"
+OUTPUT_DIR = r"C:\TelefonicaProcessAgent\Data\SourceDesigned"
+SERVER_FILENAME = "telefonica_mcp_server.py"
+# Written by --shards: {"shards": {domain: {"server": filename, "apis": [api names]}}}
+SHARD_MANIFEST = "telefonica_mcp_shards.json"
+
+
+def metadata_filename(server_filename):
+    """Metadata file of a generated server (the single server keeps its historical name)."""
+    if server_filename == SERVER_FILENAME:
+        return "telefonica_mcp_metadata.json"
+    return server_filename[:-len(".py")] + "_metadata.json"
+
+# Runtime helpers injected verbatim into every generated server. The prompt only
+# describes them, so the model spends no output tokens reproducing them.
+RUNTIME_HELPERS_MARKER = "# RUNTIME HELPERS - INJECTED BY mcp_servers_generator.py"
+
+SERVER_RUNTIME_HELPERS = """\
+# ============================================================================
+# RUNTIME HELPERS - INJECTED BY mcp_servers_generator.py (do not edit)
+# ============================================================================
+
+import os
+import sys
+import json
+import time
+import atexit
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import contextvars
+from typing import Any
+import httpx
+from mcp import types as mcp_types
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Batch tools fan out over the shared HTTP clients, so the pool is sized to match
+BATCH_CONCURRENCY = int(os.getenv('MCP_BATCH_CONCURRENCY', '16'))
+HTTP_LIMITS = httpx.Limits(max_connections=BATCH_CONCURRENCY, max_keepalive_connections=BATCH_CONCURRENCY)
+
+# Sends every backend request to another origin (the staging benchmark's mock backend)
+MCP_BACKEND_OVERRIDE = os.getenv('MCP_BACKEND_OVERRIDE', '').strip()
+
+
+async def _redirect_to_override(request: httpx.Request) -> None:
+    '''Rewrite the request origin to MCP_BACKEND_OVERRIDE, keeping path and query'''
+    override = httpx.URL(MCP_BACKEND_OVERRIDE)
+    request.url = request.url.copy_with(scheme=override.scheme, host=override.host, port=override.port)
+    request.headers['Host'] = request.url.netloc.decode('ascii')
+
+
+# Request quota shared by every server process that points at the same SQLite file:
+# MCP_QUOTA_RATE requests per second per backend host, bursts of up to MCP_QUOTA_BURST
+MCP_QUOTA_DB = os.getenv('MCP_QUOTA_DB', '').strip()
+MCP_QUOTA_RATE = float(os.getenv('MCP_QUOTA_RATE', '10'))
+MCP_QUOTA_BURST = float(os.getenv('MCP_QUOTA_BURST', str(MCP_QUOTA_RATE)))
+
+
+class SharedQuota:
+    '''Token bucket stored in SQLite; BEGIN IMMEDIATE serializes refills across processes'''
+
+    def __init__(self, path: str, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS quota_bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _take(self, key: str) -> float:
+        '''Take one token; return 0 on success or the seconds to wait before retrying'''
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = self._db.execute('SELECT tokens, updated FROM quota_bucket WHERE key = ?', (key,)).fetchone()
+                tokens = self.burst if row is None else min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+                wait = 0.0 if tokens >= 1.0 else (1.0 - tokens) / self.rate
+                if not wait:
+                    tokens -= 1.0
+                self._db.execute('INSERT OR REPLACE INTO quota_bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                                 (key, tokens, now))
+                self._db.execute('COMMIT')
+                return wait
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    async def acquire(self, key: str) -> None:
+        '''Wait until the shared bucket for key grants a request'''
+        while True:
+            wait = await asyncio.to_thread(self._take, key)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+_shared_quota: SharedQuota | None = None
+
+
+async def _acquire_quota(request: httpx.Request) -> None:
+    '''Hold the request until the cross-process quota for its backend host allows it'''
+    global _shared_quota
+    if _shared_quota is None:
+        _shared_quota = SharedQuota(MCP_QUOTA_DB, MCP_QUOTA_RATE, MCP_QUOTA_BURST)
+    await _shared_quota.acquire(request.url.host)
+
+
+# Conditional GET cache: stores ETag / Last-Modified and the body per URL, revalidates with
+# If-None-Match / If-Modified-Since and serves the stored body on 304 Not Modified
+MCP_HTTP_CACHE_DB = os.getenv('MCP_HTTP_CACHE_DB', '').strip()
+
+# True when the last backend response of the current tool call equals the previous poll
+_response_unchanged: contextvars.ContextVar[bool] = contextvars.ContextVar('response_unchanged', default=False)
+
+
+def response_unchanged() -> bool:
+    '''Whether the latest backend response of this tool call is unchanged since the last poll'''
+    return _response_unchanged.get()
+
+
+class ConditionalCacheTransport(httpx.AsyncHTTPTransport):
+    '''HTTP transport that revalidates GET requests against a SQLite response cache'''
+
+    _lock = threading.Lock()
+    _db: sqlite3.Connection | None = None
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        with self._lock:
+            if ConditionalCacheTransport._db is None:
+                db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('CREATE TABLE IF NOT EXISTS http_cache (key TEXT PRIMARY KEY, etag TEXT, '
+                           'last_modified TEXT, content_hash TEXT, headers TEXT, body BLOB)')
+                ConditionalCacheTransport._db = db
+
+    def _load(self, key: str):
+        with self._lock:
+            return self._db.execute('SELECT etag, last_modified, content_hash, headers, body FROM http_cache '
+                                    'WHERE key = ?', (key,)).fetchone()
+
+    def _store(self, key: str, response: httpx.Response, content_hash: str, body: bytes | None) -> None:
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?)', (
+                key, response.headers.get('etag'), response.headers.get('last-modified'), content_hash,
+                json.dumps(response.headers.multi_items()), body
+            ))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _response_unchanged.set(False)
+        if request.method != 'GET':
+            return await super().handle_async_request(request)
+
+        key = str(request.url)
+        cached = await asyncio.to_thread(self._load, key)
+        # Rows stored by streamed calls have no body to answer a 304 with
+        if cached and cached[4] is not None:
+            etag, last_modified = cached[0], cached[1]
+            if etag:
+                request.headers['If-None-Match'] = etag
+            if last_modified:
+                request.headers['If-Modified-Since'] = last_modified
+
+        response = await super().handle_async_request(request)
+        if response.status_code == 304 and cached:
+            await response.aclose()
+            _response_unchanged.set(True)
+            return httpx.Response(200, headers=json.loads(cached[3]), content=cached[4], request=request)
+        if response.status_code != 200:
+            return response
+        if _stream_sink.get() is not None:
+            # Streamed tool call: the body is handed on as it arrives and only hashed
+            return httpx.Response(200, headers=response.headers, request=request,
+                                  stream=_HashingStream(self, key, response, cached))
+
+        # Raw (still content-encoded) bytes, so the stored headers keep describing the body.
+        # Servers without validators are still detected as unchanged through the body hash
+        body = b''.join([chunk async for chunk in response.aiter_raw()])
+        await response.aclose()
+        content_hash = hashlib.sha256(body).hexdigest()
+        _response_unchanged.set(bool(cached) and cached[2] == content_hash)
+        fresh = httpx.Response(200, headers=response.headers, content=body, request=request)
+        await asyncio.to_thread(self._store, key, fresh, content_hash, body)
+        return fresh
+
+
+class _HashingStream(httpx.AsyncByteStream):
+    '''Body of a streamed 200: hashed on the fly, then stored in the cache without the body'''
+
+    def __init__(self, transport: ConditionalCacheTransport, key: str, response: httpx.Response, cached):
+        self._transport = transport
+        self._key = key
+        self._response = response
+        self._cached = cached
+
+    async def __aiter__(self):
+        digest = hashlib.sha256()
+        async for chunk in self._response.stream:
+            digest.update(chunk)
+            yield chunk
+        content_hash = digest.hexdigest()
+        _response_unchanged.set(bool(self._cached) and self._cached[2] == content_hash)
+        await asyncio.to_thread(self._transport._store, self._key, self._response, content_hash, None)
+
+    async def aclose(self) -> None:
+        await self._response.aclose()
+
+
+SKIP_UNCHANGED_SCHEMA = {
+    'type': 'boolean',
+    'description': ('Optional. When true and the backend data is unchanged since the previous '
+                    'call, return {"unchanged": true} instead of the payload.')
+}
+
+
+# Trace context: the client sends a W3C traceparent in the tools/call _meta; a call without one
+# starts a new trace. TRACEPARENT in the environment only parents the server.start span of the
+# workflow that spawned the server (a cached server goes on serving other workflows). Handler
+# and backend spans are appended to TELEFONICA_TRACE_FILE as JSON lines and the backend
+# receives a traceparent header
+MCP_TRACE_FILE = os.getenv('TELEFONICA_TRACE_FILE', '').strip()
+ROOT_PARENT_ID = '0' * 16
+
+_traceparent: contextvars.ContextVar[str | None] = contextvars.ContextVar('traceparent', default=None)
+
+
+def write_span(name: str, traceparent: str, span_id: str, start: float, **attributes) -> None:
+    '''Append one span, child of traceparent (a root span when its parent id is ROOT_PARENT_ID)'''
+    _, trace_id, parent_id, _ = traceparent.split('-')
+    record = {
+        'trace_id': trace_id, 'span_id': span_id,
+        'parent_id': None if parent_id == ROOT_PARENT_ID else parent_id, 'name': name,
+        'service': 'mcp_server', 'pid': os.getpid(), 'start': start,
+        'duration_ms': round((time.time() - start) * 1000, 3), 'attributes': attributes
+    }
+    with open(MCP_TRACE_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, separators=(',', ':')) + '\\n')
+
+
+async def _trace_request(request: httpx.Request) -> None:
+    '''Propagate the current trace to the backend and start its span'''
+    parent = _traceparent.get()
+    if not parent:
+        return
+    span_id = os.urandom(8).hex()
+    request.headers['traceparent'] = f"00-{parent.split('-')[1]}-{span_id}-01"
+    request.extensions['trace_span'] = (parent, span_id, time.time())
+
+
+async def _trace_response(response: httpx.Response) -> None:
+    '''Close the backend span when the response headers arrive'''
+    span = response.request.extensions.get('trace_span')
+    if span:
+        parent, span_id, start = span
+        write_span(f'backend {response.request.method} {response.request.url.path}', parent, span_id, start,
+                   status=response.status_code)
+
+
+def enable_tracing(server) -> None:
+    '''Record every tools/call as a span of the caller's trace (no-op without TELEFONICA_TRACE_FILE)'''
+    if not MCP_TRACE_FILE:
+        return
+    spawned_by = os.getenv('TRACEPARENT')
+    if spawned_by:
+        write_span('server.start', spawned_by, os.urandom(8).hex(), time.time())
+    call_handler = server.request_handlers[mcp_types.CallToolRequest]
+
+    async def traced_call_tool(request):
+        meta = request.params.meta
+        parent = getattr(meta, 'traceparent', None) if meta is not None else None
+        if not parent:
+            parent = f"00-{os.urandom(16).hex()}-{ROOT_PARENT_ID}-01"
+        span_id = os.urandom(8).hex()
+        token = _traceparent.set(f"00-{parent.split('-')[1]}-{span_id}-01")
+        start = time.time()
+        try:
+            return await call_handler(request)
+        finally:
+            _traceparent.reset(token)
+            write_span(f'server.{request.params.name}', parent, span_id, start)
+
+    server.request_handlers[mcp_types.CallToolRequest] = traced_call_tool
+
+
+def http_client_options() -> dict:
+    '''Keyword arguments shared by every httpx.AsyncClient of the server'''
+    request_hooks = []
+    if MCP_QUOTA_DB and MCP_QUOTA_RATE > 0:
+        request_hooks.append(_acquire_quota)
+    if MCP_BACKEND_OVERRIDE:
+        request_hooks.append(_redirect_to_override)
+    # Streamed tool calls (enable_item_streaming) tee the body through these; no-ops otherwise
+    request_hooks.append(_stream_request)
+    response_hooks = [_stream_response]
+    if MCP_TRACE_FILE:
+        # Last request hook, so quota waits are not counted as backend time
+        request_hooks.append(_trace_request)
+        response_hooks.append(_trace_response)
+    options = {'limits': HTTP_LIMITS, 'event_hooks': {'request': request_hooks, 'response': response_hooks}}
+    if MCP_HTTP_CACHE_DB:
+        # A custom transport owns the connection pool, so the limits move to it
+        options['transport'] = ConditionalCacheTransport(MCP_HTTP_CACHE_DB, limits=options.pop('limits'))
+    return options
+
+FIELDS_SCHEMA = {
+    'type': 'array',
+    'items': {'type': 'string'},
+    'description': ("Optional dotted paths to keep in the response, e.g. "
+                    "'implInvoiceLists.totalAmount'. Lists are projected element by element. "
+                    "Omit to return the full payload.")
+}
+
+
+def _projection_tree(fields: list[str]) -> dict:
+    '''Build a nested dict of requested paths; None marks a subtree kept whole'''
+    tree: dict = {}
+    for field in fields:
+        parts = [part for part in field.strip().split('.') if part]
+        if not parts:
+            continue
+        node = tree
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is None:
+                break
+            node = child
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def _apply_projection(node: Any, tree: dict | None) -> Any:
+    '''Keep only the branches of node named in tree'''
+    if tree is None:
+        return node
+    if isinstance(node, list):
+        return [_apply_projection(item, tree) for item in node]
+    if isinstance(node, dict):
+        return {key: _apply_projection(node[key], sub) for key, sub in tree.items() if key in node}
+    return node
+
+
+def json_loads(payload: bytes | str) -> Any:
+    '''Parse JSON straight from the response bytes (orjson when installed)'''
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def json_dumps(data: Any) -> str:
+    '''Serialize compact UTF-8 JSON (orjson when installed)'''
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def as_text(payload: bytes | str) -> str:
+    '''Decode a raw response body once, for TextContent'''
+    return payload.decode('utf-8', errors='replace') if isinstance(payload, (bytes, bytearray)) else payload
+
+
+def _fields_tree(fields: list[str] | str | None) -> dict | None:
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return _projection_tree(fields)
+
+
+def project_fields(payload: bytes | str, fields: list[str] | str | None, skip_unchanged: bool = False) -> str:
+    '''Trim a JSON response to the requested fields before it is sent back over MCP'''
+    if skip_unchanged and response_unchanged():
+        return json_dumps({'unchanged': True})
+    sink = _stream_sink.get()
+    if sink is not None and sink['count']:
+        # Streamed call: the items already went out one by one and the body was not kept
+        return json_dumps({'streamed': sink['count'], 'key': sink['key']})
+    tree = _fields_tree(fields)
+    if tree is None:
+        # Passthrough: the body is decoded once and never parsed
+        return as_text(payload)
+    try:
+        data = json_loads(payload)
+    except ValueError:
+        return as_text(payload)
+    if isinstance(data, dict) and 'error' in data:
+        return as_text(payload)
+    return json_dumps(_apply_projection(data, tree))
+
+
+def batch_schema(item_schema: dict) -> dict:
+    '''Build the inputSchema of a *_batch tool from the single-call inputSchema'''
+    item_properties = {key: value for key, value in item_schema.get('properties', {}).items()
+                       if key not in ('fields', 'skipUnchanged')}
+    return {
+        'type': 'object',
+        'properties': {
+            'items': {
+                'type': 'array',
+                'description': 'One entry per call, each with the same arguments as the single-call tool',
+                'items': {
+                    'type': 'object',
+                    'properties': item_properties,
+                    'required': item_schema.get('required', [])
+                }
+            },
+            'fields': FIELDS_SCHEMA
+        },
+        'required': ['items']
+    }
+
+
+async def run_batch(impl, items: list[dict], fields: list[str] | str | None = None) -> str:
+    '''Call impl once per item concurrently and return per-item results and errors as JSON'''
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tree = _fields_tree(fields)
+
+    async def run_one(index: int, item: dict) -> dict:
+        async with semaphore:
+            try:
+                payload = await impl(**item)
+            except Exception as e:
+                return {'index': index, 'input': item, 'error': str(e)}
+        # Each body is parsed exactly once and serialized once with the whole batch
+        try:
+            data = json_loads(payload)
+        except ValueError:
+            data = as_text(payload)
+        if isinstance(data, dict) and 'error' in data:
+            return {'index': index, 'input': item, 'error': data['error'], 'details': data.get('details')}
+        if tree is not None:
+            data = _apply_projection(data, tree)
+        return {'index': index, 'input': item, 'result': data, 'unchanged': response_unchanged()}
+
+    results = await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items or [])))
+    failed = sum(1 for entry in results if 'error' in entry)
+    return json_dumps({
+        'total': len(results),
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'results': results
+    })
+
+
+def enable_profiling() -> None:
+    '''Opt-in (MCP_PROFILE=true or a rate in Hz): sample every *_impl with async_profiler.py'''
+    if os.getenv('MCP_PROFILE', 'false').strip().lower() in ('', '0', 'false', 'no', 'off'):
+        return
+    try:
+        from async_profiler import AsyncSamplingProfiler
+    except ImportError:
+        print('MCP_PROFILE is set but async_profiler.py is not next to the server', file=sys.stderr)
+        return
+    profiler = AsyncSamplingProfiler.from_env('mcp_server', 'MCP')
+    # call_tool resolves the impls by global name, so rebinding them profiles every call
+    profiler.instrument(globals(), lambda name: name.endswith('_impl'))
+    profiler.start()
+    atexit.register(profiler.stop)
+"""
+
+# Injected in addition to SERVER_RUNTIME_HELPERS when the server is generated with --http
+SERVER_HTTP_TRANSPORT_HELPERS = """\
+# HTTP transport: one long-lived server shared by many clients over Streamable HTTP (SSE).
+# uvicorn and starlette are imported by run_http_server() only, so stdio spawns of the same
+# server (and of its zipapp) do not load them
+import argparse
+import contextlib
+
+MCP_HTTP_HOST = os.getenv('MCP_HTTP_HOST', '127.0.0.1')
+MCP_HTTP_PORT = int(os.getenv('MCP_HTTP_PORT', '8765'))
+
+
+def selected_transport() -> str:
+    '''Return 'stdio' or 'http' from the --transport argument or MCP_TRANSPORT'''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--transport', choices=['stdio', 'http'], default=os.getenv('MCP_TRANSPORT', 'stdio'))
+    args, _ = parser.parse_known_args()
+    return args.transport
+
+
+async def run_http_server(server) -> None:
+    '''Serve the MCP server at http://MCP_HTTP_HOST:MCP_HTTP_PORT/mcp/ until interrupted'''
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+    session_manager = StreamableHTTPSessionManager(app=server)
+
+    async def handle_mcp(scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        async with session_manager.run():
+            yield
+
+    app = Starlette(routes=[Mount('/mcp', app=handle_mcp)], lifespan=lifespan)
+    config = uvicorn.Config(app, host=MCP_HTTP_HOST, port=MCP_HTTP_PORT, log_level='warning')
+    await uvicorn.Server(config).serve()
+"""
+
+# Injected into every generated server; active only when MCP_CATALOG_PATH is set
+SERVER_CATALOG_RELOAD_HELPERS = r"""# ============================================================================
+# CATALOG HOT RELOAD - INJECTED BY mcp_servers_generator.py (do not edit)
+# ============================================================================
+
+import re
+import weakref
+import urllib.parse
+from mcp.server.lowlevel import NotificationOptions
+
+# Catalog file watched by a long-running server; empty disables hot reload
+MCP_CATALOG_PATH = os.getenv('MCP_CATALOG_PATH', '').strip()
+MCP_CATALOG_POLL_SECONDS = float(os.getenv('MCP_CATALOG_POLL_SECONDS', '2'))
+
+JSON_TYPES = {'string', 'integer', 'number', 'boolean', 'array', 'object'}
+
+
+def _catalog_inputs(api: dict, shared_inputs: dict) -> list[dict]:
+    '''Input definitions of a catalog API, resolving names of shared inputs'''
+    inputs = []
+    for api_input in api.get('inputs', []):
+        if isinstance(api_input, str):
+            api_input = shared_inputs.get(api_input, {'name': api_input})
+        if isinstance(api_input, dict) and api_input.get('name'):
+            inputs.append(api_input)
+    return inputs
+
+
+def catalog_tool_schema(api: dict, shared_inputs: dict) -> dict:
+    '''inputSchema of a tool served straight from its catalog entry'''
+    properties, required = {}, []
+    for api_input in _catalog_inputs(api, shared_inputs):
+        input_type = str(api_input.get('type', 'string')).lower()
+        properties[api_input['name']] = {
+            'type': input_type if input_type in JSON_TYPES else 'string',
+            'description': api_input.get('description', '')
+        }
+        if api_input.get('required', True):
+            required.append(api_input['name'])
+    properties['fields'] = FIELDS_SCHEMA
+    properties['skipUnchanged'] = SKIP_UNCHANGED_SCHEMA
+    return {'type': 'object', 'properties': properties, 'required': required}
+
+
+async def catalog_impl(api: dict, arguments: dict, shared_inputs: dict | None = None) -> bytes | str:
+    '''
+    Call a catalog API generically. Each argument goes where its input's 'in' says: path
+    placeholder, query string, header or JSON body; inputs without 'in' (hand-written
+    entries) go to the query string on GET and to the body otherwise.
+    '''
+    arguments = {key: value for key, value in arguments.items()
+                 if key not in ('fields', 'skipUnchanged') and value is not None}
+    locations = {api_input['name']: api_input.get('in') for api_input in _catalog_inputs(api, shared_inputs or {})}
+    use_apim = bool(api.get('useApimGateway'))
+    client = globals().get('_apim_client' if use_apim else '_http_client')
+    if client is None:
+        return json.dumps({'error': 'HTTP client not initialized'})
+
+    path_match = re.search(r"f?['\"](/[^'\"\s]+)['\"]", api.get('pythonExample', '')) if use_apim else None
+    target = path_match.group(1) if path_match else api.get('apimPath') or api.get('endpoint', '')
+    for name in re.findall(r'\{(\w+)\}', target):
+        target = target.replace('{' + name + '}', urllib.parse.quote(str(arguments.pop(name, '')), safe=''))
+
+    method = str(api.get('method', 'GET')).upper()
+    default_location = 'query' if method == 'GET' else 'body'
+    params, headers, body = {}, {}, {}
+    for name, value in arguments.items():
+        location = locations.get(name) or default_location
+        if location == 'query':
+            params[name] = value
+        elif location == 'header':
+            headers[name] = str(value)
+        else:
+            body[name] = value
+
+    # Set last, so catalog inputs cannot replace them
+    headers['Accept'] = 'application/json'
+    if use_apim:
+        headers['Ocp-Apim-Subscription-Key'] = globals().get('APIM_SUBSCRIPTION_KEY', '')
+    elif globals().get('BEARER_TOKEN'):
+        headers['Authorization'] = f"Bearer {globals()['BEARER_TOKEN']}"
+
+    try:
+        resp = await client.request(method, target, headers=headers, params=params or None,
+                                    json=body if body else None)
+        resp.raise_for_status()
+        return resp.content
+    except Exception as e:
+        return json.dumps({'error': str(e)})
+
+
+class CatalogRegistry:
+    '''Active/inactive catalog APIs; reload() swaps the whole state in one assignment'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.initial_names: set[str] | None = None
+        # (active APIs by name, shared inputs, names hidden from the generated tools)
+        self.state: tuple[dict, dict, set] = ({}, {}, set())
+
+    def reload(self) -> bool:
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+        apis = catalog.get('apis', [])
+        active = {api['name']: api for api in apis if api.get('name') and api.get('active', False)}
+        hidden = {api['name'] for api in apis if api.get('name') and not api.get('active', False)}
+        if self.initial_names is None:
+            self.initial_names = set(active)
+        hidden |= self.initial_names - set(active)
+        self.state = (active, catalog.get('sharedInputs', {}), hidden)
+        self.mtime = mtime
+        return True
+
+
+def _tool_result(text: str) -> mcp_types.ServerResult:
+    return mcp_types.ServerResult(mcp_types.CallToolResult(content=[mcp_types.TextContent(type='text', text=text)]))
+
+
+async def enable_catalog_hot_reload(server) -> None:
+    '''
+    Serve tools from MCP_CATALOG_PATH on top of the generated ones and follow changes to it:
+    disabled APIs disappear, new active APIs are served by catalog_impl, and every session
+    gets notifications/tools/list_changed. HTTP clients, pools and caches are untouched.
+    '''
+    if not MCP_CATALOG_PATH:
+        return
+
+    registry = CatalogRegistry(MCP_CATALOG_PATH)
+    registry.reload()
+    list_handler = server.request_handlers[mcp_types.ListToolsRequest]
+    call_handler = server.request_handlers[mcp_types.CallToolRequest]
+    generated = await list_handler(mcp_types.ListToolsRequest(method='tools/list'))
+    generated_names = {tool.name for tool in generated.root.tools}
+    sessions = weakref.WeakSet()
+
+    def remember_session() -> None:
+        try:
+            sessions.add(server.request_context.session)
+        except LookupError:
+            pass
+
+    def base_name(name: str) -> str:
+        return name[:-len('_batch')] if name.endswith('_batch') else name
+
+    async def list_tools(request):
+        remember_session()
+        active, shared_inputs, hidden = registry.state
+        result = await list_handler(request)
+        tools = [tool for tool in result.root.tools if base_name(tool.name) not in hidden]
+        for name, api in active.items():
+            if name in generated_names:
+                continue
+            schema = catalog_tool_schema(api, shared_inputs)
+            tools.append(mcp_types.Tool(name=name, description=api.get('description', ''), inputSchema=schema))
+            tools.append(mcp_types.Tool(name=f'{name}_batch', description=f'Batch variant of {name}: one call per item, run concurrently.',
+                                        inputSchema=batch_schema(schema)))
+        return mcp_types.ServerResult(mcp_types.ListToolsResult(tools=tools))
+
+    async def call_tool(request):
+        remember_session()
+        active, shared_inputs, hidden = registry.state
+        name = request.params.name
+        arguments = request.params.arguments or {}
+        if base_name(name) in hidden:
+            return _tool_result(json.dumps({'error': f'Tool {name} is disabled in the API catalog'}))
+        api = active.get(base_name(name))
+        if api is None or name in generated_names:
+            return await call_handler(request)
+        if name.endswith('_batch'):
+            async def impl(**item):
+                return await catalog_impl(api, item, shared_inputs)
+            return _tool_result(await run_batch(impl, arguments.get('items', []), arguments.get('fields')))
+        result = await catalog_impl(api, arguments, shared_inputs)
+        return _tool_result(project_fields(result, arguments.get('fields'), arguments.get('skipUnchanged', False)))
+
+    server.request_handlers[mcp_types.ListToolsRequest] = list_tools
+    server.request_handlers[mcp_types.CallToolRequest] = call_tool
+
+    # Advertise tools.listChanged for stdio and HTTP sessions alike
+    create_initialization_options = server.create_initialization_options
+    server.create_initialization_options = lambda notification_options=None, experimental_capabilities=None: (
+        create_initialization_options(notification_options or NotificationOptions(tools_changed=True),
+                                      experimental_capabilities or {})
+    )
+
+    async def watch_catalog() -> None:
+        while True:
+            await asyncio.sleep(MCP_CATALOG_POLL_SECONDS)
+            try:
+                changed = await asyncio.to_thread(registry.reload)
+            except Exception as e:
+                print(f'Catalog reload failed, keeping previous tools: {e}', file=sys.stderr)
+                continue
+            if not changed:
+                continue
+            print(f'Catalog reloaded: {len(registry.state[0])} active APIs', file=sys.stderr)
+            for session in list(sessions):
+                try:
+                    await session.send_tool_list_changed()
+                except Exception:
+                    sessions.discard(session)
+
+    # Keep a reference so the watcher task is not garbage collected
+    server.catalog_watcher = asyncio.get_running_loop().create_task(watch_catalog())
+"""
+
+# Injected into every generated server; used when a client asks for a streamed tool call
+SERVER_STREAMING_HELPERS = r"""# ============================================================================
+# STREAMED ARRAY ITEMS - INJECTED BY mcp_servers_generator.py (do not edit)
+# ============================================================================
+
+import re
+
+# Tool argument (removed before the tool sees it) naming the response array to stream
+STREAM_ITEMS_ARGUMENT = '_streamItems'
+
+_JSON_STRUCTURE = re.compile(rb'["{}\[\],]')
+_JSON_STRING_STOP = re.compile(rb'["\\]')
+_JSON_ARRAY_OPEN = re.compile(rb'\s*:\s*\[')
+
+
+class JsonArrayStreamParser:
+    '''
+    Incremental extractor of the elements of the array stored under a key, e.g.
+    {"implInvoiceLists": [{...}, {...}]}. feed() takes the body chunk by chunk and returns
+    the elements completed so far; consumed bytes are dropped, so memory stays at about
+    one element. The key is matched textually (first occurrence followed by ': [').
+    '''
+
+    def __init__(self, key: str):
+        self.pattern = b'"' + key.encode('utf-8') + b'"'
+        self.buffer = bytearray()
+        self.pos = 0
+        self.state = 'seek'
+        self.start = 0
+        self.depth = 0
+        self.in_string = False
+
+    def feed(self, chunk: bytes) -> list:
+        self.buffer += chunk
+        items = []
+        while self.state != 'done':
+            if self.state == 'seek' and not self._seek():
+                break
+            if self.state == 'between' and not self._between():
+                break
+            if self.state == 'element':
+                end = self._element()
+                if end is None:
+                    break
+                items.append(json_loads(bytes(self.buffer[self.start:end])))
+                del self.buffer[:end]
+                self.pos = 0
+                self.state = 'between' if self.state == 'element' else self.state
+        return items
+
+    def _seek(self) -> bool:
+        index = self.buffer.find(self.pattern, self.pos)
+        if index < 0:
+            # Keep a tail long enough for a key split across chunks
+            keep = len(self.pattern) - 1
+            del self.buffer[:max(len(self.buffer) - keep, 0)]
+            self.pos = 0
+            return False
+        match = _JSON_ARRAY_OPEN.match(self.buffer, index + len(self.pattern))
+        if match is None:
+            if re.fullmatch(rb'\s*(:\s*)?', bytes(self.buffer[index + len(self.pattern):])):
+                # ': [' not received yet
+                self.pos = index
+                return False
+            self.pos = index + 1
+            return True
+        del self.buffer[:match.end()]
+        self.pos = 0
+        self.state = 'between'
+        return True
+
+    def _between(self) -> bool:
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in b' \t\r\n,':
+            self.pos += 1
+        if self.pos >= len(self.buffer):
+            return False
+        if self.buffer[self.pos] == ord(']'):
+            self.state = 'done'
+            self.buffer.clear()
+            return False
+        self.start = self.pos
+        self.depth = 0
+        self.in_string = False
+        self.state = 'element'
+        return True
+
+    def _element(self) -> int | None:
+        '''End offset of the current element, or None until more bytes arrive'''
+        while True:
+            if self.in_string:
+                match = _JSON_STRING_STOP.search(self.buffer, self.pos)
+                if match is None:
+                    self.pos = len(self.buffer)
+                    return None
+                if match.group() == b'\\':
+                    if match.end() >= len(self.buffer):
+                        self.pos = match.start()
+                        return None
+                    self.pos = match.end() + 1
+                    continue
+                self.in_string = False
+                self.pos = match.end()
+                continue
+            match = _JSON_STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                return None
+            char = match.group()
+            self.pos = match.end()
+            if char == b'"':
+                self.in_string = True
+            elif char in (b'{', b'['):
+                self.depth += 1
+            elif char in (b'}', b']'):
+                self.depth -= 1
+                if self.depth == 0:
+                    return match.end()
+                if self.depth < 0:
+                    # ']' closing the array right after a scalar element
+                    self.state = 'done'
+                    return match.start()
+            elif self.depth == 0:
+                # ',' after a scalar element
+                return match.start()
+
+
+# Set by enable_item_streaming() for the duration of one streamed tool call
+_stream_sink: contextvars.ContextVar[dict | None] = contextvars.ContextVar('stream_sink', default=None)
+
+
+class _ItemStream(httpx.AsyncByteStream):
+    '''
+    Response body stream that hands every completed array element to the sink as it arrives.
+    Bytes are only kept until the first element is found, so a body without the array (an
+    error payload, an empty list) still reaches the tool unchanged; once elements are streamed
+    the tool gets an empty body and peak memory is about one element.
+    '''
+
+    def __init__(self, stream, sink: dict):
+        self._stream = stream
+        self._sink = sink
+        self._parser = JsonArrayStreamParser(sink['key'])
+
+    async def __aiter__(self):
+        pending = []
+        async for chunk in self._stream:
+            for item in self._parser.feed(chunk):
+                await self._sink['emit'](item)
+            if self._sink['count']:
+                pending.clear()
+            else:
+                pending.append(chunk)
+        for chunk in pending:
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+async def _stream_request(request: httpx.Request) -> None:
+    # The tee sees the bytes before httpx decodes them, so ask for an unencoded body
+    if _stream_sink.get() is not None:
+        request.headers['Accept-Encoding'] = 'identity'
+
+
+async def _stream_response(response: httpx.Response) -> None:
+    sink = _stream_sink.get()
+    if sink is None or response.status_code != 200 or sink['started']:
+        return
+    if sink['skip_unchanged'] and response_unchanged():
+        # 304 answered from the cache: the tool returns {"unchanged": true}, nothing to stream
+        return
+    sink['started'] = True
+    response.stream = _ItemStream(response.stream, sink)
+
+
+def enable_item_streaming(server) -> None:
+    '''
+    Streamed tool calls: when the arguments carry _streamItems (the array key) and the
+    request has a progressToken, every element of that array is sent as a progress
+    notification (message = the element as JSON, projected with 'fields') while the backend
+    body is still downloading, and the body itself is never held in memory. The tool result
+    is then {"streamed": n, "key": ...}; calls that stream nothing (errors, unchanged data,
+    empty lists) return the normal result. With skipUnchanged, data found unchanged only
+    once the whole body was hashed still returns {"unchanged": true}.
+    '''
+    call_handler = server.request_handlers[mcp_types.CallToolRequest]
+
+    async def call_tool(request):
+        arguments = request.params.arguments or {}
+        key = arguments.pop(STREAM_ITEMS_ARGUMENT, None)
+        context = server.request_context
+        progress_token = context.meta.progressToken if context.meta is not None else None
+        if not key or progress_token is None:
+            return await call_handler(request)
+
+        tree = _fields_tree(arguments.get('fields'))
+        item_tree = tree.get(key) if tree else None
+        sink = {'key': key, 'started': False, 'count': 0, 'skip_unchanged': bool(arguments.get('skipUnchanged'))}
+
+        async def emit(item) -> None:
+            sink['count'] += 1
+            await context.session.send_progress_notification(
+                progress_token, sink['count'], message=json_dumps(_apply_projection(item, item_tree)),
+                related_request_id=context.request_id
+            )
+
+        sink['emit'] = emit
+        token = _stream_sink.set(sink)
+        try:
+            result = await call_handler(request)
+        finally:
+            _stream_sink.reset(token)
+        if not sink['count']:
+            return result
+        if sink['skip_unchanged'] and response_unchanged():
+            return _tool_result(json_dumps({'unchanged': True}))
+        return _tool_result(json_dumps({'streamed': sink['count'], 'key': key}))
+
+    server.request_handlers[mcp_types.CallToolRequest] = call_tool
+"""
+
+
+def inject_runtime_helpers(generated_code, http_transport=False):
+    """Insert SERVER_RUNTIME_HELPERS (and the catalog/streaming/transport helpers) after the leading imports of the generated server."""
+
+    if RUNTIME_HELPERS_MARKER in generated_code:
+        return generated_code
+
+    helpers = SERVER_RUNTIME_HELPERS + "\n\n" + SERVER_CATALOG_RELOAD_HELPERS + "\n\n" + SERVER_STREAMING_HELPERS
+    if http_transport:
+        helpers += "\n\n" + SERVER_HTTP_TRANSPORT_HELPERS
+
+    # A bare load_dotenv() walks the caller's frames to find the script directory and fails
+    # inside the precompiled zipapp (no source file on disk); search from the working directory
+    if re.search(r"^from dotenv import load_dotenv[ \t]*$", generated_code, flags=re.MULTILINE):
+        generated_code = re.sub(r"^from dotenv import load_dotenv[ \t]*$", "from dotenv import find_dotenv, load_dotenv",
+                                generated_code, count=1, flags=re.MULTILINE)
+        generated_code = re.sub(r"^load_dotenv\(\)", "load_dotenv(find_dotenv(usecwd=True))",
+                                generated_code, flags=re.MULTILINE)
+
+    lines = generated_code.splitlines(keepends=True)
+    insert_at = 0
+    try:
+        tree = ast.parse(generated_code)
+    except SyntaxError:
+        tree = None
+
+    if tree is not None:
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                insert_at = node.end_lineno
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                break
+
+    return "".join(lines[:insert_at]) + "\n" + helpers + "\n" + "".join(lines[insert_at:])
+
+
+def _summarize_sample_curl(sample_curl):
+    """Reduce a sample curl command to its URL and header lines, with secret values removed."""
+
+    summary = {}
+    url_match = re.search(r"https?://[^\s'\"]+", sample_curl)
+    if url_match:
+        summary["curlUrl"] = url_match.group(0)
+
+    headers = []
+    for name, value in re.findall(r"-H\s+['\"]([^:'\"]+):\s*([^'\"]*)['\"]", sample_curl):
+        name = name.strip()
+        if name.lower() == "authorization":
+            value = value.split(" ")[0]
+        elif "key" in name.lower() or "token" in name.lower():
+            value = "..."
+        headers.append(f"{name}: {value}".strip())
+    if headers:
+        summary["curlHeaders"] = headers
+    return summary
+
+
+def _summarize_python_example(python_example):
+    """Extract the relative APIM path pattern (e.g. /bill/V2/retriveInvoice/{customerId})."""
+
+    path_match = re.search(r"f?['\"](/[^'\"\s]+)['\"]", python_example)
+    return {"apimPath": path_match.group(1)} if path_match else {}
+
+
+def compact_api_catalog(api_catalog):
+    """
+    Reduce the catalog to what the server generator needs.
+
+    Inactive and duplicate APIs are dropped, only CATALOG_FIELDS are kept, sampleCurl and
+    pythonExample are replaced by the URL, headers and path they encode, and input
+    definitions repeated across APIs are hoisted into 'sharedInputs' and referenced by name.
+    """
+
+    apis_by_name = {}
+    for api in api_catalog.get("apis", []):
+        if api.get("active", False):
+            apis_by_name[api.get("name")] = api
+
+    compact_apis = []
+    for api in apis_by_name.values():
+        entry = {key: api[key] for key in CATALOG_FIELDS if api.get(key) not in (None, "", [], {})}
+        if api.get("sampleCurl"):
+            entry.update(_summarize_sample_curl(api["sampleCurl"]))
+        if api.get("pythonExample"):
+            entry.update(_summarize_python_example(api["pythonExample"]))
+        if "inputs" in entry:
+            entry["inputs"] = [
+                {key: value for key, value in api_input.items() if value not in (None, "", [], {})}
+                if isinstance(api_input, dict) else api_input
+                for api_input in entry["inputs"]
+            ]
+        compact_apis.append(entry)
+
+    # Hoist input definitions that appear unchanged in more than one API
+    input_counts = {}
+    for entry in compact_apis:
+        for api_input in entry.get("inputs", []):
+            if isinstance(api_input, dict) and "name" in api_input:
+                key = json.dumps(api_input, sort_keys=True)
+                input_counts[key] = input_counts.get(key, 0) + 1
+
+    shared_inputs = {}
+    for key, count in input_counts.items():
+        api_input = json.loads(key)
+        if count > 1 and api_input["name"] not in shared_inputs:
+            shared_inputs[api_input["name"]] = api_input
+
+    for entry in compact_apis:
+        if "inputs" in entry:
+            entry["inputs"] = [
+                api_input["name"]
+                if isinstance(api_input, dict) and shared_inputs.get(api_input.get("name")) == api_input
+                else api_input
+                for api_input in entry["inputs"]
+            ]
+
+    compact_catalog = {"apis": compact_apis}
+    if shared_inputs:
+        compact_catalog["sharedInputs"] = shared_inputs
+    return compact_catalog
+
+
+def _find_function(body, name):
+    """Return the (async) function definition called name from a list of statements."""
+
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == name:
+            return node
+    raise ValueError(f"generated server has no {name}() function")
+
+
+def _server_sections(module):
+    """Locate main(), the list_tools() return list and the call_tool() if/elif chain."""
+
+    main_def = _find_function(module.body, "main")
+    list_tools = _find_function(main_def.body, "list_tools")
+    call_tool = _find_function(main_def.body, "call_tool")
+
+    tools_list = next((node.value for node in ast.walk(list_tools)
+                       if isinstance(node, ast.Return) and isinstance(node.value, ast.List)), None)
+    routing = next((node for node in call_tool.body if isinstance(node, ast.If)), None)
+    if tools_list is None or routing is None:
+        raise ValueError("generated server does not follow the list_tools/call_tool structure")
+    return main_def, tools_list, routing
+
+
+def merge_generated_servers(codes):
+    """
+    Merge servers generated from separate catalog slices into one module.
+
+    The first server is kept as the base; the implementation functions, schema
+    constants, Tool entries and call_tool branches of the others are spliced into it.
+    """
+
+    if len(codes) == 1:
+        return codes[0]
+
+    base = ast.parse(codes[0])
+    base_main, base_tools, base_routing = _server_sections(base)
+    known = {node.name for node in base.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    known |= {target.id for node in base.body if isinstance(node, ast.Assign)
+              for target in node.targets if isinstance(target, ast.Name)}
+
+    last_branch = base_routing
+    while len(last_branch.orelse) == 1 and isinstance(last_branch.orelse[0], ast.If):
+        last_branch = last_branch.orelse[0]
+
+    for code in codes[1:]:
+        module = ast.parse(code)
+        _, tools, routing = _server_sections(module)
+
+        definitions = []
+        for node in module.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.endswith("_impl"):
+                names = {node.name}
+            elif isinstance(node, ast.Assign):
+                names = {target.id for target in node.targets if isinstance(target, ast.Name)}
+                if not any(name.endswith("_SCHEMA") for name in names):
+                    continue
+            else:
+                continue
+            if not names & known:
+                definitions.append(node)
+                known |= names
+        main_index = base.body.index(base_main)
+        base.body[main_index:main_index] = definitions
+
+        base_tools.elts.extend(tools.elts)
+
+        branch = routing
+        while True:
+            new_branch = ast.If(test=branch.test, body=branch.body, orelse=last_branch.orelse)
+            last_branch.orelse = [new_branch]
+            last_branch = new_branch
+            if len(branch.orelse) == 1 and isinstance(branch.orelse[0], ast.If):
+                branch = branch.orelse[0]
+            else:
+                break
+
+    return ast.unparse(ast.fix_missing_locations(base)) + "\n"
+
+
+def create_mcp_generation_instructions(http_transport=False):
+    """
+    Create the static part of the MCP server generation prompt.
     
-    api_catalog_json = json.dumps(api_catalog, indent=2)
+    It does not depend on the catalog, so it is sent first and every request of a
+    run (and of later runs) shares the same prefix for provider-side prompt caching.
+    """
     
-    prompt = ("You are an expert Python developer specializing in creating MCP (Model Context Protocol) servers.\n\n"
-              "OBJECTIVE: Generate ONE complete Python MCP server file that includes ALL active APIs from the catalog.\n"
+    if http_transport:
+        run_block = ("        if selected_transport() == 'http':\n"
+                     "            await run_http_server(server)\n"
+                     "        else:\n"
+                     "            async with stdio_server() as (read_stream, write_stream):\n"
+                     "                await server.run(read_stream, write_stream, server.create_initialization_options())\n")
+        transport_instructions = ("10. TRANSPORT:\n"
+                                  "   - selected_transport() and run_http_server() are injected runtime helpers\n"
+                                  "   - Keep the stdio/http branch in main() EXACTLY as shown\n\n")
+    else:
+        run_block = ("        async with stdio_server() as (read_stream, write_stream):\n"
+                     "            await server.run(read_stream, write_stream, server.create_initialization_options())\n")
+        transport_instructions = ""
+    
+    instructions = ("You are an expert Python developer specializing in creating MCP (Model Context Protocol) servers.\n\n"
+              "OBJECTIVE: Generate ONE complete Python MCP server file that includes ALL APIs from the API CATALOG at the end.\n"
               "Each API will have its own implementation function and tool definition in the SAME file.\n\n"
               "REQUIREMENTS:\n"
-              "1. Include ONLY APIs where 'active' field is true\n"
+              "1. The catalog already contains ONLY active APIs - include every one of them\n"
               "2. Create ONE implementation function per active API (e.g., async def deuda_fija_impl(...))\n"
-              "3. Create ONE Tool definition per active API in the @server.list_tools() decorator\n"
+              "3. Create ONE Tool definition per active API (plus its '_batch' variant) in the @server.list_tools() decorator\n"
               "4. Handle each API in the @server.call_tool() if/elif chain\n"
               "5. Use httpx AsyncClient with proper base_url configuration\n"
               "6. Handle both direct APIs and APIM Gateway APIs correctly\n"
-              "7. Return all responses as JSON strings from implementation functions\n\n"
-              "API CATALOG:\n" + api_catalog_json + "\n\n"
+              "7. Return all responses as JSON strings from implementation functions\n"
+              "8. Every tool accepts an optional 'fields' projection argument (see FIELD PROJECTION below)\n"
+              "9. Every active API ALSO gets a '<name>_batch' tool (see BATCH TOOLS below)\n\n"
               "CRITICAL - FOLLOW THIS EXACT STRUCTURE:\n\n"
               "import os\n"
               "import urllib.parse\n"
@@ -33,11 +1203,11 @@ def create_mcp_generation_prompt(api_catalog):
               "from typing import Any\n"
               "import asyncio\n"
               "import httpx\n"
-              "from dotenv import load_dotenv\n"
+              "from dotenv import find_dotenv, load_dotenv\n"
               "from mcp.server import Server\n"
               "from mcp.server.stdio import stdio_server\n"
               "from mcp.types import Tool, TextContent\n\n"
-              "load_dotenv()\n\n"
+              "load_dotenv(find_dotenv(usecwd=True))\n\n"
               "# Configuration - Load ALL required environment variables\n"
               "APIM_TIMEOUT = float(os.getenv('APIM_TIMEOUT', '15.0'))\n"
               "BEARER_TOKEN = os.getenv('BEARER_TOKEN', '').strip()\n"
@@ -50,9 +1220,9 @@ def create_mcp_generation_prompt(api_catalog):
               "    '''Initialize HTTP clients for direct and APIM APIs'''\n"
               "    global _http_client, _apim_client\n"
               "    if _http_client is None:\n"
-              "        _http_client = httpx.AsyncClient(timeout=APIM_TIMEOUT)\n"
+              "        _http_client = httpx.AsyncClient(timeout=APIM_TIMEOUT, **http_client_options())\n"
               "    if _apim_client is None and APIM_BASE_URL:\n"
-              "        _apim_client = httpx.AsyncClient(base_url=APIM_BASE_URL, timeout=APIM_TIMEOUT)\n\n"
+              "        _apim_client = httpx.AsyncClient(base_url=APIM_BASE_URL, timeout=APIM_TIMEOUT, **http_client_options())\n\n"
               "async def cleanup_http_client() -> None:\n"
               "    '''Cleanup all HTTP clients'''\n"
               "    global _http_client, _apim_client\n"
@@ -62,11 +1232,15 @@ def create_mcp_generation_prompt(api_catalog):
               "    if _apim_client:\n"
               "        await _apim_client.aclose()\n"
               "        _apim_client = None\n\n"
+              "# RUNTIME HELPERS (FIELDS_SCHEMA, SKIP_UNCHANGED_SCHEMA, project_fields, http_client_options, batch_schema, run_batch,\n"
+              "# enable_catalog_hot_reload, enable_item_streaming, enable_profiling, enable_tracing)\n"
+              "# are injected automatically\n"
+              "# after the imports by the generator - do NOT define them yourself.\n\n"
               "# ============================================================================\n"
               "# API IMPLEMENTATION FUNCTIONS - ONE PER ACTIVE API\n"
               "# ============================================================================\n\n"
               "# Example for direct API with Bearer token:\n"
-              "# async def deuda_fija_impl(customerIdentification: str, type: str, document: str) -> str:\n"
+              "# async def deuda_fija_impl(customerIdentification: str, type: str, document: str) -> bytes | str:\n"
               "#     '''Retrieves documents to pay for a customer'''\n"
               "#     if not _http_client:\n"
               "#         return json.dumps({'error': 'HTTP client not initialized'})\n"
@@ -84,11 +1258,11 @@ def create_mcp_generation_prompt(api_catalog):
               "#     try:\n"
               "#         resp = await _http_client.get(url, headers=headers, params=params)\n"
               "#         resp.raise_for_status()\n"
-              "#         return resp.text\n"
+              "#         return resp.content\n"
               "#     except Exception as e:\n"
               "#         return json.dumps({'error': str(e)})\n\n"
               "# Example for APIM Gateway API (when useApimGateway=true and pythonExample provided):\n"
-              "# async def listado_de_boletas_fija_impl(customerId: int, msisidn: str) -> str:\n"
+              "# async def listado_de_boletas_fija_impl(customerId: int, msisidn: str) -> bytes | str:\n"
               "#     '''Retrieves a list of invoices for a customer via APIM Gateway'''\n"
               "#     if not _apim_client:\n"
               "#         return json.dumps({'error': 'APIM client not initialized'})\n"
@@ -103,9 +1277,33 @@ def create_mcp_generation_prompt(api_catalog):
               "#     try:\n"
               "#         resp = await _apim_client.get(path, headers=headers, params=params)\n"
               "#         resp.raise_for_status()\n"
-              "#         return resp.text\n"
+              "#         return resp.content\n"
               "#     except Exception as e:\n"
               "#         return json.dumps({'error': str(e)})\n\n"
+              "# ============================================================================\n"
+              "# INPUT SCHEMAS - ONE MODULE-LEVEL CONSTANT PER ACTIVE API\n"
+              "# ============================================================================\n\n"
+              "# DEUDA_FIJA_SCHEMA = {\n"
+              "#     'type': 'object',\n"
+              "#     'properties': {\n"
+              "#         'customerIdentification': {'type': 'string', 'description': '...'},\n"
+              "#         'type': {'type': 'string', 'description': '...'},\n"
+              "#         'document': {'type': 'string', 'description': '...'},\n"
+              "#         'fields': FIELDS_SCHEMA,\n"
+              "#         'skipUnchanged': SKIP_UNCHANGED_SCHEMA\n"
+              "#     },\n"
+              "#     'required': ['customerIdentification', 'type', 'document']\n"
+              "# }\n\n"
+              "# LISTADO_DE_BOLETAS_FIJA_SCHEMA = {\n"
+              "#     'type': 'object',\n"
+              "#     'properties': {\n"
+              "#         'customerId': {'type': 'integer', 'description': '...'},\n"
+              "#         'msisidn': {'type': 'string', 'description': '...'},\n"
+              "#         'fields': FIELDS_SCHEMA,\n"
+              "#         'skipUnchanged': SKIP_UNCHANGED_SCHEMA\n"
+              "#     },\n"
+              "#     'required': ['customerId', 'msisidn']\n"
+              "# }\n\n"
               "async def main():\n"
               "    '''Main entry point - creates server with ALL active API tools'''\n"
               "    server = Server('telefonica-api-mcp')\n"
@@ -118,28 +1316,23 @@ def create_mcp_generation_prompt(api_catalog):
               "            # Tool(\n"
               "            #     name='deuda_fija',\n"
               "            #     description='Retrieves documents to pay for a customer.',\n"
-              "            #     inputSchema={\n"
-              "            #         'type': 'object',\n"
-              "            #         'properties': {\n"
-              "            #             'customerIdentification': {'type': 'string', 'description': '...'},\n"
-              "            #             'type': {'type': 'string', 'description': '...'},\n"
-              "            #             'document': {'type': 'string', 'description': '...'}\n"
-              "            #         },\n"
-              "            #         'required': ['customerIdentification', 'type', 'document']\n"
-              "            #     }\n"
+              "            #     inputSchema=DEUDA_FIJA_SCHEMA\n"
+              "            # ),\n"
+              "            # Tool(\n"
+              "            #     name='deuda_fija_batch',\n"
+              "            #     description='Batch variant of deuda_fija: one call per item, run concurrently.',\n"
+              "            #     inputSchema=batch_schema(DEUDA_FIJA_SCHEMA)\n"
               "            # ),\n"
               "            # Example Tool 2 - APIM Gateway API:\n"
               "            # Tool(\n"
               "            #     name='listado_de_boletas_fija',\n"
               "            #     description='Retrieves a list of invoices for a customer.',\n"
-              "            #     inputSchema={\n"
-              "            #         'type': 'object',\n"
-              "            #         'properties': {\n"
-              "            #             'customerId': {'type': 'integer', 'description': '...'},\n"
-              "            #             'msisidn': {'type': 'string', 'description': '...'}\n"
-              "            #         },\n"
-              "            #         'required': ['customerId', 'msisidn']\n"
-              "            #     }\n"
+              "            #     inputSchema=LISTADO_DE_BOLETAS_FIJA_SCHEMA\n"
+              "            # ),\n"
+              "            # Tool(\n"
+              "            #     name='listado_de_boletas_fija_batch',\n"
+              "            #     description='Batch variant of listado_de_boletas_fija: one call per item, run concurrently.',\n"
+              "            #     inputSchema=batch_schema(LISTADO_DE_BOLETAS_FIJA_SCHEMA)\n"
               "            # )\n"
               "            # ... ADD ALL OTHER ACTIVE APIS HERE\n"
               "        ]\n"
@@ -154,25 +1347,30 @@ def create_mcp_generation_prompt(api_catalog):
               "        #         type=arguments.get('type'),\n"
               "        #         document=arguments.get('document')\n"
               "        #     )\n"
-              "        #     return [TextContent(type='text', text=result)]\n"
+              "        #     return [TextContent(type='text', text=project_fields(result, arguments.get('fields'), arguments.get('skipUnchanged', False)))]\n"
               "        # elif name == 'listado_de_boletas_fija':\n"
               "        #     result = await listado_de_boletas_fija_impl(\n"
               "        #         customerId=arguments.get('customerId'),\n"
               "        #         msisidn=arguments.get('msisidn')\n"
               "        #     )\n"
+              "        #     return [TextContent(type='text', text=project_fields(result, arguments.get('fields'), arguments.get('skipUnchanged', False)))]\n"
+              "        # elif name == 'listado_de_boletas_fija_batch':\n"
+              "        #     result = await run_batch(listado_de_boletas_fija_impl, arguments.get('items', []), arguments.get('fields'))\n"
               "        #     return [TextContent(type='text', text=result)]\n"
               "        # elif name == 'another_api':\n"
               "        #     result = await another_api_impl(...)\n"
-              "        #     return [TextContent(type='text', text=result)]\n"
+              "        #     return [TextContent(type='text', text=project_fields(result, arguments.get('fields'), arguments.get('skipUnchanged', False)))]\n"
               "        # else:\n"
               "        #     raise ValueError(f'Unknown tool: {name}')\n"
               "        pass\n"
               "    \n"
+              "    enable_profiling()\n"
               "    await initialize_http_client()\n"
+              "    await enable_catalog_hot_reload(server)\n"
+              "    enable_item_streaming(server)\n"
+              "    enable_tracing(server)\n"
               "    \n"
-              "    try:\n"
-              "        async with stdio_server() as (read_stream, write_stream):\n"
-              "            await server.run(read_stream, write_stream, server.create_initialization_options())\n"
+              "    try:\n" + run_block +
               "    finally:\n"
               "        await cleanup_http_client()\n\n"
               "if __name__ == '__main__':\n"
@@ -187,67 +1385,210 @@ def create_mcp_generation_prompt(api_catalog):
               "   A) DIRECT APIs (no useApimGateway or useApimGateway=false):\n"
               "      - Use _http_client (not _apim_client)\n"
               "      - Use FULL URL from 'endpoint' field\n"
-              "      - Parse sampleCurl for headers:\n"
-              "        * If sampleCurl has 'Authorization: Bearer', add: 'Authorization': f'Bearer {BEARER_TOKEN}'\n"
-              "        * If sampleCurl has other headers, include them\n"
+              "      - Use curlHeaders (the headers of the sample curl) for headers:\n"
+              "        * If curlHeaders has 'Authorization: Bearer', add: 'Authorization': f'Bearer {BEARER_TOKEN}'\n"
+              "        * If curlHeaders has other headers, include them\n"
               "      - For GET: use params dict\n"
               "      - For POST with form data: use data dict with Content-Type: application/x-www-form-urlencoded\n\n"
               "   B) APIM GATEWAY APIs (useApimGateway=true):\n"
               "      - Use _apim_client (already configured with base_url=APIM_BASE_URL)\n"
-              "      - Use RELATIVE path (from pythonExample or sampleCurl path part)\n"
+              "      - Use RELATIVE path (from apimPath or the path part of curlUrl)\n"
               "      - Example: f'/bill/V2/retriveInvoice/{customerId}'\n"
               "      - Headers: 'Accept': 'application/json', 'Ocp-Apim-Subscription-Key': APIM_SUBSCRIPTION_KEY\n"
-              "      - Follow pythonExample pattern EXACTLY if provided\n"
-              "      - Parse sampleCurl for path structure (IDs in path vs query params)\n\n"
+              "      - Follow apimPath (taken from the catalog pythonExample) EXACTLY if provided\n"
+              "      - Use curlUrl for path structure (IDs in path vs query params)\n\n"
               "3. URL PATH HANDLING:\n"
-              "   - Parse sampleCurl to detect path parameters\n"
-              "   - Example: 'curl .../retriveInvoice/181696144?msisidn=...' means:\n"
+              "   - Use curlUrl (the URL of the sample curl) to detect path parameters\n"
+              "   - Example: curlUrl '.../retriveInvoice/181696144?msisidn=...' means:\n"
               "     * customerId goes in PATH: f'/bill/V2/retriveInvoice/{customerId}'\n"
               "     * msisidn goes in PARAMS: params={'msisidn': msisidn}\n"
               "   - Use urllib.parse.quote() for URL encoding path parameters if needed\n\n"
               "4. INPUT PARAMETER MAPPING:\n"
               "   - Map each 'inputs' field to function parameters\n"
-              "   - Use exact names from 'inputs'[].name\n"
+              "   - Use exact names from 'inputs'[].name; an input given as a plain string is defined in 'sharedInputs'\n"
               "   - Use exact types: 'int' -> int, 'string' -> str, 'boolean' -> bool\n"
               "   - For parameters in path, don't add to params dict\n"
-              "   - For parameters in query string, add to params dict\n\n"
+              "   - For parameters in query string, add to params dict\n"
+              "   - An input's 'in' field gives its location: 'path' -> URL, 'query' -> params,\n"
+              "     'header' -> request headers (value as str), 'body' -> JSON body\n\n"
               "5. ERROR HANDLING:\n"
               "   - Wrap all HTTP calls in try/except\n"
               "   - Return JSON error objects: json.dumps({'error': 'message', 'details': ...})\n"
               "   - Check if clients are initialized\n"
               "   - Handle httpx.TimeoutException, httpx.HTTPError, general Exception\n\n"
               "6. RESPONSE HANDLING:\n"
-              "   - Return resp.text for successful responses (already JSON string)\n"
+              "   - Return resp.content for successful responses (raw JSON bytes - project_fields decodes them once)\n"
               "   - Return json.dumps(...) for error responses\n"
               "   - Do NOT parse JSON unless needed for error handling\n\n"
               "7. IMPORTANT - NO DECORATORS MISTAKES:\n"
               "   - NEVER use server.add_tool() - it doesn't exist\n"
               "   - MUST use @server.list_tools() decorator\n"
               "   - MUST use @server.call_tool() decorator\n\n"
+              "8. FIELD PROJECTION AND CHANGE DETECTION:\n"
+              "   - Add 'fields': FIELDS_SCHEMA and 'skipUnchanged': SKIP_UNCHANGED_SCHEMA to the 'properties' of EVERY\n"
+              "     Tool inputSchema (never to 'required')\n"
+              "   - Do NOT pass 'fields' or 'skipUnchanged' to the implementation functions\n"
+              "   - Wrap every successful result: TextContent(type='text', text=project_fields(result, arguments.get('fields'), arguments.get('skipUnchanged', False)))\n\n"
+              "9. BATCH TOOLS:\n"
+              "   - Define each API inputSchema ONCE as a module-level constant named <API_NAME_UPPER>_SCHEMA\n"
+              "   - For EVERY active API also list Tool(name='<api_name>_batch', inputSchema=batch_schema(<API_NAME_UPPER>_SCHEMA))\n"
+              "   - Route '<api_name>_batch' to: await run_batch(<api_name>_impl, arguments.get('items', []), arguments.get('fields'))\n"
+              "   - run_batch already returns the final JSON string - do NOT wrap it in project_fields\n\n"
+              + transport_instructions +
               "Generate ONLY the complete Python code. No explanations, no markdown, no comments outside the code - just pure Python code.")
 
     
-    return prompt
+    return instructions
+
+
+def create_mcp_generation_prompt(api_catalog, http_transport=False):
+    """Create a detailed prompt for Azure OpenAI to generate MCP server code."""
+    
+    compact_catalog = compact_api_catalog(api_catalog)
+    api_catalog_json = json.dumps(compact_catalog, ensure_ascii=False, separators=(",", ":"))
+    
+    return (create_mcp_generation_instructions(http_transport) + "\n\n"
+            "API CATALOG (minified JSON):\n" + api_catalog_json)
 
 
-def generate_mcp_server_code():
-    """Main function to generate MCP server code using Azure OpenAI."""
+def build_generation_prompts(api_catalog, http_transport=False, token_budget=None):
+    """
+    Split the active APIs into as few prompts as possible that each fit token_budget.
+    
+    Every prompt starts with the same static instructions, so after the first request
+    the shared prefix is served from the provider's prompt cache. Each prompt yields a
+    complete server for its slice of the catalog; merge_generated_servers() joins them.
+    
+    Each API is estimated once, as its own compact catalog entry, on top of the cost of the
+    empty prompt. The sum is an upper bound: hoisting shared inputs only shrinks a chunk.
+    """
+    
+    if token_budget is None:
+        token_budget = int(os.getenv("MCP_PROMPT_TOKEN_BUDGET", "6000"))
+    
+    active_apis = [api for api in api_catalog.get("apis", []) if api.get("active", False)]
+    base_tokens = estimate_tokens(create_mcp_generation_prompt({"apis": []}, http_transport))
+    
+    chunks = []
+    current, current_tokens = [], base_tokens
+    for api in active_apis:
+        entry = compact_api_catalog({"apis": [api]})["apis"]
+        # +1 for the separating comma
+        api_tokens = estimate_tokens(json.dumps(entry[0] if entry else {}, ensure_ascii=False,
+                                                separators=(",", ":"))) + 1
+        if current and current_tokens + api_tokens > token_budget:
+            chunks.append((current, current_tokens))
+            current, current_tokens = [], base_tokens
+        current.append(api)
+        current_tokens += api_tokens
+    if current:
+        chunks.append((current, current_tokens))
+    
+    prompts = []
+    for chunk, chunk_tokens in chunks:
+        if chunk_tokens > token_budget:
+            print(f"⚠ Warning: API {chunk[0].get('name')} alone exceeds the {token_budget} token budget "
+                  f"(static instructions use ~{base_tokens})")
+        prompts.append(create_mcp_generation_prompt({"apis": chunk}, http_transport))
+    
+    return prompts
+
+
+def validate_staged_server(staged_path, current_path):
+    """
+    Check a staged server before it replaces the current one.
+    
+    The code must compile, start, list its tools and answer every tool against the
+    local mock backend without errors, and must not be markedly slower than the
+    current server. Returns (accepted, benchmark_report).
+    """
+    
+    with open(staged_path, 'r', encoding='utf-8') as f:
+        code = f.read()
+    try:
+        compile(ast.parse(code, filename=staged_path), staged_path, "exec")
+    except SyntaxError as e:
+        print(f"✗ Generated code does not compile: {e}")
+        return False, None
+    print("✓ Code compiles")
+    
+    if os.getenv("MCP_STAGING_BENCHMARK", "true").lower() != "true":
+        print("⚠ Runtime benchmark skipped (MCP_STAGING_BENCHMARK=false)")
+        return True, None
+    
+    calls_per_tool = int(os.getenv("MCP_STAGING_CALLS_PER_TOOL", "3"))
+    print("⏳ Starting staged server against the mock backend...")
+    try:
+        report = run_benchmark(staged_path, calls_per_tool=calls_per_tool)
+    except Exception as e:
+        print(f"✗ Staged server failed to start or answer: {e!r}")
+        return False, None
+    print_report(report)
+    
+    if report["tool_count"] == 0:
+        print("✗ Staged server exposes no tools")
+        return False, report
+    if report["errors"]:
+        print(f"✗ {len(report['errors'])} tool call(s) failed against the mock backend")
+        return False, report
+    
+    if not os.path.exists(current_path):
+        return True, report
+    with open(current_path, 'r', encoding='utf-8') as f:
+        if "MCP_BACKEND_OVERRIDE" not in f.read():
+            # Older servers call direct-URL APIs on the real endpoints even against the mock
+            print("⚠ Current server has no MCP_BACKEND_OVERRIDE hook - skipping comparison")
+            return True, report
+    
+    print("⏳ Benchmarking the current server for comparison...")
+    try:
+        baseline = run_benchmark(current_path, calls_per_tool=calls_per_tool)
+    except Exception as e:
+        print(f"⚠ Current server could not be benchmarked ({e!r}) - skipping comparison")
+        return True, report
+    
+    max_slowdown = float(os.getenv("MCP_STAGING_MAX_SLOWDOWN", "1.5"))
+    regressions = compare_reports(report, baseline, max_slowdown)
+    report["baseline"] = {key: baseline.get(key) for key in ("cold_start_ms", "list_tools_ms", "mean_call_ms")}
+    if regressions:
+        print(f"✗ Staged server is more than {max_slowdown}x slower than the current one:")
+        for regression in regressions:
+            print(f"   - {regression}")
+        return False, report
+    
+    return True, report
+
+
+def generate_mcp_server_code(http_transport=None, domains=None, output_filename=SERVER_FILENAME, keep_files=()):
+    """
+    Main function to generate MCP server code using Azure OpenAI.
+    
+    domains limits the server to some catalog domains (default: MCP_CATALOG_DOMAINS) and
+    output_filename names the server; generate_sharded_mcp_servers() uses both for one
+    server per domain. Files in keep_files survive the clean-up of the output directory.
+    Returns the path of the saved server, or None if nothing was saved.
+    """
+    
+    if http_transport is None:
+        http_transport = os.getenv("MCP_SERVER_HTTP_TRANSPORT", "false").lower() == "true"
     
     print("Starting MCP Server Code Generation...")
     print("=" * 80)
     
     # Step 1: Read API catalog
     print("\n[Step 1] Reading API catalog...")
-    api_catalog_path = r"C:\TelefonicaProcessAgent\Data\api_catalog_modified_1765230841788.json"
+    api_catalog_path = API_CATALOG_PATH
     
     try:
         with open(api_catalog_path, 'r', encoding='utf-8') as f:
             api_catalog = json.load(f)
         print(f"✓ Loaded {len(api_catalog.get('apis', []))} APIs from catalog")
         
-        # Check for active APIs
-        active_apis = [api for api in api_catalog.get('apis', []) if api.get('active', False)]
-        print(f"✓ Found {len(active_apis)} active APIs:")
+        # Active APIs, optionally only some domains (indexed catalogs from openapi_catalog_importer.py)
+        if domains is None:
+            domains = [domain.strip() for domain in os.getenv("MCP_CATALOG_DOMAINS", "").split(",") if domain.strip()]
+        active_apis = load_catalog_slice(api_catalog, domains=domains or None)
+        print(f"✓ Found {len(active_apis)} active APIs" + (f" in {', '.join(domains)}:" if domains else ":"))
         for api in active_apis:
             print(f"  - {api['name']}: {api['description']}")
         
@@ -269,10 +1610,11 @@ def generate_mcp_server_code():
         print(f"✗ Error: Invalid JSON in API catalog: {e}")
         return
     
-    # Step 2: Create prompt
+    # Step 2: Create prompts (compact catalog, split to fit the token budget)
     print("\n[Step 2] Creating Azure OpenAI prompt...")
-    prompt = create_mcp_generation_prompt(filtered_catalog)
-    print(f"✓ Prompt created ({len(prompt)} characters)")
+    prompts = build_generation_prompts(filtered_catalog, http_transport=http_transport)
+    prompt_tokens = [estimate_tokens(prompt) for prompt in prompts]
+    print(f"✓ {len(prompts)} prompt(s) created (~{sum(prompt_tokens)} tokens: {prompt_tokens})")
     
     # Step 3: Set up Azure OpenAI client
     print("\n[Step 3] Setting up Azure OpenAI client...")
@@ -306,77 +1648,110 @@ def generate_mcp_server_code():
     print("⏳ This may take a minute...")
     
     try:
-        response = client.chat.completions.create(
-            model=deployment_name,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert Python developer specializing in MCP server development. Generate clean, production-ready code."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.3,
-            max_tokens=4000
-        )
-        
-        generated_code = response.choices[0].message.content
+        generated_parts = []
+        total_tokens = 0
+        continuations = 0
+        for index, prompt in enumerate(prompts, start=1):
+            if len(prompts) > 1:
+                print(f"   Request {index}/{len(prompts)}...")
+            # Streamed; truncated replies are continued and transient errors retried
+            part, usage = generate_code(
+                client,
+                deployment_name,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are an expert Python developer specializing in MCP server development. Generate clean, production-ready code."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                temperature=0.3,
+                max_tokens=4000
+            )
+            
+            generated_parts.append(part)
+            total_tokens += usage["total_tokens"]
+            continuations += usage["continuations"]
         
-        # Clean up the code if it has markdown formatting
-        if "```python" in generated_code:
-            generated_code = generated_code.split("```python")[1].split("```")[0].strip()
-        elif "```" in generated_code:
-            generated_code = generated_code.split("```")[1].split("```")[0].strip()
+        generated_code = merge_generated_servers(generated_parts)
+        generated_code = inject_runtime_helpers(generated_code, http_transport=http_transport)
         
         print(f"✓ Generated {len(generated_code)} characters of code")
-        print(f"✓ Tokens used: {response.usage.total_tokens}")
+        print(f"✓ Tokens used: {total_tokens} ({continuations} continuation(s))")
         
     except Exception as e:
         print(f"✗ Error calling Azure OpenAI: {e}")
         return
     
-    # Step 5: Save the generated code
-    print("\n[Step 5] Saving generated MCP server code...")
+    # Step 5: Validate the generated code in a staging directory
+    print("\n[Step 5] Validating generated MCP server in staging directory...")
     
     # Create output directory if it doesn't exist
-    output_dir = r"C:\TelefonicaProcessAgent\Data\SourceDesigned"
+    output_dir = OUTPUT_DIR
     os.makedirs(output_dir, exist_ok=True)
     
-    # Delete all existing files in the output directory (except the API catalog)
+    # Use a unique name without timestamp numbers
+    output_path = os.path.join(output_dir, output_filename)
+    
+    # Stage inside output_dir so the final os.replace() stays on one filesystem (atomic)
+    staging_dir = tempfile.mkdtemp(prefix=".staging_", dir=output_dir)
+    staged_path = os.path.join(staging_dir, output_filename)
+    with open(staged_path, 'w', encoding='utf-8') as f:
+        f.write(generated_code)
+    
+    accepted, benchmark = validate_staged_server(staged_path, output_path)
+    if not accepted:
+        print("✗ Generated server rejected - the current server was left untouched")
+        print(f"   Rejected code kept for review at: {staged_path}")
+        return
+    print("✓ Generated server accepted")
+    
+    # Step 6: Swap the staged server in, then remove stale files
+    print("\n[Step 6] Saving generated MCP server code...")
+    
+    try:
+        os.replace(staged_path, output_path)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"✓ Code saved to: {output_path}")
+    except Exception as e:
+        print(f"✗ Error saving files: {e}")
+        return
+    
+    # Delete all other existing files in the output directory (except the API catalog)
     print("🗑️  Deleting old files from output directory...")
     try:
         for filename in os.listdir(output_dir):
             file_path = os.path.join(output_dir, filename)
-            # Skip the API catalog file
-            if os.path.isfile(file_path) and not filename.startswith('api_catalog'):
+            # Skip the API catalog file, the server that was just swapped in and the other shards
+            if (os.path.isfile(file_path) and not filename.startswith('api_catalog')
+                    and filename != output_filename and filename not in keep_files):
                 os.remove(file_path)
                 print(f"   Deleted: {filename}")
         print("✓ Old files deleted successfully")
     except Exception as e:
         print(f"⚠️  Warning: Could not delete some files: {e}")
     
-    # Use a unique name without timestamp numbers
-    output_filename = "telefonica_mcp_server.py"
-    output_path = os.path.join(output_dir, output_filename)
-    
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(generated_code)
-        print(f"✓ Code saved to: {output_path}")
-        
         # Also save a metadata file
         metadata = {
             "generated_at": datetime.now().isoformat(),
             "api_catalog_file": api_catalog_path,
             "active_apis_count": len(active_apis),
             "active_apis": [api['name'] for api in active_apis],
-            "tokens_used": response.usage.total_tokens,
-            "model": deployment_name
+            "catalog_domains": domains,
+            "tokens_used": total_tokens,
+            "generation_requests": len(prompts),
+            "continuations": continuations,
+            "prompt_tokens_estimate": sum(prompt_tokens),
+            "model": deployment_name,
+            "transports": ["stdio", "http"] if http_transport else ["stdio"],
+            "benchmark": benchmark
         }
         
-        metadata_path = os.path.join(output_dir, "telefonica_mcp_metadata.json")
+        metadata_path = os.path.join(output_dir, metadata_filename(output_filename))
         with open(metadata_path, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=2)
         print(f"✓ Metadata saved to: {metadata_path}")
@@ -393,9 +1768,80 @@ def generate_mcp_server_code():
     print("   BEARER_TOKEN=your-bearer-token")
     print("   APIM_TIMEOUT=15.0")
     print("3. Install dependencies: pip install httpx python-dotenv mcp")
-    print("4. Test the MCP server")
+    print(f"4. Re-run the benchmark any time: python mcp_server_benchmark.py {output_path}")
+    if http_transport:
+        print("5. Run it as a shared service: python telefonica_mcp_server.py --transport http")
+        print("   and point clients at it with MCP_SERVER_URL=http://127.0.0.1:8765/mcp/")
+    print("=" * 80)
+    return output_path
+
+
+def generate_sharded_mcp_servers(http_transport=None):
+    """
+    Generate one server per catalog domain (telefonica_mcp_server_<domain>.py) and the
+    shard manifest the client generator turns into its tool router.
+    
+    Each shard only starts when a workflow calls one of its tools, and its agents only
+    see that shard's tools. APIs without a domain go to the 'default' shard.
+    """
+    
+    print("=" * 80)
+    print("SHARDED MCP SERVER GENERATION")
+    print("=" * 80)
+    
+    try:
+        with open(API_CATALOG_PATH, 'r', encoding='utf-8') as f:
+            api_catalog = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"✗ Error reading API catalog {API_CATALOG_PATH}: {e}")
+        return None
+    
+    shard_apis = {}
+    for api in load_catalog_slice(api_catalog):
+        shard_apis.setdefault(api.get("domain", "default"), []).append(api["name"])
+    if not shard_apis:
+        print("⚠ Warning: No active APIs found in catalog!")
+        return None
+    
+    shard_files = {domain: f"telefonica_mcp_server_{domain}.py" for domain in sorted(shard_apis)}
+    keep_files = {SHARD_MANIFEST} | set(shard_files.values()) | {metadata_filename(name) for name in shard_files.values()}
+    print(f"✓ {len(shard_files)} shard(s): " + ", ".join(f"{domain} ({len(shard_apis[domain])} APIs)"
+                                                     for domain in shard_files))
+    
+    shards = {}
+    for domain, filename in shard_files.items():
+        print(f"\n>>> Shard '{domain}' -> {filename}")
+        generate_mcp_server_code(http_transport=http_transport, domains=[domain],
+                                 output_filename=filename, keep_files=keep_files)
+        # A rejected shard keeps serving its previous (validated) version, if any
+        if os.path.exists(os.path.join(OUTPUT_DIR, filename)):
+            shards[domain] = {"server": filename, "apis": shard_apis[domain]}
+        else:
+            print(f"⚠ Shard '{domain}' has no server and is left out of the manifest")
+    
+    manifest_path = os.path.join(OUTPUT_DIR, SHARD_MANIFEST)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"generated_at": datetime.now().isoformat(), "shards": shards}, f, indent=2)
+    
+    print("\n" + "=" * 80)
+    print(f"✓ {len(shards)}/{len(shard_files)} shard(s) generated")
+    print(f"✓ Shard manifest saved to: {manifest_path}")
+    print("  Run mcp_client_generator.py to rebuild the client router")
     print("=" * 80)
+    return manifest_path
 
 
 if __name__ == "__main__":
-    generate_mcp_server_code()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Generate the Telefonica MCP server from the API catalog")
+    parser.add_argument("--http", action="store_true", default=None,
+                        help="also emit the Streamable HTTP transport (long-lived shared server)")
+    parser.add_argument("--shards", action="store_true",
+                        default=os.getenv("MCP_SERVER_SHARDS", "false").lower() == "true",
+                        help="one server per catalog domain plus a shard manifest for the client router")
+    args = parser.parse_args()
+    if args.shards:
+        generate_sharded_mcp_servers(http_transport=args.http)
+    else:
+        generate_mcp_server_code(http_transport=args.http)
@@ -0,0 +1,247 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+"""
+MCP Server Zygote
+
+Spawning telefonica_mcp_server.py normally pays for interpreter start-up plus the
+imports of mcp, httpx and dotenv on every call. The zygote imports the server module
+once and forks a ready worker for each client:
+
+1. Zygote (long running, POSIX only):
+       python mcp_zygote.py --serve --server telefonica_mcp_server.py
+   Imports the server, listens on a Unix socket (MCP_ZYGOTE_SOCKET).
+
+2. Launcher (what MCPStdioTool spawns, stdlib only so it runs with -I -S):
+       python -I -S mcp_zygote.py --connect
+   Hands its stdin/stdout/stderr to the zygote over the socket (SCM_RIGHTS). The
+   forked worker serves MCP on those descriptors; the launcher waits for it to exit.
+
+On Windows, or when no zygote is listening, the launcher runs the server as a normal
+child process, so the client command works everywhere.
+
+--server may also be the telefonica_mcp_server.pyz built by build_package.py.
+
+Workers inherit the configuration loaded when the zygote started: module-level settings
+such as APIM_BASE_URL are read once at import. Only WORKER_VARIABLES, which the server
+reads when it starts serving (e.g. the TRACEPARENT of the workflow that spawned it), are
+sent by the launcher and applied in the worker. Restart the zygote after changing .env.
+"""
+
+import os
+import sys
+import json
+import struct
+import signal
+import socket
+import argparse
+import subprocess
+
+DEFAULT_SOCKET = os.path.join(os.getenv("TMPDIR", "/tmp"), "telefonica_mcp_zygote.sock")
+DEFAULT_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telefonica_mcp_server.py")
+
+# Length of the JSON request that follows the descriptors
+HEADER = struct.Struct("!I")
+PID = struct.Struct("!i")
+# Sent instead of a worker pid when the zygote serves another server file
+REJECTED = -1
+
+# Launcher environment applied in the worker (read by the server in main(), not at import)
+WORKER_VARIABLES = ("TRACEPARENT", "MCP_PROFILE", "MCP_PROFILE_HZ", "MCP_PROFILE_DIR")
+
+
+def _recv_exact(conn, size):
+    """Read exactly size bytes or raise ConnectionError."""
+
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+# ============================================================================
+# ZYGOTE
+# ============================================================================
+
+def load_server(server_path):
+    """Import the server module (and with it mcp, httpx and dotenv) without running main()."""
+
+    import importlib
+    import importlib.util
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(server_path)))
+    if server_path.endswith(".pyz"):
+        # Zipapp from build_package.py: the module is inside, as bytecode (zipimport)
+        sys.path.insert(0, os.path.abspath(server_path))
+        return importlib.import_module("telefonica_mcp_server")
+    spec = importlib.util.spec_from_file_location("telefonica_mcp_server", server_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run_worker(module, server_path, conn, fds, request):
+    """Forked child: take over the launcher's stdio and serve MCP until the client disconnects."""
+
+    exit_code = 1
+    try:
+        import asyncio
+
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        sys.argv = [server_path] + request.get("args", [])
+        environment = request.get("env", {})
+        for name in WORKER_VARIABLES:
+            if environment.get(name) is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = environment[name]
+
+        conn.sendall(PID.pack(os.getpid()))
+        asyncio.run(module.main())
+        exit_code = 0
+    except BaseException:
+        pass
+    finally:
+        # The stdio transport may already have closed stdout
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        # Never return into serve(): skip interpreter shutdown, the parent's state
+        # (listener, socket file) must not be torn down by a worker
+        os._exit(exit_code)
+
+
+def serve(server_path, socket_path):
+    """Import the server once, then fork one worker per launcher connection."""
+
+    module = load_server(server_path)
+    zygote_pid = os.getpid()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(64)
+
+    # Workers are reaped by the kernel
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print(f"✓ Zygote ready: {server_path} on {socket_path}", file=sys.stderr)
+
+    try:
+        while True:
+            conn, _ = listener.accept()
+            fds = []
+            try:
+                header, fds, _, _ = socket.recv_fds(conn, HEADER.size, 3)
+                if len(header) != HEADER.size or len(fds) != 3:
+                    raise ConnectionError("incomplete request")
+                request = json.loads(_recv_exact(conn, HEADER.unpack(header)[0]))
+                requested = request.get("server")
+                if requested and os.path.realpath(requested) != os.path.realpath(server_path):
+                    # e.g. a shard server: the launcher runs it directly instead
+                    conn.sendall(PID.pack(REJECTED))
+                    print(f"⚠ Zygote rejected a request for {requested}", file=sys.stderr)
+                    continue
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if os.fork() == 0:
+                    listener.close()
+                    _run_worker(module, server_path, conn, fds, request)
+            except Exception as e:
+                print(f"⚠ Zygote request failed: {e}", file=sys.stderr)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.getpid() == zygote_pid and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+# ============================================================================
+# LAUNCHER
+# ============================================================================
+
+def _run_directly(server_path, args):
+    """Fallback: run the server as a normal child process on the launcher's stdio."""
+
+    return subprocess.call([sys.executable, server_path] + args)
+
+
+def connect(socket_path, server_path, args):
+    """Hand this process's stdio to a zygote worker and wait until it exits."""
+
+    if not hasattr(socket, "send_fds") or not hasattr(os, "fork"):
+        return _run_directly(server_path, args)
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        conn.close()
+        return _run_directly(server_path, args)
+
+    with conn:
+        payload = json.dumps({
+            "server": os.path.abspath(server_path),
+            "args": args,
+            "env": {name: os.environ[name] for name in WORKER_VARIABLES if name in os.environ}
+        }).encode("utf-8")
+        socket.send_fds(conn, [HEADER.pack(len(payload))], [0, 1, 2])
+        conn.sendall(payload)
+        worker_pid = PID.unpack(_recv_exact(conn, PID.size))[0]
+        if worker_pid == REJECTED:
+            conn.close()
+            return _run_directly(server_path, args)
+
+        # Stopping the launcher (as MCPStdioTool does on close) stops the worker
+        def forward(signum, frame):
+            try:
+                os.kill(worker_pid, signum)
+            except ProcessLookupError:
+                pass
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+
+        # The worker holds the other end; EOF means it has exited
+        while conn.recv(1):
+            pass
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forking launcher for the Telefonica MCP server")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--serve", action="store_true", help="run the zygote")
+    mode.add_argument("--connect", action="store_true", help="start one worker on this process's stdio")
+    parser.add_argument("--server", default=os.getenv("MCP_SERVER_PATH", DEFAULT_SERVER),
+                        help="path of telefonica_mcp_server.py (or of its .pyz)")
+    parser.add_argument("--socket", default=os.getenv("MCP_ZYGOTE_SOCKET", DEFAULT_SOCKET),
+                        help="Unix socket shared by zygote and launchers")
+    args, server_args = parser.parse_known_args()
+
+    if args.serve:
+        if not hasattr(os, "fork"):
+            print("✗ The zygote needs fork() (POSIX); clients fall back to spawning the server", file=sys.stderr)
+            return 1
+        serve(args.server, args.socket)
+        return 0
+    return connect(args.socket, args.server, server_args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+"""
+OpenAPI Catalog Importer
+
+Bulk onboarding of Telefonica APIs into the API catalog:
+
+1. Parses every OpenAPI 3 / Swagger 2 file (.json, or .yaml/.yml when PyYAML is
+   installed) of a directory in parallel worker processes
+2. Converts each operation into a catalog entry (name, description, endpoint, method,
+   inputs, useApimGateway, apimPath, domain)
+3. Merges the entries into an existing catalog: hand-maintained fields and the
+   'active' flag of known APIs are kept, new APIs are imported inactive
+4. Writes an indexed catalog: the usual 'apis' list plus an 'index' with the
+   positions of the APIs by name, by domain and of the active ones
+
+Generators call load_catalog_slice() to take only the APIs they need. The persisted
+index is used as long as its fingerprint (count, names, domains and 'active' flags of
+the APIs) still matches the entries; a catalog edited by hand gets its index rebuilt.
+
+Usage:
+    python openapi_catalog_importer.py specs/ --catalog api_catalog.json --output api_catalog.json
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+SPEC_EXTENSIONS = (".json", ".yaml", ".yml")
+HTTP_METHODS = ("get", "post", "put", "patch", "delete")
+
+# Headers supplied by the server itself, never by the caller
+MANAGED_HEADERS = {"authorization", "ocp-apim-subscription-key", "accept", "content-type"}
+APIM_KEY_HEADER = "ocp-apim-subscription-key"
+
+
+def _snake_case(text):
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", text)
+    return re.sub(r"[^0-9a-zA-Z]+", "_", text).strip("_").lower()
+
+
+def _resolve(spec, node, depth=0):
+    """Follow local $ref pointers (#/components/..., #/definitions/...)."""
+    while isinstance(node, dict) and "$ref" in node and depth < 16:
+        target = spec
+        for part in node["$ref"].lstrip("#/").split("/"):
+            target = target.get(part, {}) if isinstance(target, dict) else {}
+        node = target
+        depth += 1
+    return node if isinstance(node, dict) else {}
+
+
+def _input(name, schema, description, required, location):
+    api_input = {
+        "name": name,
+        "type": schema.get("type", "string"),
+        "description": " ".join(str(description or schema.get("description", "")).split()),
+        "required": bool(required),
+        "in": location
+    }
+    return {key: value for key, value in api_input.items() if value not in ("", None)}
+
+
+def _body_inputs(spec, schema):
+    """Top-level properties of a JSON request body, one input each."""
+    schema = _resolve(spec, schema)
+    required = set(schema.get("required", []))
+    return [
+        _input(name, _resolve(spec, prop), None, name in required, "body")
+        for name, prop in schema.get("properties", {}).items()
+    ]
+
+
+def _base_url(spec):
+    if "servers" in spec:
+        return (spec["servers"] or [{}])[0].get("url", "").rstrip("/")
+    if "host" in spec:
+        scheme = (spec.get("schemes") or ["https"])[0]
+        return f"{scheme}://{spec['host']}{spec.get('basePath', '')}".rstrip("/")
+    return ""
+
+
+def _uses_apim(spec, base_url):
+    """APIM-published specs carry the subscription key header as their security scheme."""
+    schemes = spec.get("components", {}).get("securitySchemes", {}) or spec.get("securityDefinitions", {})
+    for scheme in schemes.values():
+        if scheme.get("type") == "apiKey" and str(scheme.get("name", "")).lower() == APIM_KEY_HEADER:
+            return True
+    return ".azure-api.net" in base_url
+
+
+def operations_to_entries(spec, source=""):
+    """Convert every operation of one OpenAPI document into catalog entries."""
+    base_url = _base_url(spec)
+    use_apim = _uses_apim(spec, base_url)
+    default_domain = _snake_case(spec.get("info", {}).get("title", "")) or _snake_case(os.path.splitext(source)[0])
+
+    entries = []
+    for path, path_item in (spec.get("paths") or {}).items():
+        path_item = _resolve(spec, path_item)
+        shared_parameters = path_item.get("parameters", [])
+        for method in HTTP_METHODS:
+            operation = path_item.get(method)
+            if not isinstance(operation, dict):
+                continue
+
+            inputs = []
+            for parameter in shared_parameters + operation.get("parameters", []):
+                parameter = _resolve(spec, parameter)
+                location = parameter.get("in")
+                if location == "header" and parameter.get("name", "").lower() in MANAGED_HEADERS:
+                    continue
+                if location == "cookie":
+                    # Neither the generated servers nor catalog_impl send cookies
+                    continue
+                if location == "body":
+                    inputs += _body_inputs(spec, parameter.get("schema", {}))
+                    continue
+                schema = _resolve(spec, parameter.get("schema", parameter))
+                inputs.append(_input(parameter.get("name"), schema, parameter.get("description"),
+                                     parameter.get("required") or location == "path", location))
+            content = _resolve(spec, operation.get("requestBody", {})).get("content", {})
+            if "application/json" in content:
+                inputs += _body_inputs(spec, content["application/json"].get("schema", {}))
+
+            name = _snake_case(operation.get("operationId") or f"{method}_{path}")
+            tags = operation.get("tags") or []
+            entry = {
+                "name": name,
+                "description": " ".join(str(operation.get("summary") or operation.get("description") or name).split()),
+                "endpoint": base_url + path,
+                "method": method.upper(),
+                "inputs": [api_input for api_input in inputs if api_input.get("name")],
+                "useApimGateway": use_apim,
+                "domain": _snake_case(tags[0]) if tags else default_domain,
+                "source": source
+            }
+            if use_apim:
+                # Path relative to APIM_BASE_URL (keeping the API's base path, e.g. /bill/V2),
+                # as the generated servers call the gateway
+                entry["apimPath"] = urlparse(base_url).path.rstrip("/") + path
+            entries.append(entry)
+    return entries
+
+
+def parse_spec_file(path):
+    """Worker: parse one spec file. Returns (path, entries, error)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                spec = json.load(f)
+            elif yaml is not None:
+                spec = yaml.safe_load(f)
+            else:
+                return path, [], "PyYAML is not installed"
+        if not isinstance(spec, dict) or not ("openapi" in spec or "swagger" in spec):
+            return path, [], "not an OpenAPI document"
+        return path, operations_to_entries(spec, os.path.basename(path)), None
+    except Exception as e:
+        return path, [], str(e)
+
+
+def parse_spec_directory(spec_dir, workers=None):
+    """Parse every spec file of spec_dir in parallel; returns (entries, errors) in file order."""
+    paths = sorted(
+        os.path.join(root, filename)
+        for root, _, filenames in os.walk(spec_dir)
+        for filename in filenames if filename.lower().endswith(SPEC_EXTENSIONS)
+    )
+    results, errors = {}, {}
+    if not paths:
+        return [], errors
+    # Largest specs are submitted first so a big file does not end up running alone at the end
+    by_size = sorted(paths, key=os.path.getsize, reverse=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, file_entries, error in executor.map(parse_spec_file, by_size):
+            if error:
+                errors[path] = error
+            results[path] = file_entries
+    return [entry for path in paths for entry in results[path]], errors
+
+
+def merge_entries(catalog, entries, activate=False):
+    """
+    Merge imported entries into catalog['apis'] by name.
+
+    Existing APIs keep their 'active' flag, their description and any field the import
+    does not produce (sampleCurl, pythonExample, ...). Operations whose name is already taken by another
+    domain are prefixed with their domain. Operations of this import that end up with the same name
+    get the HTTP method, then the spec file, appended; they are returned as (old, new, source) in
+    renamed.
+
+    Returns (catalog, added, updated, renamed).
+    """
+    apis = list(catalog.get("apis", []))
+    positions = {api.get("name"): i for i, api in enumerate(apis)}
+    added, updated = 0, 0
+    imported, renamed = set(), []
+    for entry in entries:
+        name = entry["name"]
+        if name in positions and apis[positions[name]].get("domain", entry["domain"]) != entry["domain"]:
+            name = entry["name"] = f"{entry['domain']}_{name}"
+        if name in imported:
+            suffixes = [entry["method"].lower(), _snake_case(os.path.splitext(entry.get("source", ""))[0])]
+            candidate = name
+            for suffix in filter(None, suffixes):
+                candidate = f"{candidate}_{suffix}"
+                if candidate not in imported:
+                    break
+            counter = 2
+            while candidate in imported:
+                candidate = f"{name}_{counter}"
+                counter += 1
+            renamed.append((name, candidate, entry.get("source", "")))
+            name = entry["name"] = candidate
+        imported.add(name)
+        if name in positions:
+            existing = apis[positions[name]]
+            apis[positions[name]] = {
+                **existing,
+                **entry,
+                "description": existing.get("description") or entry["description"],
+                "active": existing.get("active", False)
+            }
+            updated += 1
+        else:
+            positions[name] = len(apis)
+            apis.append({**entry, "active": activate})
+            added += 1
+    return {**catalog, "apis": apis}, added, updated, renamed
+
+
+def _fingerprint(apis):
+    """Hash of what the index is built from, to tell a stale persisted index."""
+    digest = hashlib.sha256()
+    for api in apis:
+        digest.update(f"{api.get('name')}\0{api.get('domain', 'default')}\0{bool(api.get('active', False))}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_index(apis):
+    """Positions of the APIs by name, by domain and of the active ones."""
+    index = {"count": len(apis), "fingerprint": _fingerprint(apis), "byName": {}, "byDomain": {}, "active": []}
+    for i, api in enumerate(apis):
+        index["byName"][api.get("name")] = i
+        index["byDomain"].setdefault(api.get("domain", "default"), []).append(i)
+        if api.get("active", False):
+            index["active"].append(i)
+    return index
+
+
+def write_indexed_catalog(catalog, output_path, modified_by="openapi_catalog_importer"):
+    """Write catalog with a fresh index (atomic replace, so running servers never read half a file)."""
+    indexed = {
+        **{key: value for key, value in catalog.items() if key not in ("apis", "index")},
+        "lastModified": datetime.now().isoformat(),
+        "modifiedBy": modified_by,
+        "apis": catalog.get("apis", []),
+        "index": build_index(catalog.get("apis", []))
+    }
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(indexed, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, output_path)
+    return indexed
+
+
+def load_catalog_slice(catalog, names=None, domains=None, active_only=True):
+    """
+    APIs of a catalog (dict as loaded from JSON) selected by name and/or domain.
+
+    The persisted index is used when its count and fingerprint match the entries; otherwise
+    (no index, or an 'active' flag edited by hand) it is rebuilt.
+    """
+    apis = catalog.get("apis", [])
+    index = catalog.get("index")
+    if not (isinstance(index, dict) and index.get("count") == len(apis)
+            and index.get("fingerprint") == _fingerprint(apis)):
+        index = build_index(apis)
+
+    positions = None
+    if names:
+        positions = {index["byName"][name] for name in names if name in index["byName"]}
+    if domains:
+        in_domains = {i for domain in domains for i in index["byDomain"].get(domain, [])}
+        positions = in_domains if positions is None else positions & in_domains
+    if active_only:
+        positions = set(index["active"]) if positions is None else positions & set(index["active"])
+    if positions is None:
+        return list(apis)
+    return [apis[i] for i in sorted(positions)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import OpenAPI specs into the indexed API catalog")
+    parser.add_argument("spec_dir", help="directory with OpenAPI 3 / Swagger 2 files (searched recursively)")
+    parser.add_argument("--catalog", help="existing catalog to merge into (default: start empty)")
+    parser.add_argument("--output", help="indexed catalog to write (default: --catalog)")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--activate", action="store_true", help="mark newly imported APIs as active")
+    args = parser.parse_args()
+
+    output_path = args.output or args.catalog
+    if not output_path:
+        parser.error("--output is required when no --catalog is given")
+
+    print("=" * 80)
+    print("OPENAPI CATALOG IMPORT")
+    print("=" * 80)
+
+    catalog = {"apis": []}
+    if args.catalog and os.path.exists(args.catalog):
+        with open(args.catalog, "r", encoding="utf-8") as f:
+            catalog = json.load(f)
+        print(f"✓ Loaded {len(catalog.get('apis', []))} APIs from {args.catalog}")
+
+    entries, errors = parse_spec_directory(args.spec_dir, args.workers)
+    print(f"✓ Parsed {len(entries)} operations from {args.spec_dir}")
+    for path, error in errors.items():
+        print(f"⚠ Skipped {path}: {error}")
+
+    catalog, added, updated, renamed = merge_entries(catalog, entries, activate=args.activate)
+    indexed = write_indexed_catalog(catalog, output_path)
+    for old_name, new_name, source in renamed:
+        print(f"⚠ Duplicate operation name '{old_name}' in {source}: imported as '{new_name}'")
+    print(f"✓ {added} APIs added, {updated} updated")
+    print(f"✓ {len(indexed['apis'])} APIs in {len(indexed['index']['byDomain'])} domains, "
+          f"{len(indexed['index']['active'])} active")
+    print(f"✓ Indexed catalog saved to: {output_path}")
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,19 @@
 
 import os
 import sys
+import csv
 import json
+import math
+import time
+import heapq
 import asyncio
-from datetime import datetime
+import argparse
+import functools
+import itertools
+from datetime import date, datetime
 from dotenv import load_dotenv
+from async_profiler import AsyncSamplingProfiler
+from invoice_column_store import InvoiceColumnStore
 
 # Add the SourceDesigned directory to the path to import the MCP client
 sys.path.insert(0, r"C:\TelefonicaProcessAgent\Data\SourceDesigned")
@@ -17,7 +26,13 @@ load_dotenv(r"C:\TelefonicaProcessAgent\Data\SourceDesigned\.env")
 from telefonica_mcp_client import (
     call_deuda_fija,
     call_listado_de_boletas_fija,
-    call_retrieve_invoice_link
+    call_retrieve_invoice_link,
+    run_workflow,
+    stream_tool_items,
+    shutdown_clients,
+    new_traceparent,
+    current_traceparent,
+    trace_span
 )
 
 """
@@ -29,16 +44,75 @@ This orchestrator runs the MCP client methods in sequence:
 3. call_deuda_fija - Get payment details (if needed)
 
 Each step uses outputs from previous steps as inputs.
+
+Set TELEFONICA_WORKFLOW_AGENT=true to run the three steps as ONE workflow agent
+conversation (run_workflow) instead of three separate agents.
+
+With --batch customers.csv every customer is scheduled through a priority queue
+(CustomerScheduler) so the most urgent / valuable workflows finish first when the
+batch deadline or the tool call budget runs out.
+
+With --profile (or TELEFONICA_PROFILE=true / a rate in Hz) every step_* coroutine is
+sampled by AsyncSamplingProfiler and one collapsed-stack file per step is written to
+TELEFONICA_PROFILE_DIR (default ./profiles).
+
+With TELEFONICA_TRACE_FILE set, each customer workflow gets one trace: every step is a
+span, and its traceparent is passed to the call_* functions, the MCP server (tools/call
+_meta) and the backend (traceparent header). All processes append their spans to the
+same JSON lines file.
+
+With TELEFONICA_STREAM_INVOICES=true step 1 receives the invoices one by one while the
+MCP server is still reading the backend response (stream_tool_items), and step 2 starts
+fetching the link of the first open invoice as soon as it arrives.
 """
 
+# With TELEFONICA_SKIP_UNCHANGED=true the server answers {"unchanged": true} for customers
+# whose invoice list did not change since the previous poll, and they are skipped.
+SKIP_UNCHANGED = os.getenv('TELEFONICA_SKIP_UNCHANGED', 'false').lower() == 'true'
+
+# Stream implInvoiceLists item by item instead of waiting for the whole invoice list
+STREAM_INVOICES = os.getenv('TELEFONICA_STREAM_INVOICES', 'false').lower() == 'true'
+
+# Invoice fields used by the workflow; the MCP server trims everything else
+# before the response is serialized back to the client.
+INVOICE_FIELDS = [
+    'implInvoiceLists.name',
+    'implInvoiceLists.customerRut',
+    'implInvoiceLists.billingInvoiceNumber',
+    'implInvoiceLists.invoiceStatusInd',
+    'implInvoiceLists.documentType',
+    'implInvoiceLists.totalAmount',
+    'implInvoiceLists.dueDate',
+    'implInvoiceLists.downloadLink'
+]
+
+
+def traced_step(step):
+    """Record a step as a span of the customer's trace; the body passes current_traceparent() on."""
+    
+    @functools.wraps(step)
+    async def traced(self, *args, **kwargs):
+        with trace_span(step.__name__, self.traceparent, service="orchestrator"):
+            return await step(self, *args, **kwargs)
+    
+    return traced
+
 
 class TelefonicaProcessOrchestrator:
     """Orchestrates execution of Telefonica API calls in a business workflow."""
     
-    def __init__(self):
+    def __init__(self, invoice_store: InvoiceColumnStore = None, early_link: bool = True):
         self.execution_log = []
         self.results = {}
         self.customer_data = None
+        # Invoices of every processed customer, in typed columns for batch analytics
+        self.invoice_store = invoice_store if invoice_store is not None else InvoiceColumnStore()
+        # One trace per customer workflow (None when TELEFONICA_TRACE_FILE is not set)
+        self.traceparent = new_traceparent()
+        # Streamed step 1 starts step 2 at the first open invoice (off in batch mode,
+        # where the scheduler decides when follow-up calls run)
+        self.early_link = early_link
+        self.link_task = None
         
     def log_step(self, step_name: str, status: str, data: dict = None):
         """Log execution step."""
@@ -55,6 +129,7 @@ class TelefonicaProcessOrchestrator:
         if data and status == "error":
             print(f"    Error: {data.get('error', 'Unknown error')}")
         
+    @traced_step
     async def step_1_get_customer_invoices(self, customer_id: int, msisidn: str):
         """
         Step 1: Get list of customer invoices.
@@ -64,34 +139,43 @@ class TelefonicaProcessOrchestrator:
             msisidn: Customer phone number
             
         Returns:
-            dict: Invoice list response
+            dict: Invoice list response, or None if unchanged since the last poll
         """
         self.log_step("Step 1: Get Customer Invoices", "running")
         
         try:
-            response = await call_listado_de_boletas_fija(
-                customerId=customer_id,
-                msisidn=msisidn
-            )
-            
-            # Parse the response
-            if 'raw_response' in response:
-                # Extract JSON from the raw response
-                raw = response['raw_response']
-                if '```json' in raw:
-                    json_str = raw.split('```json')[1].split('```')[0].strip()
-                    invoice_data = json.loads(json_str)
-                else:
-                    invoice_data = response
+            if STREAM_INVOICES:
+                response = await self._stream_customer_invoices(customer_id, msisidn)
             else:
-                invoice_data = response
+                response = await call_listado_de_boletas_fija(
+                    customerId=customer_id,
+                    msisidn=msisidn,
+                    fields=INVOICE_FIELDS,
+                    skipUnchanged=SKIP_UNCHANGED or None,
+                    traceparent=current_traceparent()
+                )
+            
+            if response.get('unchanged'):
+                self.results['unchanged'] = True
+                self.log_step(
+                    "Step 1: Get Customer Invoices",
+                    "success",
+                    {'message': 'Invoices unchanged since last poll - skipping customer'}
+                )
+                return None
+            
+            # The client already parsed the response (once, including ```json fences)
+            if 'implInvoiceLists' not in response and 'raw_response' in response:
+                raise ValueError(f"Could not parse the invoice list: {str(response['raw_response'])[:200]}")
+            invoice_data = response
             
             self.results['invoices'] = invoice_data
+            self.invoice_store.append_customer(customer_id, invoice_data)
             self.customer_data = {
                 'customer_id': customer_id,
                 'msisidn': msisidn,
-                'customer_name': invoice_data.get('implInvoiceLists', [{}])[0].get('name', 'Unknown'),
-                'customer_rut': invoice_data.get('implInvoiceLists', [{}])[0].get('customerRut', 'Unknown')
+                'customer_name': (invoice_data.get('implInvoiceLists') or [{}])[0].get('name', 'Unknown'),
+                'customer_rut': (invoice_data.get('implInvoiceLists') or [{}])[0].get('customerRut', 'Unknown')
             }
             
             # Count invoice statuses
@@ -113,27 +197,76 @@ class TelefonicaProcessOrchestrator:
             return invoice_data
             
         except Exception as e:
+            if self.link_task is not None:
+                self.link_task.cancel()
+                self.link_task = None
             self.log_step("Step 1: Get Customer Invoices", "error", {'error': str(e)})
             raise
     
-    async def step_2_get_first_unpaid_invoice_link(self):
+    async def _stream_customer_invoices(self, customer_id: int, msisidn: str) -> dict:
+        """
+        Collect the invoices of step 1 as the MCP server streams them; the first open
+        invoice starts step 2 right away when early_link is set.
+        
+        Returns:
+            dict: {'implInvoiceLists': [...]}, or the plain tool response when nothing was
+            streamed (errors, no invoices) or the data is unchanged
+        """
+        arguments = {'customerId': customer_id, 'msisidn': msisidn, 'fields': INVOICE_FIELDS}
+        if SKIP_UNCHANGED:
+            arguments['skipUnchanged'] = True
+        
+        invoices = []
+        final = {}
+        async for invoice in stream_tool_items(
+            'listado_de_boletas_fija',
+            arguments,
+            'implInvoiceLists',
+            final=final,
+            traceparent=current_traceparent()
+        ):
+            invoices.append(invoice)
+            if self.early_link and self.link_task is None and invoice.get('invoiceStatusInd') == 'O':
+                self.link_task = asyncio.create_task(self.step_2_get_first_unpaid_invoice_link(invoice))
+        
+        response = final.get('response')
+        if response is not None and (response.get('unchanged') or not invoices):
+            # Unchanged data can be detected only once the whole body was hashed
+            if self.link_task is not None:
+                self.link_task.cancel()
+                self.link_task = None
+            return response
+        # Only the projected invoices are kept (results file, column store); the raw
+        # backend body is never held in memory, neither here nor in the MCP server
+        return {'implInvoiceLists': invoices}
+    
+    @traced_step
+    async def step_2_get_first_unpaid_invoice_link(self, unpaid_invoice: dict = None):
         """
         Step 2: Get download link for the first unpaid invoice from Step 1.
         
+        Args:
+            unpaid_invoice: Open invoice to use (streamed step 1); default: the first
+                open invoice of the Step 1 results
+        
         Returns:
             dict: Invoice link response or None if no unpaid invoices
         """
+        if unpaid_invoice is None and self.link_task is not None:
+            # Already started by the streamed step 1
+            return await self.link_task
+        
         self.log_step("Step 2: Get Unpaid Invoice Link", "running")
         
         try:
-            invoices = self.results['invoices'].get('implInvoiceLists', [])
-            
-            # Find first unpaid invoice (status 'O' = Open)
-            unpaid_invoice = None
-            for invoice in invoices:
-                if invoice.get('invoiceStatusInd') == 'O':
-                    unpaid_invoice = invoice
-                    break
+            if unpaid_invoice is None:
+                invoices = self.results['invoices'].get('implInvoiceLists', [])
+                
+                # Find first unpaid invoice (status 'O' = Open)
+                for invoice in invoices:
+                    if invoice.get('invoiceStatusInd') == 'O':
+                        unpaid_invoice = invoice
+                        break
             
             if not unpaid_invoice:
                 self.log_step(
@@ -149,7 +282,8 @@ class TelefonicaProcessOrchestrator:
             
             response = await call_retrieve_invoice_link(
                 billingInvoiceNumber=billing_invoice_number,
-                isCyclicInvoice=is_cyclic
+                isCyclicInvoice=is_cyclic,
+                traceparent=current_traceparent()
             )
             
             self.results['invoice_link'] = response
@@ -172,6 +306,7 @@ class TelefonicaProcessOrchestrator:
             # Don't raise - continue to next step
             return None
     
+    @traced_step
     async def step_3_get_payment_details(self, document_id: str):
         """
         Step 3: Get payment details using deuda_fija API.
@@ -188,7 +323,8 @@ class TelefonicaProcessOrchestrator:
             response = await call_deuda_fija(
                 customerIdentification=self.customer_data['customer_rut'],
                 type="RUT",
-                document=document_id
+                document=document_id,
+                traceparent=current_traceparent()
             )
             
             self.results['payment_details'] = response
@@ -206,6 +342,69 @@ class TelefonicaProcessOrchestrator:
             # Don't raise - this API might be blocked by WAF
             return None
     
+    @traced_step
+    async def run_workflow_agent(self, customer_id: int, msisidn: str):
+        """
+        Steps 1-3 in one agent conversation (all tools, parallel tool calls, structured output).
+        
+        Args:
+            customer_id: Customer account ID
+            msisidn: Customer phone number
+            
+        Returns:
+            dict: Workflow result with the responses grouped by tool
+        """
+        self.log_step("Workflow Agent: Invoices, Link and Debt", "running")
+        
+        task = (
+            f"1. Call listado_de_boletas_fija with customerId={customer_id}, msisidn=\"{msisidn}\" "
+            f"and fields={json.dumps(INVOICE_FIELDS)}.\n"
+            "2. For the first invoice with invoiceStatusInd 'O', call retrieve_invoice_link with its "
+            "billingInvoiceNumber and isCyclicInvoice=true when documentType is 'CY'.\n"
+            "3. In parallel with step 2, call deuda_fija with customerIdentification set to the "
+            f"customerRut of the invoices, type=\"RUT\" and document=\"{customer_id}\"."
+        )
+        
+        try:
+            workflow = await run_workflow(
+                task,
+                traceparent=current_traceparent(),
+                tools=['listado_de_boletas_fija', 'retrieve_invoice_link', 'deuda_fija']
+            )
+            results = workflow['results']
+            
+            invoice_data = (results.get('listado_de_boletas_fija') or [{}])[0]
+            self.results['invoices'] = invoice_data
+            self.invoice_store.append_customer(customer_id, invoice_data)
+            if results.get('retrieve_invoice_link'):
+                self.results['invoice_link'] = results['retrieve_invoice_link'][0]
+            if results.get('deuda_fija'):
+                self.results['payment_details'] = results['deuda_fija'][0]
+            self.results['workflow_summary'] = workflow['summary']
+            
+            first_invoice = (invoice_data.get('implInvoiceLists') or [{}])[0]
+            self.customer_data = {
+                'customer_id': customer_id,
+                'msisidn': msisidn,
+                'customer_name': first_invoice.get('name', 'Unknown'),
+                'customer_rut': first_invoice.get('customerRut', 'Unknown')
+            }
+            
+            self.log_step(
+                "Workflow Agent: Invoices, Link and Debt",
+                "success",
+                {
+                    'tools_called': {name: len(calls) for name, calls in results.items()},
+                    'summary': workflow['summary']
+                }
+            )
+            
+            return workflow
+            
+        except Exception as e:
+            self.log_step("Workflow Agent: Invoices, Link and Debt", "error", {'error': str(e)})
+            raise
+    
     def print_summary(self):
         """Print execution summary."""
         print("\n" + "=" * 80)
@@ -228,6 +427,14 @@ class TelefonicaProcessOrchestrator:
                 status = "OPEN" if invoice.get('invoiceStatusInd') == 'O' else "PAID"
                 print(f"    - {invoice['billingInvoiceNumber']}: ${invoice['totalAmount']} CLP ({status})")
         
+        portfolio = None
+        if len(self.invoice_store):
+            portfolio = self.invoice_store.analytics()
+            print(f"\nPortfolio Analytics ({portfolio['customers']} customers, {portfolio['invoices']} invoices):")
+            print(f"  Open debt: ${portfolio['open_debt']:,.0f} CLP ({portfolio['open_invoices']} open invoices)")
+            print("  Aging: " + ", ".join(f"{name} ${amount:,.0f}" for name, amount in portfolio['aging'].items()))
+            print(f"  Cyclic invoices: {portfolio['cyclic_share']:.1%}")
+        
         print("\nExecution Log:")
         for entry in self.execution_log:
             if entry['status'] in ['success', 'error']:
@@ -240,13 +447,215 @@ class TelefonicaProcessOrchestrator:
             json.dump({
                 'customer_data': self.customer_data,
                 'results': self.results,
+                'portfolio': portfolio,
+                'trace_id': self.traceparent.split('-')[1] if self.traceparent else None,
                 'execution_log': self.execution_log
             }, f, indent=2)
         
         print(f"\n✓ Results saved to: {output_file}")
+        if self.traceparent:
+            print(f"✓ Trace {self.traceparent.split('-')[1]} in: {os.getenv('TELEFONICA_TRACE_FILE')}")
         print("=" * 80)
 
 
+# Batch mode: rank keys, most significant first (TELEFONICA_PRIORITY_KEYS)
+#   input       - 'priority' column of the customers CSV (higher runs first)
+#   due_date    - earliest dueDate among the customer's open invoices (known after step 1)
+#   open_amount - total open amount of the customer (known after step 1, larger runs first)
+PRIORITY_KEYS = ('input', 'due_date', 'open_amount')
+
+
+def load_customers(csv_path: str) -> list:
+    """Read customer_id, msisidn and an optional priority column from a CSV file."""
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        return [
+            {
+                'customer_id': int(row['customer_id']),
+                'msisidn': row['msisidn'].strip(),
+                'priority': float(row.get('priority') or 0)
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+class CustomerScheduler:
+    """
+    Priority queue of customer workflow stages.
+    
+    Every customer starts with a step 1 entry ranked by what is known up front (the input
+    priority). When step 1 returns, a follow-up entry (steps 2-3) is pushed ranked by the
+    customer's real due dates and open debt, so valuable follow-ups overtake customers
+    whose invoices have not been fetched yet.
+    """
+    
+    def __init__(self, keys=PRIORITY_KEYS):
+        unknown = [key for key in keys if key not in PRIORITY_KEYS]
+        if unknown:
+            raise ValueError(f"Unknown priority keys: {unknown}")
+        self.keys = tuple(keys)
+        self._heap = []
+        self._sequence = itertools.count()
+    
+    def __len__(self):
+        return len(self._heap)
+    
+    def rank(self, customer: dict, invoice_data: dict = None) -> tuple:
+        """Sort key of a customer; values not known yet rank last."""
+        open_invoices = [
+            invoice for invoice in (invoice_data or {}).get('implInvoiceLists', [])
+            if invoice.get('invoiceStatusInd') == 'O'
+        ]
+        due_dates = []
+        for invoice in open_invoices:
+            try:
+                due_dates.append(date.fromisoformat(str(invoice.get('dueDate'))[:10]).toordinal())
+            except ValueError:
+                pass
+        
+        values = {
+            'input': -customer.get('priority', 0),
+            'due_date': min(due_dates) if due_dates else math.inf,
+            'open_amount': -sum(float(invoice.get('totalAmount') or 0) for invoice in open_invoices)
+                           if invoice_data is not None else math.inf
+        }
+        return tuple(values[key] for key in self.keys)
+    
+    def push(self, stage: str, customer: dict, invoice_data: dict = None):
+        """Queue a stage ('invoices' or 'follow_up') of a customer workflow."""
+        heapq.heappush(
+            self._heap,
+            (self.rank(customer, invoice_data), next(self._sequence), stage, customer)
+        )
+    
+    def peek(self):
+        """Return (stage, customer) of the highest ranked entry without removing it."""
+        _, _, stage, customer = self._heap[0]
+        return stage, customer
+    
+    def pop(self):
+        """Remove and return (stage, customer) of the highest ranked entry."""
+        _, _, stage, customer = heapq.heappop(self._heap)
+        return stage, customer
+    
+    def pending(self) -> list:
+        """Entries still queued, best first."""
+        return [(stage, customer) for _, _, stage, customer in sorted(self._heap)]
+
+
+async def run_batch(csv_path: str):
+    """
+    Process every customer of a CSV file in priority order until the queue is empty,
+    the batch deadline passes or the tool call budget is used up.
+    """
+    keys = [key.strip() for key in os.getenv('TELEFONICA_PRIORITY_KEYS', ','.join(PRIORITY_KEYS)).split(',') if key.strip()]
+    deadline_seconds = float(os.getenv('TELEFONICA_BATCH_DEADLINE_SECONDS', '0'))
+    max_calls = int(os.getenv('TELEFONICA_BATCH_MAX_CALLS', '0'))
+    concurrency = max(1, int(os.getenv('TELEFONICA_BATCH_CONCURRENCY', '4')))
+    
+    customers = load_customers(csv_path)
+    scheduler = CustomerScheduler(keys)
+    for customer in customers:
+        scheduler.push('invoices', customer)
+    
+    print(f"\nBatch: {len(customers)} customers from {csv_path}")
+    print(f"  Priority keys: {', '.join(scheduler.keys)}")
+    
+    invoice_store = InvoiceColumnStore()
+    orchestrators = {}
+    processed = []
+    state = {'calls': 0, 'in_flight': 0, 'stop_reason': None}
+    started = time.monotonic()
+    queue_changed = asyncio.Condition()
+    
+    def budget_left(calls_needed: int) -> bool:
+        if deadline_seconds and time.monotonic() - started >= deadline_seconds:
+            state['stop_reason'] = 'deadline'
+            return False
+        if max_calls and state['calls'] + calls_needed > max_calls:
+            state['stop_reason'] = 'max_calls'
+            return False
+        return True
+    
+    async def run_stage(stage: str, customer: dict):
+        customer_id = customer['customer_id']
+        if stage == 'invoices':
+            orchestrator = orchestrators[customer_id] = TelefonicaProcessOrchestrator(invoice_store, early_link=False)
+            invoice_data = await orchestrator.step_1_get_customer_invoices(customer_id, customer['msisidn'])
+            # Unchanged customers and customers without open invoices need no follow-up calls
+            if invoice_data and any(invoice.get('invoiceStatusInd') == 'O' for invoice in invoice_data.get('implInvoiceLists', [])):
+                scheduler.push('follow_up', customer, invoice_data)
+        else:
+            orchestrator = orchestrators[customer_id]
+            await orchestrator.step_2_get_first_unpaid_invoice_link()
+            await orchestrator.step_3_get_payment_details(document_id=str(customer_id))
+        processed.append({
+            'customer_id': customer_id,
+            'stage': stage,
+            'trace_id': orchestrator.traceparent.split('-')[1] if orchestrator.traceparent else None
+        })
+    
+    async def worker():
+        while True:
+            async with queue_changed:
+                # Follow-ups are pushed by stages still running, so wait for them too
+                await queue_changed.wait_for(lambda: len(scheduler) or not state['in_flight'] or state['stop_reason'])
+                if state['stop_reason'] or not len(scheduler):
+                    return
+                stage, customer = scheduler.peek()
+                calls_needed = 1 if stage == 'invoices' else 2
+                if not budget_left(calls_needed):
+                    queue_changed.notify_all()
+                    return
+                scheduler.pop()
+                state['calls'] += calls_needed
+                state['in_flight'] += 1
+            
+            try:
+                await run_stage(stage, customer)
+            except Exception as e:
+                print(f"  ✗ Customer {customer['customer_id']} ({stage}) failed: {e}")
+            finally:
+                async with queue_changed:
+                    state['in_flight'] -= 1
+                    queue_changed.notify_all()
+    
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    
+    pending = scheduler.pending()
+    portfolio = invoice_store.analytics() if len(invoice_store) else None
+    
+    print("\n" + "=" * 80)
+    print("BATCH SUMMARY")
+    print("=" * 80)
+    print(f"  Stages completed: {len(processed)} ({state['calls']} tool calls, {time.monotonic() - started:.1f}s)")
+    if state['stop_reason']:
+        print(f"  ⚠ Stopped by {state['stop_reason']} - {len(pending)} stages not run")
+    if portfolio:
+        print(f"  Open debt: ${portfolio['open_debt']:,.0f} CLP across {portfolio['customers']} customers")
+    
+    output_file = r"C:\TelefonicaProcessAgent\Data\SourceDesigned\orchestrator_batch_results.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'priority_keys': scheduler.keys,
+            'stop_reason': state['stop_reason'],
+            'tool_calls': state['calls'],
+            'processed': processed,
+            'pending': [{'customer_id': customer['customer_id'], 'stage': stage} for stage, customer in pending],
+            'portfolio': portfolio,
+            'customers': {
+                customer_id: {
+                    'customer_data': orchestrator.customer_data,
+                    'results': orchestrator.results,
+                    'execution_log': orchestrator.execution_log
+                }
+                for customer_id, orchestrator in orchestrators.items()
+            }
+        }, f, indent=2)
+    
+    print(f"\n✓ Results saved to: {output_file}")
+    print("=" * 80)
+
+
 async def main():
     """Main orchestration flow."""
     
@@ -270,26 +679,67 @@ async def main():
     print("=" * 80)
     
     try:
-        # Step 1: Get customer invoices
-        await orchestrator.step_1_get_customer_invoices(CUSTOMER_ID, MSISIDN)
-        
-        # Step 2: Get invoice link for first unpaid invoice
-        await orchestrator.step_2_get_first_unpaid_invoice_link()
-        
-        # Step 3: Get payment details (optional - may be blocked by WAF)
-        # Using the customer RUT from step 1
-        if orchestrator.customer_data:
-            await orchestrator.step_3_get_payment_details(
-                document_id=str(CUSTOMER_ID)
-            )
+        if os.getenv("TELEFONICA_WORKFLOW_AGENT", "false").lower() == "true":
+            # Steps 1-3 resolved by one agent in a single conversation
+            await orchestrator.run_workflow_agent(CUSTOMER_ID, MSISIDN)
+        else:
+            # Step 1: Get customer invoices
+            invoice_data = await orchestrator.step_1_get_customer_invoices(CUSTOMER_ID, MSISIDN)
+            
+            if invoice_data is not None:
+                # Step 2: Get invoice link for first unpaid invoice
+                await orchestrator.step_2_get_first_unpaid_invoice_link()
+                
+                # Step 3: Get payment details (optional - may be blocked by WAF)
+                # Using the customer RUT from step 1
+                if orchestrator.customer_data:
+                    await orchestrator.step_3_get_payment_details(
+                        document_id=str(CUSTOMER_ID)
+                    )
         
     except Exception as e:
         print(f"\n✗ Fatal error in orchestration: {e}")
     
     finally:
+        # Close the cached agents (and the MCP server connections they hold)
+        await shutdown_clients()
+        
         # Print summary
         orchestrator.print_summary()
 
 
+async def run_batch_main(csv_path: str):
+    """Batch entry point; closes the cached agents when done."""
+    print("=" * 80)
+    print("TELEFONICA PROCESS ORCHESTRATOR - BATCH")
+    print("=" * 80)
+    
+    try:
+        await run_batch(csv_path)
+    finally:
+        await shutdown_clients()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Run the Telefonica billing workflow")
+    parser.add_argument("--batch", metavar="CSV",
+                        help="process every customer of a CSV (customer_id,msisidn[,priority]) in priority order")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample each step with the async profiler (see TELEFONICA_PROFILE_HZ / _DIR)")
+    args = parser.parse_args()
+    
+    profiler = AsyncSamplingProfiler.from_env("orchestrator", "TELEFONICA", enabled=args.profile)
+    if profiler:
+        profiler.instrument(TelefonicaProcessOrchestrator,
+                            lambda name: name.startswith("step_") or name == "run_workflow_agent")
+        profiler.start()
+    
+    try:
+        if args.batch:
+            asyncio.run(run_batch_main(args.batch))
+        else:
+            asyncio.run(main())
+    finally:
+        if profiler:
+            profiler.stop()
+            print(f"✓ Step profiles saved to: {profiler.output_dir}")
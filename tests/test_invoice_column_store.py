@@ -0,0 +1,58 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import invoice_column_store  # noqa: E402
+from invoice_column_store import InvoiceColumnStore  # noqa: E402
+
+AS_OF = date(2025, 3, 31)
+
+
+def make_store():
+    store = InvoiceColumnStore()
+    store.append_customer(1, {"implInvoiceLists": [
+        {"totalAmount": "100.5", "invoiceStatusInd": "O", "dueDate": "2025-04-10", "documentType": "CY"},
+        {"totalAmount": 50, "invoiceStatusInd": "O", "dueDate": "2025-03-01T00:00:00", "documentType": "CY"},
+        {"totalAmount": 20, "invoiceStatusInd": "P", "dueDate": "2025-01-01", "documentType": "XX"},
+    ]})
+    store.append_customer(2, {"implInvoiceLists": [
+        {"totalAmount": 10, "invoiceStatusInd": "O", "dueDate": "2024-11-01"},
+        {"totalAmount": "n/a", "invoiceStatusInd": "O"},
+    ]})
+    store.append_customer(3, {"implInvoiceLists": []})
+    return store
+
+
+def test_array_analytics():
+    result = make_store()._analytics_array(AS_OF.toordinal())
+
+    assert result["invoices"] == 5
+    assert result["customers"] == 2
+    assert result["total_amount"] == 180.5
+    assert result["open_invoices"] == 4
+    assert result["open_debt"] == 160.5
+    assert result["aging"] == {"not_due": 100.5, "1_30": 50.0, "31_60": 0.0, "61_90": 0.0,
+                               "over_90": 10.0, "no_due_date": 0.0}
+    assert result["cyclic_share"] == 2 / 5
+
+
+def test_numpy_analytics_match_array_analytics():
+    pytest.importorskip("numpy")
+    store = make_store()
+
+    assert store._analytics_numpy(AS_OF.toordinal()) == store._analytics_array(AS_OF.toordinal())
+
+
+def test_empty_store(monkeypatch):
+    monkeypatch.setattr(invoice_column_store, "np", None)
+
+    result = InvoiceColumnStore().analytics(AS_OF)
+
+    assert result["invoices"] == 0
+    assert result["cyclic_share"] == 0.0
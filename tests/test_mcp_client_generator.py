@@ -0,0 +1,82 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+import ast
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mcp_client_generator import (  # noqa: E402
+    _parameter_names,
+    extract_tools_from_mcp_server,
+    render_client_function,
+    render_unified_client,
+)
+
+CATALOG_TOOL = {
+    "name": "list-invoices",
+    "description": "List invoices",
+    "inputSchema": {
+        "type": "object",
+        "properties": {
+            "customerId": {"type": "integer"},
+            "X-Correlation-Id": {"type": "string"},
+            "page[size]": {"type": "integer"},
+            "class": {"type": "string"},
+            "traceparent": {"type": "string"}
+        },
+        "required": ["customerId", "X-Correlation-Id"]
+    }
+}
+
+
+def test_parameter_names_are_unique_identifiers():
+    names = _parameter_names(["X-Correlation-Id", "page[size]", "class", "1st", "page_size", "traceparent"])
+
+    assert all(name.isidentifier() for name in names.values())
+    assert len(set(names.values())) == len(names)
+    assert names["class"] == "class_"
+    assert names["traceparent"] != "traceparent"
+
+
+def test_rendered_function_compiles_and_sends_original_names():
+    source = render_client_function(CATALOG_TOOL)
+
+    tree = ast.parse(source)
+    function = tree.body[0]
+    assert function.name == "call_list_invoices"
+    assert "'X-Correlation-Id': X_Correlation_Id" in source
+    assert "kwargs['page[size]'] = page_size" in source
+
+
+def test_rendered_client_compiles():
+    code = render_unified_client([CATALOG_TOOL], "telefonica_mcp_server.py")
+
+    compile(code, "telefonica_mcp_client.py", "exec")
+
+
+def test_extraction_does_not_run_server_code(tmp_path):
+    marker = tmp_path / "executed"
+    server = (
+        "SCHEMA = {'type': 'object', 'properties': {'rut': {'type': 'string'}}, 'required': ['rut']}\n"
+        "def side_effect():\n"
+        f"    open({str(marker)!r}, 'w').close()\n"
+        "    return {}\n"
+        "async def main():\n"
+        "    @server.list_tools()\n"
+        "    async def list_tools():\n"
+        "        return [Tool(name='listado', description='List', inputSchema=SCHEMA),\n"
+        "                Tool(name='listado_batch', description='Batch', inputSchema=batch_schema(SCHEMA)),\n"
+        "                Tool(name='bad', description='x', inputSchema=side_effect())]\n"
+    )
+
+    tools = extract_tools_from_mcp_server(server)
+
+    assert [tool["name"] for tool in tools] == ["listado", "listado_batch"]
+    assert tools[1]["inputSchema"]["properties"]["items"]["items"]["required"] == ["rut"]
+    assert not marker.exists()
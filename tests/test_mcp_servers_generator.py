@@ -0,0 +1,86 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+import ast
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from llm_codegen import estimate_tokens  # noqa: E402
+from mcp_servers_generator import (  # noqa: E402
+    build_generation_prompts,
+    compact_api_catalog,
+    create_mcp_generation_prompt,
+    merge_generated_servers,
+)
+
+
+def make_catalog(count):
+    shared = {"name": "customerId", "type": "int", "description": "Customer account ID", "in": "path"}
+    return {"apis": [
+        {"name": f"api_{i}", "description": f"Operation number {i} " * 5, "endpoint": f"https://x.test/op/{i}/{{customerId}}",
+         "method": "GET", "active": i % 7 != 3, "inputs": [dict(shared), {"name": f"param_{i}", "type": "string"}]}
+        for i in range(count)
+    ]}
+
+
+def test_compact_catalog_hoists_shared_inputs():
+    compact = compact_api_catalog(make_catalog(4))
+
+    assert [api["name"] for api in compact["apis"]] == ["api_0", "api_1", "api_2"]
+    assert compact["sharedInputs"]["customerId"]["in"] == "path"
+    assert all(api["inputs"][0] == "customerId" for api in compact["apis"])
+
+
+def test_generation_prompts_fit_budget_and_keep_every_api():
+    catalog = make_catalog(40)
+    budget = estimate_tokens(create_mcp_generation_prompt({"apis": []})) + 400
+
+    prompts = build_generation_prompts(catalog, token_budget=budget)
+
+    assert 1 < len(prompts) < 34
+    assert all(estimate_tokens(prompt) <= budget for prompt in prompts)
+    names = []
+    for prompt in prompts:
+        names += [api["name"] for api in json.loads(prompt.rsplit("\n", 1)[1])["apis"]]
+    assert names == [api["name"] for api in catalog["apis"] if api["active"]]
+
+
+def make_server(name):
+    return (
+        "import json\n"
+        f"{name.upper()}_SCHEMA = {{'type': 'object', 'properties': {{}}}}\n"
+        f"async def {name}_impl():\n"
+        f"    return json.dumps({{'tool': {name!r}}})\n"
+        "async def main():\n"
+        "    server = Server('telefonica-api-mcp')\n"
+        "    @server.list_tools()\n"
+        "    async def list_tools():\n"
+        f"        return [Tool(name={name!r}, description='', inputSchema={name.upper()}_SCHEMA)]\n"
+        "    @server.call_tool()\n"
+        "    async def call_tool(name, arguments):\n"
+        f"        if name == {name!r}:\n"
+        f"            return await {name}_impl()\n"
+        "        else:\n"
+        "            raise ValueError(name)\n"
+    )
+
+
+def test_merged_server_has_every_tool_and_route():
+    merged = merge_generated_servers([make_server("alpha"), make_server("beta"), make_server("gamma")])
+
+    compile(merged, "telefonica_mcp_server.py", "exec")
+    module = ast.parse(merged)
+    functions = [node.name for node in module.body if isinstance(node, ast.AsyncFunctionDef)]
+    assert functions == ["alpha_impl", "beta_impl", "gamma_impl", "main"]
+    assert merged.count("Tool(name=") == 3
+    routes = [node.comparators[0].value for node in ast.walk(module)
+              if isinstance(node, ast.Compare) and isinstance(node.comparators[0], ast.Constant)]
+    assert routes == ["alpha", "beta", "gamma"]
+    assert "raise ValueError(name)" in merged
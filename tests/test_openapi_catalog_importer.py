@@ -0,0 +1,92 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from openapi_catalog_importer import (  # noqa: E402
+    build_index,
+    load_catalog_slice,
+    merge_entries,
+    operations_to_entries,
+)
+
+SPEC = {
+    "openapi": "3.0.0",
+    "info": {"title": "Billing"},
+    "servers": [{"url": "https://telefonica.azure-api.net/bill/V2"}],
+    "paths": {
+        "/invoices/{customerId}": {
+            "parameters": [{"name": "customerId", "in": "path", "schema": {"type": "integer"}}],
+            "get": {
+                "operationId": "getInvoices",
+                "parameters": [
+                    {"name": "status", "in": "query", "schema": {"type": "string"}},
+                    {"name": "X-Correlation-Id", "in": "header", "schema": {"type": "string"}},
+                    {"name": "Ocp-Apim-Subscription-Key", "in": "header", "schema": {"type": "string"}},
+                    {"name": "session", "in": "cookie", "schema": {"type": "string"}},
+                ],
+            },
+            "post": {
+                "operationId": "getInvoices",
+                "requestBody": {"content": {"application/json": {"schema": {
+                    "type": "object", "required": ["amount"], "properties": {"amount": {"type": "number"}}}}}},
+            },
+        }
+    },
+}
+
+
+def test_operations_keep_parameter_locations():
+    get_entry = operations_to_entries(SPEC, "billing.json")[0]
+
+    assert get_entry["apimPath"] == "/bill/V2/invoices/{customerId}"
+    assert {api_input["name"]: api_input["in"] for api_input in get_entry["inputs"]} == {
+        "customerId": "path", "status": "query", "X-Correlation-Id": "header"}
+
+
+def test_same_name_operations_of_one_import_are_renamed():
+    entries = operations_to_entries(SPEC, "billing.json")
+
+    catalog, added, updated, renamed = merge_entries({"apis": []}, entries)
+
+    assert [api["name"] for api in catalog["apis"]] == ["get_invoices", "get_invoices_post"]
+    assert (added, updated) == (2, 0)
+    assert renamed == [("get_invoices", "get_invoices_post", "billing.json")]
+
+    # Re-importing gives the same names, so the APIs are updated rather than added again
+    catalog, added, updated, renamed = merge_entries(catalog, operations_to_entries(SPEC, "billing.json"))
+    assert (added, updated) == (0, 2)
+
+
+def test_merge_keeps_active_flag_and_hand_fields():
+    entries = operations_to_entries(SPEC, "billing.json")[:1]
+    catalog = {"apis": [{"name": "get_invoices", "domain": "billing", "active": True,
+                         "description": "Hand written", "pythonExample": "..."}]}
+
+    catalog, _, updated, _ = merge_entries(catalog, entries)
+
+    api = catalog["apis"][0]
+    assert updated == 1
+    assert api["active"] is True
+    assert api["description"] == "Hand written"
+    assert api["pythonExample"] == "..."
+    assert api["endpoint"].endswith("/invoices/{customerId}")
+
+
+def test_slice_uses_persisted_index_while_it_matches():
+    apis = [{"name": "a", "domain": "x", "active": True}, {"name": "b", "domain": "y", "active": True}]
+    index = build_index(apis)
+    index["byDomain"]["y"] = []  # only a persisted index that was used can produce this
+
+    assert load_catalog_slice({"apis": apis, "index": index}, domains=["y"]) == []
+
+
+def test_slice_rebuilds_index_after_hand_edits():
+    apis = [{"name": "a", "domain": "x", "active": True}, {"name": "b", "domain": "x", "active": False}]
+    catalog = {"apis": apis, "index": build_index(apis)}
+    apis[1]["active"] = True
+
+    assert [api["name"] for api in load_catalog_slice(catalog)] == ["a", "b"]
+    assert [api["name"] for api in load_catalog_slice(catalog, names=["b"], domains=["x"])] == ["b"]
@@ -0,0 +1,169 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("mcp")
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mcp_servers_generator import (  # noqa: E402
+    SERVER_CATALOG_RELOAD_HELPERS,
+    SERVER_RUNTIME_HELPERS,
+    SERVER_STREAMING_HELPERS,
+)
+
+
+@pytest.fixture
+def helpers():
+    """The runtime helpers as inject_runtime_helpers() puts them into a generated server."""
+    namespace = {"__name__": "telefonica_mcp_server"}
+    code = "\n\n".join((SERVER_RUNTIME_HELPERS, SERVER_CATALOG_RELOAD_HELPERS, SERVER_STREAMING_HELPERS))
+    exec(compile(code, "helpers", "exec"), namespace)
+    return namespace
+
+
+def run_catalog_call(helpers, api, arguments, shared_inputs=None):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"ok": True})
+
+    async def call():
+        helpers["_http_client"] = httpx.AsyncClient(base_url="https://backend.test",
+                                                   transport=httpx.MockTransport(handler))
+        try:
+            return await helpers["catalog_impl"](api, arguments, shared_inputs)
+        finally:
+            await helpers["_http_client"].aclose()
+
+    result = asyncio.run(call())
+    assert json.loads(result) == {"ok": True}
+    return requests[0]
+
+
+def test_catalog_arguments_are_routed_by_location(helpers):
+    api = {
+        "method": "POST",
+        "endpoint": "/customers/{customerId}/invoices",
+        "inputs": [
+            {"name": "customerId", "in": "path"},
+            {"name": "status", "in": "query"},
+            {"name": "X-Correlation-Id", "in": "header"},
+            {"name": "amount", "in": "body"},
+            "channel",
+        ],
+    }
+    shared_inputs = {"channel": {"name": "channel"}}
+
+    request = run_catalog_call(helpers, api, {
+        "customerId": "12 34", "status": "UNPAID", "X-Correlation-Id": "abc",
+        "amount": 10, "channel": "web", "fields": ["id"],
+    }, shared_inputs)
+
+    assert request.method == "POST"
+    assert request.url.raw_path.split(b"?")[0] == b"/customers/12%2034/invoices"
+    assert dict(request.url.params) == {"status": "UNPAID"}
+    assert request.headers["X-Correlation-Id"] == "abc"
+    assert json.loads(request.content) == {"amount": 10, "channel": "web"}
+
+
+def test_catalog_get_without_locations_uses_query(helpers):
+    api = {"method": "GET", "endpoint": "/invoices", "inputs": [{"name": "rut"}]}
+
+    request = run_catalog_call(helpers, api, {"rut": "1-9", "page": None})
+
+    assert dict(request.url.params) == {"rut": "1-9"}
+    assert request.content == b""
+
+
+def test_project_fields_keeps_requested_paths(helpers):
+    payload = json.dumps({
+        "implInvoiceLists": [{"totalAmount": 1, "name": "a", "dueDate": "2025-01-01"}, {"totalAmount": 2}],
+        "meta": {"page": 1, "size": 2},
+        "other": True,
+    }).encode("utf-8")
+
+    result = helpers["project_fields"](payload, ["implInvoiceLists.totalAmount", "meta"])
+
+    assert json.loads(result) == {"implInvoiceLists": [{"totalAmount": 1}, {"totalAmount": 2}],
+                                  "meta": {"page": 1, "size": 2}}
+    assert json.loads(helpers["project_fields"](payload, "meta.page,other")) == {"meta": {"page": 1}, "other": True}
+
+
+def test_project_fields_passes_unprojected_and_error_payloads_through(helpers):
+    error = b'{"error": "Not found", "details": {"status": 404}}'
+
+    assert helpers["project_fields"](b'{"a": 1, "b": 2}', None) == '{"a": 1, "b": 2}'
+    assert helpers["project_fields"](error, ["a"]) == error.decode("utf-8")
+    assert helpers["project_fields"](b"not json", ["a"]) == "not json"
+
+
+def test_run_batch_fans_out_concurrently_and_reports_each_item(helpers):
+    running, peak = 0, 0
+
+    async def impl(customerId):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if customerId == 2:
+            return json.dumps({"error": "Not found", "details": 404})
+        if customerId == 3:
+            raise ValueError("boom")
+        return json.dumps({"id": customerId, "extra": True}).encode("utf-8")
+
+    result = json.loads(asyncio.run(helpers["run_batch"](impl, [{"customerId": i} for i in range(1, 5)], ["id"])))
+
+    assert peak == 4
+    assert (result["total"], result["succeeded"], result["failed"]) == (4, 2, 2)
+    assert [entry.get("result") for entry in result["results"]] == [{"id": 1}, None, None, {"id": 4}]
+    assert result["results"][1]["details"] == 404
+    assert result["results"][2]["error"] == "boom"
+    assert [entry["input"] for entry in result["results"]] == [{"customerId": i} for i in range(1, 5)]
+
+
+def test_shared_quota_is_one_bucket_per_host_across_connections(helpers, tmp_path):
+    path = str(tmp_path / "quota.db")
+    quota = helpers["SharedQuota"](path, 10, 2)
+    other_process = helpers["SharedQuota"](path, 10, 2)
+
+    assert quota._take("apim.test") == 0
+    assert other_process._take("apim.test") == 0
+    wait = quota._take("apim.test")
+    assert 0 < wait <= 0.1
+    assert other_process._take("backend.test") == 0
+
+
+def test_conditional_cache_revalidates_and_detects_unchanged_data(helpers, tmp_path, monkeypatch):
+    validators = []
+
+    async def backend(self, request):
+        validators.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, request=request)
+        # A stream, like a real transport returns (content= would be read already)
+        return httpx.Response(200, headers={"ETag": '"v1"'}, stream=httpx.ByteStream(b'{"a":1}'), request=request)
+
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", backend)
+    transport = helpers["ConditionalCacheTransport"](str(tmp_path / "cache.db"))
+
+    async def poll_twice():
+        polls = []
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(2):
+                response = await client.get("https://backend.test/invoices")
+                polls.append((response.status_code, response.content, helpers["response_unchanged"]()))
+        return polls
+
+    assert asyncio.run(poll_twice()) == [(200, b'{"a":1}', False), (200, b'{"a":1}', True)]
+    assert validators == [None, '"v1"']